@@ -1 +1 @@
-from .attention import attention_forward
+from .attention import attention_forward, attention_forward_varlen, attention_forward_padded
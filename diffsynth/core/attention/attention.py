@@ -1,5 +1,6 @@
 import torch, os
 from einops import rearrange
+from .autotune import AttentionAutoTuner
 
 
 try:
@@ -20,6 +21,12 @@ try:
 except ModuleNotFoundError:
     SAGE_ATTN_AVAILABLE = False
 
+try:
+    from sageattention import sageattn_varlen
+    SAGE_ATTN_VARLEN_AVAILABLE = True
+except ImportError:
+    SAGE_ATTN_VARLEN_AVAILABLE = False
+
 try:
     import xformers.ops as xops
     XFORMERS_AVAILABLE = True
@@ -27,10 +34,15 @@ except ModuleNotFoundError:
     XFORMERS_AVAILABLE = False
 
 
-def initialize_attention_priority():
-    if os.environ.get('DIFFSYNTH_ATTENTION_IMPLEMENTATION') is not None:
-        return os.environ.get('DIFFSYNTH_ATTENTION_IMPLEMENTATION').lower()
-    elif FLASH_ATTN_3_AVAILABLE:
+try:
+    from torch.nn.attention import sdpa_kernel, SDPBackend
+    SDPA_KERNEL_AVAILABLE = True
+except ImportError:
+    SDPA_KERNEL_AVAILABLE = False
+
+
+def fetch_default_attention_implementation():
+    if FLASH_ATTN_3_AVAILABLE:
         return "flash_attention_3"
     elif FLASH_ATTN_2_AVAILABLE:
         return "flash_attention_2"
@@ -42,7 +54,17 @@ def initialize_attention_priority():
         return "torch"
 
 
+def initialize_attention_priority():
+    # "auto" selects the fastest implementation per shape, see `AttentionAutoTuner`.
+    if os.environ.get('DIFFSYNTH_ATTENTION_IMPLEMENTATION') is not None:
+        return os.environ.get('DIFFSYNTH_ATTENTION_IMPLEMENTATION').lower()
+    else:
+        return fetch_default_attention_implementation()
+
+
 ATTENTION_IMPLEMENTATION = initialize_attention_priority()
+ATTENTION_IMPLEMENTATION_SPECIFIED = os.environ.get('DIFFSYNTH_ATTENTION_IMPLEMENTATION') is not None
+DEFAULT_ATTENTION_IMPLEMENTATION = fetch_default_attention_implementation() if ATTENTION_IMPLEMENTATION == "auto" else ATTENTION_IMPLEMENTATION
 
 
 def rearrange_qkv(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", required_in_pattern="b n s d", dims=None):
@@ -105,17 +127,129 @@ def xformers_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_patt
     return out
 
 
-def attention_forward(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, attn_mask=None, scale=None, compatibility_mode=False):
+def torch_sdpa_math(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, scale=None):
+    with sdpa_kernel(SDPBackend.MATH):
+        return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
+
+
+def torch_sdpa_efficient(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, scale=None):
+    with sdpa_kernel(SDPBackend.EFFICIENT_ATTENTION):
+        return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
+
+
+def torch_sdpa_flash(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, scale=None):
+    with sdpa_kernel(SDPBackend.FLASH_ATTENTION):
+        return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
+
+
+def torch_sdpa_cudnn(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, scale=None):
+    with sdpa_kernel(SDPBackend.CUDNN_ATTENTION):
+        return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
+
+
+# name: (available, implementation)
+ATTENTION_BACKENDS = {
+    "flash_attention_3": (FLASH_ATTN_3_AVAILABLE, flash_attention_3),
+    "flash_attention_2": (FLASH_ATTN_2_AVAILABLE, flash_attention_2),
+    "sage_attention": (SAGE_ATTN_AVAILABLE, sage_attention),
+    "xformers": (XFORMERS_AVAILABLE, xformers_attention),
+    "torch": (True, torch_sdpa),
+    "torch_math": (SDPA_KERNEL_AVAILABLE, torch_sdpa_math),
+    "torch_efficient": (SDPA_KERNEL_AVAILABLE, torch_sdpa_efficient),
+    "torch_flash": (SDPA_KERNEL_AVAILABLE, torch_sdpa_flash),
+    "torch_cudnn": (SDPA_KERNEL_AVAILABLE, torch_sdpa_cudnn),
+}
+ATTENTION_AUTO_TUNER = AttentionAutoTuner() if ATTENTION_IMPLEMENTATION == "auto" else None
+
+
+def fetch_attention_candidates():
+    # Attention functions for the auto-tuner, taking and returning "b s n d" tensors.
+    def wrap(attention):
+        return lambda q, k, v, scale: attention(q, k, v, "b s n d", "b s n d", "b s n d", "b s n d", scale=scale)
+    return {name: wrap(attention) for name, (available, attention) in ATTENTION_BACKENDS.items() if available}
+
+
+# Built once, so that the auto-tuner only looks up its decisions on each call.
+ATTENTION_CANDIDATES = fetch_attention_candidates() if ATTENTION_IMPLEMENTATION == "auto" else None
+
+
+def select_attention_implementation(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, scale=None, implementation=None):
+    # q, k, v: (b, s, n, d)
+    if implementation is not None and not ATTENTION_IMPLEMENTATION_SPECIFIED:
+        return implementation
+    if ATTENTION_IMPLEMENTATION != "auto":
+        return ATTENTION_IMPLEMENTATION
+    if q.device.type != "cuda" or torch.compiler.is_compiling() or torch.cuda.is_current_stream_capturing():
+        # Benchmarking is not possible during compilation or graph capture.
+        return DEFAULT_ATTENTION_IMPLEMENTATION
+    return ATTENTION_AUTO_TUNER.fetch(q, k, v, ATTENTION_CANDIDATES, ATTENTION_CANDIDATES["torch"], scale=scale)
+
+
+def attention_forward(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, attn_mask=None, scale=None, compatibility_mode=False, implementation=None):
+    # implementation: the implementation used by this call site unless `DIFFSYNTH_ATTENTION_IMPLEMENTATION` is set.
     if compatibility_mode or (attn_mask is not None):
         return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, attn_mask=attn_mask, scale=scale)
+    # Rearranging to "b s n d" only creates views, and the implementations requiring "b n s d" rearrange them back.
+    q, k, v = rearrange_qkv(q, k, v, q_pattern, k_pattern, v_pattern, "b s n d", dims)
+    implementation = select_attention_implementation(q, k, v, scale=scale, implementation=implementation)
+    _, attention = ATTENTION_BACKENDS.get(implementation, ATTENTION_BACKENDS["torch"])
+    return attention(q, k, v, "b s n d", "b s n d", "b s n d", out_pattern, dims, scale=scale)
+
+
+def fetch_cu_seqlens(seqlens, device=None):
+    seqlens = torch.as_tensor(seqlens, dtype=torch.int32, device=device)
+    return torch.nn.functional.pad(torch.cumsum(seqlens, dim=0, dtype=torch.int32), (1, 0))
+
+
+def torch_sdpa_varlen(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, cu_seqlens_q: torch.Tensor, cu_seqlens_k: torch.Tensor, scale=None):
+    # Packed SDPA: each sequence is computed separately, so no FLOPs are spent on padding tokens.
+    cu_seqlens_q, cu_seqlens_k = cu_seqlens_q.tolist(), cu_seqlens_k.tolist()
+    out = torch.empty_like(q)
+    for i in range(len(cu_seqlens_q) - 1):
+        q_slice, k_slice = slice(cu_seqlens_q[i], cu_seqlens_q[i + 1]), slice(cu_seqlens_k[i], cu_seqlens_k[i + 1])
+        q_i, k_i, v_i = q[q_slice].transpose(0, 1), k[k_slice].transpose(0, 1), v[k_slice].transpose(0, 1)
+        out[q_slice] = torch.nn.functional.scaled_dot_product_attention(q_i, k_i, v_i, scale=scale).transpose(0, 1)
+    return out
+
+
+def xformers_attention_varlen(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, cu_seqlens_q: torch.Tensor, cu_seqlens_k: torch.Tensor, scale=None):
+    seqlens_q = (cu_seqlens_q[1:] - cu_seqlens_q[:-1]).tolist()
+    seqlens_k = (cu_seqlens_k[1:] - cu_seqlens_k[:-1]).tolist()
+    attn_bias = xops.fmha.attn_bias.BlockDiagonalMask.from_seqlens(seqlens_q, seqlens_k)
+    out = xops.memory_efficient_attention(q.unsqueeze(0), k.unsqueeze(0), v.unsqueeze(0), attn_bias=attn_bias, scale=scale)
+    return out.squeeze(0)
+
+
+def attention_forward_varlen(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, cu_seqlens_q: torch.Tensor, cu_seqlens_k: torch.Tensor, max_seqlen_q: int, max_seqlen_k: int, scale=None, compatibility_mode=False):
+    # q, k, v: packed sequences in the pattern "s n d", where sequence i is `[cu_seqlens[i], cu_seqlens[i+1])`.
+    # max_seqlen_q and max_seqlen_k can be upper bounds.
+    if compatibility_mode or q.device.type == "cpu":
+        return torch_sdpa_varlen(q, k, v, cu_seqlens_q, cu_seqlens_k, scale=scale)
+    elif DEFAULT_ATTENTION_IMPLEMENTATION == "flash_attention_3":
+        out = flash_attn_interface.flash_attn_varlen_func(q, k, v, cu_seqlens_q, cu_seqlens_k, max_seqlen_q, max_seqlen_k, softmax_scale=scale)
+        return out[0] if isinstance(out, tuple) else out
+    elif DEFAULT_ATTENTION_IMPLEMENTATION == "flash_attention_2":
+        return flash_attn.flash_attn_varlen_func(q, k, v, cu_seqlens_q, cu_seqlens_k, max_seqlen_q, max_seqlen_k, softmax_scale=scale)
+    elif DEFAULT_ATTENTION_IMPLEMENTATION == "sage_attention" and SAGE_ATTN_VARLEN_AVAILABLE:
+        return sageattn_varlen(q, k, v, cu_seqlens_q, cu_seqlens_k, max_seqlen_q, max_seqlen_k, sm_scale=scale)
+    elif DEFAULT_ATTENTION_IMPLEMENTATION == "xformers":
+        return xformers_attention_varlen(q, k, v, cu_seqlens_q, cu_seqlens_k, scale=scale)
     else:
-        if ATTENTION_IMPLEMENTATION == "flash_attention_3":
-            return flash_attention_3(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
-        elif ATTENTION_IMPLEMENTATION == "flash_attention_2":
-            return flash_attention_2(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
-        elif ATTENTION_IMPLEMENTATION == "sage_attention":
-            return sage_attention(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
-        elif ATTENTION_IMPLEMENTATION == "xformers":
-            return xformers_attention(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
-        else:
-            return torch_sdpa(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale)
+        return torch_sdpa_varlen(q, k, v, cu_seqlens_q, cu_seqlens_k, scale=scale)
+
+
+def attention_forward_padded(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, padding_mask: torch.Tensor, q_pattern="b n s d", k_pattern="b n s d", v_pattern="b n s d", out_pattern="b n s d", dims=None, scale=None, compatibility_mode=False):
+    # Self-attention on a padded batch. padding_mask: bool tensor (b, s), True for valid tokens.
+    # The valid tokens are packed and computed by `attention_forward_varlen` instead of masked dense attention.
+    if bool(padding_mask.all()):
+        return attention_forward(q, k, v, q_pattern, k_pattern, v_pattern, out_pattern, dims, scale=scale, compatibility_mode=compatibility_mode)
+    required_in_pattern, required_out_pattern = "b s n d", "b s n d"
+    q, k, v = rearrange_qkv(q, k, v, q_pattern, k_pattern, v_pattern, required_in_pattern, dims)
+    seqlens = padding_mask.sum(dim=1, dtype=torch.int32)
+    cu_seqlens = fetch_cu_seqlens(seqlens, device=q.device)
+    max_seqlen = padding_mask.shape[1]
+    out_packed = attention_forward_varlen(q[padding_mask], k[padding_mask], v[padding_mask], cu_seqlens, cu_seqlens, max_seqlen, max_seqlen, scale=scale, compatibility_mode=compatibility_mode)
+    out = torch.zeros_like(q)
+    out[padding_mask] = out_packed
+    out = rearrange_out(out, out_pattern, required_out_pattern, dims)
+    return out
@@ -0,0 +1,104 @@
+import torch, os, json, math
+
+
+class AttentionAutoTuner:
+    # Selects the fastest attention implementation for each (device, dtype, head_dim, seq_len bucket).
+    # The decisions are benchmarked on the first call of each bucket and persisted on disk, so that later runs skip the benchmark.
+
+    def __init__(self, cache_path=None, num_warmup=2, num_repeats=5, tolerance=0.05):
+        if cache_path is None:
+            if os.environ.get('DIFFSYNTH_ATTENTION_AUTOTUNE_PATH') is not None:
+                cache_path = os.environ.get('DIFFSYNTH_ATTENTION_AUTOTUNE_PATH')
+            else:
+                cache_path = os.path.join(os.path.expanduser("~"), ".cache", "diffsynth", "attention_autotune.json")
+        # An empty path disables the persistence.
+        self.cache_path = cache_path if cache_path != "" else None
+        self.num_warmup = num_warmup
+        self.num_repeats = num_repeats
+        self.tolerance = tolerance
+        self.decisions = {}
+        # In-memory decisions keyed by tuples, so that each call only costs a dict lookup.
+        self.cached_decisions = {}
+        self.load()
+
+    def load(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self.decisions = json.load(f).get("decisions", {})
+        except (OSError, ValueError):
+            self.decisions = {}
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        try:
+            # Merge with the decisions written by other processes, then replace the file atomically.
+            decisions = self.decisions
+            self.load()
+            self.decisions.update(decisions)
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"decisions": self.decisions}, f, indent=4)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Cannot save the attention auto-tuning decisions to {self.cache_path}: {e}")
+
+    @staticmethod
+    def fetch_seq_len_bucket(seq_len):
+        return 2 ** math.ceil(math.log2(max(seq_len, 1)))
+
+    def build_key(self, q, k):
+        # q, k: (b, s, n, d)
+        return (q.device, q.dtype, q.shape[-1], self.fetch_seq_len_bucket(q.shape[1]), self.fetch_seq_len_bucket(k.shape[1]))
+
+    def build_persistent_key(self, key, candidates):
+        device, dtype, head_dim, seq_len_q, seq_len_k = key
+        device_name = torch.cuda.get_device_name(device) if device.type == "cuda" else device.type
+        return json.dumps([device_name, torch.__version__, str(dtype), head_dim, seq_len_q, seq_len_k, sorted(candidates)])
+
+    def benchmark(self, q, k, v, candidates, reference, scale=None):
+        # candidates: {name: attention function taking "b s n d" inputs}
+        # Implementations whose outputs deviate from the reference by more than `tolerance` are rejected.
+        with torch.no_grad():
+            q, k, v = q.detach(), k.detach(), v.detach()
+            out_ref = reference(q, k, v, scale)
+            ref_norm = out_ref.float().abs().mean().clamp(min=1e-6)
+            timing = {}
+            for name, attention in candidates.items():
+                try:
+                    out = attention(q, k, v, scale)
+                    error = ((out.float() - out_ref.float()).abs().mean() / ref_norm).item()
+                    if not math.isfinite(error) or error > self.tolerance:
+                        continue
+                    for _ in range(self.num_warmup):
+                        attention(q, k, v, scale)
+                    start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+                    start.record()
+                    for _ in range(self.num_repeats):
+                        attention(q, k, v, scale)
+                    end.record()
+                    end.synchronize()
+                    timing[name] = start.elapsed_time(end) / self.num_repeats
+                except (RuntimeError, ValueError, TypeError, NotImplementedError):
+                    # The implementation does not support this dtype, head_dim or device.
+                    continue
+        return timing
+
+    def fetch(self, q, k, v, candidates, reference, scale=None):
+        key = self.build_key(q, k)
+        name = self.cached_decisions.get(key)
+        if name is not None:
+            return name
+        persistent_key = self.build_persistent_key(key, candidates)
+        name = self.decisions.get(persistent_key)
+        if name is None or name not in candidates:
+            timing = self.benchmark(q, k, v, candidates, reference, scale=scale)
+            name = min(timing, key=timing.get) if len(timing) > 0 else "torch"
+            print(f"Attention auto-tuning: {persistent_key} -> {name} ({', '.join(f'{i}: {t:.3f}ms' for i, t in timing.items())})")
+            self.decisions[persistent_key] = name
+            self.save()
+        self.cached_decisions[key] = name
+        return name
@@ -1 +1,3 @@
 from .unified_dataset import UnifiedDataset
+from .latent_cache import LatentCacheWriter, LatentCacheReader
+from .sampler import BucketBatchSampler
@@ -0,0 +1,117 @@
+from safetensors.torch import save_file
+import torch, os, json, mmap, pickle
+from ..loader.file import read_safetensors_header, SAFETENSORS_DTYPES
+
+
+class LatentCacheWriter:
+    # Writes the preprocessed samples into safetensors shards and an index `index.json`.
+    # Each entry of the index records the shard, the nested structure (`inputs_shared`, `inputs_posi`, `inputs_nega`) and the tensor offsets of a sample.
+
+    def __init__(self, path, shard_size=1e9):
+        self.path = path
+        self.shard_size = shard_size
+        self.samples = []
+        self.pending_samples = []
+        self.pending_tensors = {}
+        self.pending_bytes = 0
+        self.num_shards = 0
+        os.makedirs(path, exist_ok=True)
+
+    def flatten(self, value, name, tensors):
+        if isinstance(value, torch.Tensor):
+            tensors[name] = value.detach().to(device="cpu", copy=True).contiguous()
+            return {"type": "tensor", "name": name}
+        elif isinstance(value, (list, tuple)):
+            return {"type": type(value).__name__, "items": [self.flatten(v, f"{name}.{i}", tensors) for i, v in enumerate(value)]}
+        elif isinstance(value, dict) and all(isinstance(k, str) for k in value):
+            return {"type": "dict", "items": {k: self.flatten(v, f"{name}.{k}", tensors) for k, v in value.items()}}
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            return {"type": "value", "value": value}
+        else:
+            # Other objects (e.g., `torch.device`) are pickled into uint8 tensors.
+            tensors[name] = torch.frombuffer(bytearray(pickle.dumps(value)), dtype=torch.uint8)
+            return {"type": "pickle", "name": name}
+
+    def write(self, data):
+        tensors = {}
+        structure = self.flatten(data, str(len(self.samples) + len(self.pending_samples)), tensors)
+        self.pending_samples.append({"structure": structure, "tensors": list(tensors.keys())})
+        self.pending_tensors.update(tensors)
+        self.pending_bytes += sum(tensor.numel() * tensor.element_size() for tensor in tensors.values())
+        if self.pending_bytes >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending_samples) == 0:
+            return
+        shard_name = f"shard-{self.num_shards:05d}.safetensors"
+        self.num_shards += 1
+        shard_path = os.path.join(self.path, shard_name)
+        save_file(self.pending_tensors, shard_path)
+        header = read_safetensors_header(shard_path)
+        for sample in self.pending_samples:
+            sample["shard"] = shard_name
+            sample["tensors"] = {name: header[name] for name in sample["tensors"]}
+        self.samples.extend(self.pending_samples)
+        self.pending_samples, self.pending_tensors, self.pending_bytes = [], {}, 0
+        # The index is updated after each shard, so that an interrupted job leaves a usable cache.
+        tmp_path = os.path.join(self.path, f"index.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format": "latent_cache", "version": 1, "samples": self.samples}, f)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+
+    def close(self):
+        self.flush()
+
+
+class LatentCacheReader:
+    # Reads the samples written by `LatentCacheWriter`.
+    # Shards are memory-mapped and tensors are views of the mapped pages, so no data is copied or unpickled.
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            self.samples = json.load(f)["samples"]
+
+    @staticmethod
+    def is_latent_cache(path):
+        return os.path.exists(os.path.join(path, "index.json"))
+
+    def map_shard(self, shard_name):
+        # Each sample gets its own copy-on-write mapping, which shares the page cache with other mappings.
+        # Thus in-place operations on the tensors neither modify the file nor leak into other samples.
+        with open(os.path.join(self.path, shard_name), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    def unflatten(self, structure, tensors):
+        if structure["type"] == "tensor":
+            return tensors[structure["name"]]
+        elif structure["type"] == "pickle":
+            return pickle.loads(tensors[structure["name"]].numpy().tobytes())
+        elif structure["type"] in ("list", "tuple"):
+            items = [self.unflatten(i, tensors) for i in structure["items"]]
+            return tuple(items) if structure["type"] == "tuple" else items
+        elif structure["type"] == "dict":
+            return {k: self.unflatten(v, tensors) for k, v in structure["items"].items()}
+        else:
+            return structure["value"]
+
+    def fetch_tensor_shapes(self, sample_id):
+        # Tensor names are prefixed with the sample id, which is removed here.
+        tensors = self.samples[sample_id]["tensors"]
+        return {name[name.find(".") + 1:]: shape for name, (_, shape, _, _) in tensors.items()}
+
+    def __getitem__(self, sample_id):
+        sample = self.samples[sample_id]
+        shard = self.map_shard(sample["shard"])
+        tensors = {}
+        for name, (dtype, shape, begin, end) in sample["tensors"].items():
+            dtype = SAFETENSORS_DTYPES[dtype]
+            if end > begin:
+                tensors[name] = torch.frombuffer(shard, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=begin).reshape(shape)
+            else:
+                tensors[name] = torch.empty(shape, dtype=dtype)
+        return self.unflatten(sample["structure"], tensors)
+
+    def __len__(self):
+        return len(self.samples)
@@ -1,4 +1,4 @@
-import torch, torchvision, imageio, os
+import torch, torchvision, imageio, os, math
 import imageio.v3 as iio
 from PIL import Image
 import numpy as np
@@ -85,8 +85,11 @@ class ImageCropAndResize(DataProcessingOperator):
         return image
     
     def get_height_width(self, image):
+        width, height = image.size
+        return self.get_target_height_width(height, width)
+    
+    def get_target_height_width(self, height, width):
         if self.height is None or self.width is None:
-            width, height = image.size
             if width * height > self.max_pixels:
                 scale = (width * height / self.max_pixels) ** 0.5
                 height, width = int(height / scale), int(width / scale)
@@ -100,6 +103,20 @@ class ImageCropAndResize(DataProcessingOperator):
         image = self.crop_and_resize(data, *self.get_height_width(data))
         return image
 
+    def crop_and_resize_batch(self, frames: torch.Tensor):
+        # frames: uint8 tensor (T, C, H, W). Frames are resized together without PIL conversion.
+        height, width = frames.shape[-2:]
+        target_height, target_width = self.get_target_height_width(height, width)
+        scale = max(target_width / width, target_height / height)
+        frames = torchvision.transforms.functional.resize(
+            frames,
+            (round(height*scale), round(width*scale)),
+            interpolation=torchvision.transforms.InterpolationMode.BILINEAR,
+            antialias=True,
+        )
+        frames = torchvision.transforms.functional.center_crop(frames, (target_height, target_width))
+        return frames
+
 
 class ToList(DataProcessingOperator):
     def __call__(self, data):
@@ -134,6 +151,109 @@ class LoadVideo(DataProcessingOperator):
         reader.close()
         return frames
 
+
+class LoadVideoStream(DataProcessingOperator):
+    # A streaming version of `LoadVideo`.
+    # The number of frames is read from the container metadata instead of being counted by decoding,
+    # frames are decoded sequentially and only up to the last sampled frame,
+    # and `frame_processor` is applied to batches of uint8 tensors if it supports `crop_and_resize_batch`.
+    # output_type: "numpy" (uint8, T H W C), "tensor" (uint8, T C H W) or "pil" (list of images).
+    def __init__(
+        self,
+        num_frames=81, time_division_factor=4, time_division_remainder=1,
+        frame_stride=1, frame_offset=0,
+        frame_processor=None, batch_size=16, output_type="numpy",
+    ):
+        self.num_frames = num_frames
+        self.time_division_factor = time_division_factor
+        self.time_division_remainder = time_division_remainder
+        self.frame_stride = frame_stride
+        self.frame_offset = frame_offset
+        self.frame_processor = frame_processor
+        self.batch_size = batch_size
+        self.output_type = output_type
+        
+    def get_num_frames(self, num_available_frames):
+        num_frames = self.num_frames
+        if num_available_frames < num_frames:
+            num_frames = num_available_frames
+            while num_frames > 1 and num_frames % self.time_division_factor != self.time_division_remainder:
+                num_frames -= 1
+        return num_frames
+    
+    def get_num_available_frames(self, reader):
+        meta_data = reader.get_meta_data()
+        num_container_frames = meta_data.get("nframes", float("inf"))
+        if not math.isfinite(num_container_frames) and "fps" in meta_data and "duration" in meta_data:
+            num_container_frames = round(meta_data["fps"] * meta_data["duration"])
+        if not math.isfinite(num_container_frames):
+            return num_container_frames
+        return max(math.ceil((num_container_frames - self.frame_offset) / self.frame_stride), 0)
+    
+    def process_batch(self, batch):
+        frames = torch.from_numpy(np.stack(batch)).permute(0, 3, 1, 2)
+        if self.frame_processor is None:
+            return frames
+        elif hasattr(self.frame_processor, "crop_and_resize_batch"):
+            return self.frame_processor.crop_and_resize_batch(frames)
+        else:
+            frames = [self.frame_processor(Image.fromarray(frame)) for frame in batch]
+            return torch.from_numpy(np.stack([np.asarray(frame) for frame in frames])).permute(0, 3, 1, 2)
+        
+    def __call__(self, data: str):
+        reader = imageio.get_reader(data)
+        num_frames = self.get_num_frames(self.get_num_available_frames(reader))
+        last_frame_id = self.frame_offset + (num_frames - 1) * self.frame_stride
+        frames, batch = [], []
+        for frame_id, frame in enumerate(reader):
+            if frame_id > last_frame_id:
+                break
+            if frame_id >= self.frame_offset and (frame_id - self.frame_offset) % self.frame_stride == 0:
+                batch.append(frame)
+                if len(batch) == self.batch_size:
+                    frames.append(self.process_batch(batch))
+                    batch = []
+        reader.close()
+        if len(batch) > 0:
+            frames.append(self.process_batch(batch))
+        if len(frames) == 0:
+            raise ValueError(f"No frames are loaded from {data} (frame_offset={self.frame_offset}, frame_stride={self.frame_stride}).")
+        frames = torch.concat(frames, dim=0)
+        # The container metadata may overestimate the number of frames.
+        frames = frames[:self.get_num_frames(frames.shape[0])]
+        if self.output_type == "tensor":
+            return frames
+        frames = frames.permute(0, 2, 3, 1).contiguous().numpy()
+        if self.output_type == "pil":
+            return [Image.fromarray(frame) for frame in frames]
+        return frames
+
+
+class FetchTargetShape(DataProcessingOperator):
+    # Computes the (height, width, num_frames) produced by the loaders, using only the file header or the container metadata.
+    # It is used as the bucket key of `BucketBatchSampler`.
+    def __init__(self, frame_processor=None, frame_loader=None):
+        self.frame_processor = frame_processor
+        # frame_loader (`LoadVideoStream`) computes the number of frames. Videos are treated as single images if it is None.
+        self.frame_loader = frame_loader
+        
+    def __call__(self, data: str):
+        file_ext_name = data.split(".")[-1].lower()
+        if file_ext_name in ("jpg", "jpeg", "png", "webp", "gif"):
+            with Image.open(data) as image:
+                width, height = image.size
+                num_available_frames = getattr(image, "n_frames", 1)
+        else:
+            reader = imageio.get_reader(data)
+            width, height = reader.get_meta_data()["size"]
+            num_available_frames = 1 if self.frame_loader is None else self.frame_loader.get_num_available_frames(reader)
+            reader.close()
+        if self.frame_processor is not None:
+            height, width = self.frame_processor.get_target_height_width(height, width)
+        num_frames = 1 if self.frame_loader is None else self.frame_loader.get_num_frames(num_available_frames)
+        return height, width, num_frames
+
+
 class LoadNumpy(DataProcessingOperator):
     def __call__(self, data: str):
         npy_data = np.load(data)
@@ -0,0 +1,44 @@
+from tqdm import tqdm
+import torch
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    # Groups the samples with the same bucket key (e.g., target height, width and number of frames) into batches.
+    # The batches are shuffled with a seed that depends on the epoch, so all processes produce the same batches.
+    def __init__(self, dataset, batch_size=1, shuffle=True, drop_last=False, seed=0):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        num_samples = len(dataset) // dataset.repeat
+        self.bucket_keys = [dataset.fetch_bucket_key(data_id) for data_id in tqdm(range(num_samples), desc="Bucketing")]
+        print(f"{len(set(self.bucket_keys))} buckets found.")
+        
+    def build_buckets(self):
+        buckets = {}
+        for data_id in range(len(self.dataset)):
+            buckets.setdefault(self.bucket_keys[data_id % len(self.bucket_keys)], []).append(data_id)
+        return list(buckets.values())
+    
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        batches = []
+        for data_ids in self.build_buckets():
+            if self.shuffle:
+                data_ids = [data_ids[i] for i in torch.randperm(len(data_ids), generator=generator).tolist()]
+            for i in range(0, len(data_ids), self.batch_size):
+                batch = data_ids[i: i + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator).tolist()]
+        return iter(batches)
+    
+    def __len__(self):
+        if self.drop_last:
+            return sum(len(data_ids) // self.batch_size for data_ids in self.build_buckets())
+        else:
+            return sum((len(data_ids) + self.batch_size - 1) // self.batch_size for data_ids in self.build_buckets())
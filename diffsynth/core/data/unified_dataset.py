@@ -1,4 +1,5 @@
 from .operators import *
+from .latent_cache import LatentCacheReader
 import torch, json, pandas
 
 
@@ -10,6 +11,8 @@ class UnifiedDataset(torch.utils.data.Dataset):
         data_file_keys=tuple(),
         main_data_operator=lambda x: x,
         special_operator_map=None,
+        bucket_operator=None,
+        special_bucket_operator_map=None,
     ):
         self.base_path = base_path
         self.metadata_path = metadata_path
@@ -18,6 +21,9 @@ class UnifiedDataset(torch.utils.data.Dataset):
         self.main_data_operator = main_data_operator
         self.cached_data_operator = LoadTorchPickle()
         self.special_operator_map = {} if special_operator_map is None else special_operator_map
+        # bucket_operator computes the target shape of a data file, which is used by `BucketBatchSampler`.
+        self.bucket_operator = bucket_operator
+        self.special_bucket_operator_map = {} if special_bucket_operator_map is None else special_bucket_operator_map
         self.data = []
         self.cached_data = []
         self.load_from_cache = metadata_path is None
@@ -48,14 +54,44 @@ class UnifiedDataset(torch.utils.data.Dataset):
                     num_frames, time_division_factor, time_division_remainder,
                     frame_processor=ImageCropAndResize(height, width, max_pixels, height_division_factor, width_division_factor),
                 )),
-                (("mp4", "avi", "mov", "wmv", "mkv", "flv", "webm"), LoadVideo(
+                (("mp4", "avi", "mov", "wmv", "mkv", "flv", "webm"), LoadVideoStream(
                     num_frames, time_division_factor, time_division_remainder,
                     frame_processor=ImageCropAndResize(height, width, max_pixels, height_division_factor, width_division_factor),
+                    output_type="pil",
                 )),
             ])),
         ])
         
+    @staticmethod
+    def default_image_bucket_operator(
+        base_path="",
+        max_pixels=1920*1080, height=None, width=None,
+        height_division_factor=16, width_division_factor=16,
+    ):
+        return RouteByType(operator_map=[
+            (str, ToAbsolutePath(base_path) >> FetchTargetShape(ImageCropAndResize(height, width, max_pixels, height_division_factor, width_division_factor))),
+            (list, SequencialProcess(ToAbsolutePath(base_path) >> FetchTargetShape(ImageCropAndResize(height, width, max_pixels, height_division_factor, width_division_factor)))),
+        ])
+    
+    @staticmethod
+    def default_video_bucket_operator(
+        base_path="",
+        max_pixels=1920*1080, height=None, width=None,
+        height_division_factor=16, width_division_factor=16,
+        num_frames=81, time_division_factor=4, time_division_remainder=1,
+    ):
+        return RouteByType(operator_map=[
+            (str, ToAbsolutePath(base_path) >> FetchTargetShape(
+                ImageCropAndResize(height, width, max_pixels, height_division_factor, width_division_factor),
+                LoadVideoStream(num_frames, time_division_factor, time_division_remainder),
+            )),
+        ])
+        
     def search_for_cached_data_files(self, path):
+        if LatentCacheReader.is_latent_cache(path):
+            reader = LatentCacheReader(path)
+            self.cached_data.extend((reader, sample_id) for sample_id in range(len(reader)))
+            return
         for file_name in os.listdir(path):
             subpath = os.path.join(path, file_name)
             if os.path.isdir(subpath):
@@ -85,7 +121,11 @@ class UnifiedDataset(torch.utils.data.Dataset):
     def __getitem__(self, data_id):
         if self.load_from_cache:
             data = self.cached_data[data_id % len(self.cached_data)]
-            data = self.cached_data_operator(data)
+            if isinstance(data, tuple):
+                reader, sample_id = data
+                data = reader[sample_id]
+            else:
+                data = self.cached_data_operator(data)
         else:
             data = self.data[data_id % len(self.data)].copy()
             for key in self.data_file_keys:
@@ -96,6 +136,41 @@ class UnifiedDataset(torch.utils.data.Dataset):
                         data[key] = self.main_data_operator(data[key])
         return data
 
+    def fetch_bucket_key(self, data_id):
+        # Samples with the same bucket key can be stacked into a batch.
+        if self.load_from_cache:
+            data = self.cached_data[data_id % len(self.cached_data)]
+            if isinstance(data, tuple):
+                reader, sample_id = data
+                return str(reader.fetch_tensor_shapes(sample_id))
+            else:
+                data = self.cached_data_operator(data)
+                return str(self.fetch_tensor_shapes(data))
+        else:
+            if self.bucket_operator is None:
+                raise ValueError("`bucket_operator` is required to group the samples into buckets.")
+            data = self.data[data_id % len(self.data)]
+            bucket_key = []
+            for key in self.data_file_keys:
+                if key in data:
+                    if key in self.special_bucket_operator_map:
+                        bucket_key.append((key, self.special_bucket_operator_map[key](data[key])))
+                    elif key not in self.special_operator_map:
+                        bucket_key.append((key, self.bucket_operator(data[key])))
+            return str(bucket_key)
+        
+    def fetch_tensor_shapes(self, data, name=""):
+        if isinstance(data, torch.Tensor):
+            return {name: list(data.shape)}
+        shapes, prefix = {}, f"{name}." if name else ""
+        if isinstance(data, (list, tuple)):
+            for i, value in enumerate(data):
+                shapes.update(self.fetch_tensor_shapes(value, f"{prefix}{i}"))
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                shapes.update(self.fetch_tensor_shapes(value, f"{prefix}{key}"))
+        return shapes
+
     def __len__(self):
         if self.load_from_cache:
             return len(self.cached_data) * self.repeat
@@ -1,3 +1,6 @@
 from .file import load_state_dict, hash_state_dict_keys, hash_model_file
+from .fingerprint import ModelFingerprintIndex
+from .conversion import SafetensorsConversionCache, convert_to_safetensors
+from .parallel import ParallelStateDictLoader
 from .model import load_model, load_model_with_disk_offload
 from .config import ModelConfig
@@ -0,0 +1,147 @@
+from safetensors.torch import save_file
+import torch, os, json, glob, shutil, hashlib
+from .file import load_state_dict_from_bin
+
+
+class SafetensorsConversionCache:
+    # Converts legacy checkpoints (`.pth`, `.bin`, ...) into safetensors shards once, so that they are memory-mapped afterwards.
+    # The converted shards are addressed by the SHA-256 of the source file, so identical files downloaded to different paths share them.
+    # The digests are indexed by (path, size, modification time, inode), so unchanged files are not hashed again.
+
+    def __init__(self, cache_dir=None, shard_size=5 * 10**9):
+        if cache_dir is None:
+            if os.environ.get('DIFFSYNTH_CONVERSION_CACHE_DIR') is not None:
+                cache_dir = os.environ.get('DIFFSYNTH_CONVERSION_CACHE_DIR')
+            else:
+                cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "diffsynth", "converted_safetensors")
+        # An empty path disables the conversion.
+        self.cache_dir = cache_dir if cache_dir != "" else None
+        self.shard_size = shard_size
+        self.index_path = os.path.join(self.cache_dir, "index.json") if self.cache_dir is not None else None
+        self.files = {}
+        self.load()
+
+    def load(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        # Merge with the entries written by other processes, then replace the file atomically.
+        files = self.files
+        self.load()
+        self.files.update(files)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def fetch_file_signature(file_path):
+        stat = os.stat(file_path)
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    @staticmethod
+    def hash_file(file_path, chunk_size=2**24):
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if len(chunk) == 0:
+                    break
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def fetch_digest(self, file_path):
+        signature = self.fetch_file_signature(file_path)
+        entry = self.files.get(file_path)
+        if entry is not None and entry["signature"] == signature:
+            return entry["digest"]
+        digest = self.hash_file(file_path)
+        self.files[file_path] = {"signature": signature, "digest": digest}
+        return digest
+
+    def fetch_shard_paths(self, digest):
+        return sorted(glob.glob(os.path.join(self.cache_dir, digest, "*.safetensors")))
+
+    def load_source(self, file_path):
+        # The tensors are memory-mapped if the checkpoint is saved in the zip format, so that the whole pickle is not held in memory.
+        try:
+            return load_state_dict_from_bin(file_path, mmap=True)
+        except RuntimeError:
+            return load_state_dict_from_bin(file_path)
+
+    def write_shards(self, state_dict, output_dir):
+        shards, shard, shard_bytes = [], {}, 0
+        for name, tensor in state_dict.items():
+            num_bytes = tensor.numel() * tensor.element_size()
+            if len(shard) > 0 and shard_bytes + num_bytes > self.shard_size:
+                shards.append(shard)
+                shard, shard_bytes = {}, 0
+            shard[name] = tensor
+            shard_bytes += num_bytes
+        shards.append(shard)
+        for shard_id, shard in enumerate(shards):
+            # Safetensors cannot store tensors sharing memory, e.g., tied weights.
+            storages = set()
+            for name, tensor in shard.items():
+                storage = tensor.untyped_storage().data_ptr()
+                if storage in storages or not tensor.is_contiguous():
+                    shard[name] = tensor.clone(memory_format=torch.contiguous_format)
+                storages.add(storage)
+            save_file(shard, os.path.join(output_dir, f"model-{shard_id + 1:05d}-of-{len(shards):05d}.safetensors"))
+
+    def convert(self, file_path, digest):
+        state_dict = self.load_source(file_path)
+        if not all(isinstance(name, str) and isinstance(tensor, torch.Tensor) for name, tensor in state_dict.items()):
+            # Nested checkpoints cannot be stored as safetensors.
+            return None
+        print(f"Converting {file_path} into safetensors. It is converted only once.")
+        output_dir = os.path.join(self.cache_dir, digest)
+        tmp_dir = f"{output_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            self.write_shards(state_dict, tmp_dir)
+            try:
+                os.rename(tmp_dir, output_dir)
+            except OSError:
+                # The file has been converted by another process.
+                if len(self.fetch_shard_paths(digest)) == 0:
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return self.fetch_shard_paths(digest)
+
+    def fetch(self, file_path):
+        # Returns the safetensors files containing the tensors of `file_path`.
+        if self.cache_dir is None or file_path.endswith(".safetensors"):
+            return [file_path]
+        file_path = os.path.abspath(file_path)
+        try:
+            digest = self.fetch_digest(file_path)
+            if not self.files[file_path].get("convertible", True):
+                return [file_path]
+            shard_paths = self.fetch_shard_paths(digest)
+            if len(shard_paths) == 0:
+                shard_paths = self.convert(file_path, digest)
+            if shard_paths is None:
+                self.files[file_path]["convertible"] = False
+            self.save()
+        except OSError as e:
+            print(f"Cannot convert {file_path} into safetensors: {e}")
+            return [file_path]
+        return [file_path] if shard_paths is None else shard_paths
+
+
+def convert_to_safetensors(path, cache_dir=None):
+    # path: a file or a list of files. Returns a list of files, in which legacy checkpoints are replaced by the converted safetensors shards.
+    paths = path if isinstance(path, list) else [path]
+    if all(path_.endswith(".safetensors") for path_ in paths):
+        return paths
+    cache = SafetensorsConversionCache(cache_dir=cache_dir)
+    return [shard_path for path_ in paths for shard_path in cache.fetch(path_)]
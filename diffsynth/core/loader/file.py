@@ -1,5 +1,21 @@
 from safetensors import safe_open
-import torch, hashlib
+import torch, hashlib, mmap, struct, json
+
+
+SAFETENSORS_DTYPES = {
+    "BOOL": torch.bool, "U8": torch.uint8, "I8": torch.int8, "I16": torch.int16, "I32": torch.int32, "I64": torch.int64,
+    "F16": torch.float16, "BF16": torch.bfloat16, "F32": torch.float32, "F64": torch.float64,
+    "F8_E4M3": torch.float8_e4m3fn, "F8_E5M2": torch.float8_e5m2,
+}
+
+
+def read_safetensors_header(file_path):
+    # Returns {name: (dtype, shape, begin, end)}, where begin and end are absolute offsets in the file.
+    with open(file_path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return {name: (info["dtype"], info["shape"], info["data_offsets"][0] + 8 + header_size, info["data_offsets"][1] + 8 + header_size) for name, info in header.items()}
 
 
 def load_state_dict(file_path, torch_dtype=None, device="cpu"):
@@ -10,8 +26,12 @@ def load_state_dict(file_path, torch_dtype=None, device="cpu"):
         return state_dict
     if file_path.endswith(".safetensors"):
         return load_state_dict_from_safetensors(file_path, torch_dtype=torch_dtype, device=device)
-    else:
-        return load_state_dict_from_bin(file_path, torch_dtype=torch_dtype, device=device)
+    # Legacy checkpoints are converted into safetensors once.
+    from .conversion import convert_to_safetensors
+    file_paths = convert_to_safetensors(file_path)
+    if file_paths != [file_path]:
+        return load_state_dict(file_paths, torch_dtype, device)
+    return load_state_dict_from_bin(file_path, torch_dtype=torch_dtype, device=device)
 
 
 def load_state_dict_from_safetensors(file_path, torch_dtype=None, device="cpu"):
@@ -24,8 +44,27 @@ def load_state_dict_from_safetensors(file_path, torch_dtype=None, device="cpu"):
     return state_dict
 
 
-def load_state_dict_from_bin(file_path, torch_dtype=None, device="cpu"):
-    state_dict = torch.load(file_path, map_location=device, weights_only=True)
+def map_safetensors_file(file_path):
+    # Returns the tensor index {name: (dtype, shape, begin, end)} and a memory mapping of the file,
+    # or (None, None) if some tensors cannot be viewed by torch.
+    header = read_safetensors_header(file_path)
+    if any(dtype not in SAFETENSORS_DTYPES for dtype, _, _, _ in header.values()):
+        return None, None
+    # Copy-on-write mapping: nothing is written, and torch requires a writable buffer.
+    with open(file_path, "rb") as f:
+        return header, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+
+def view_safetensors_tensor(buffer, dtype, shape, begin, end):
+    # A zero-copy view of a tensor in a mapped safetensors file.
+    dtype = SAFETENSORS_DTYPES[dtype]
+    if end == begin:
+        return torch.empty(shape, dtype=dtype)
+    return torch.frombuffer(buffer, dtype=dtype, count=(end - begin) // dtype.itemsize, offset=begin).reshape(shape)
+
+
+def load_state_dict_from_bin(file_path, torch_dtype=None, device="cpu", mmap=False):
+    state_dict = torch.load(file_path, map_location=device, weights_only=True, mmap=mmap)
     if len(state_dict) == 1:
         if "state_dict" in state_dict:
             state_dict = state_dict["state_dict"]
@@ -70,8 +109,11 @@ def load_keys_dict(file_path):
         return state_dict
     if file_path.endswith(".safetensors"):
         return load_keys_dict_from_safetensors(file_path)
-    else:
-        return load_keys_dict_from_bin(file_path)
+    from .conversion import convert_to_safetensors
+    file_paths = convert_to_safetensors(file_path)
+    if file_paths != [file_path]:
+        return load_keys_dict(file_paths)
+    return load_keys_dict_from_bin(file_path)
 
 
 def load_keys_dict_from_safetensors(file_path):
@@ -0,0 +1,88 @@
+import os, json, hashlib
+from .file import load_keys_dict, convert_keys_dict_to_single_str
+
+
+def fetch_file_signature(file_path):
+    # A file is considered unchanged if its size, modification time and inode are unchanged.
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+class ModelFingerprintIndex:
+    # An on-disk index of model fingerprints.
+    # It allows repeated startups (and every `accelerate` rank) to resolve models without parsing file headers.
+
+    def __init__(self, index_path=None):
+        if index_path is None:
+            if os.environ.get('DIFFSYNTH_FINGERPRINT_INDEX_PATH') is not None:
+                index_path = os.environ.get('DIFFSYNTH_FINGERPRINT_INDEX_PATH')
+            else:
+                index_path = os.path.join(os.path.expanduser("~"), ".cache", "diffsynth", "model_fingerprints.json")
+        # An empty path disables the index.
+        self.index_path = index_path if index_path != "" else None
+        self.files = {}
+        self.models = {}
+        self.load()
+
+    def load(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.files = index.get("files", {})
+            self.models = index.get("models", {})
+        except (OSError, ValueError):
+            # A broken index is ignored and will be rebuilt.
+            self.files, self.models = {}, {}
+
+    def save(self):
+        if self.index_path is None:
+            return
+        try:
+            # Merge with the entries written by other processes, then replace the file atomically.
+            files, models = self.files, self.models
+            self.load()
+            self.files.update(files)
+            self.models.update(models)
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files, "models": self.models}, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Cannot save the model fingerprint index to {self.index_path}: {e}")
+
+    def fetch_keys_dict(self, file_path):
+        file_path = os.path.abspath(file_path)
+        signature = fetch_file_signature(file_path)
+        entry = self.files.get(file_path)
+        if entry is not None and entry["signature"] == signature:
+            return entry["keys_dict"]
+        keys_dict = load_keys_dict(file_path)
+        self.files[file_path] = {"signature": signature, "keys_dict": keys_dict}
+        return keys_dict
+
+    def hash_model_file(self, path, with_shape=True, model_configs=None):
+        paths = path if isinstance(path, list) else [path]
+        model_key = json.dumps([os.path.abspath(i) for i in paths] + [with_shape])
+        signatures = [fetch_file_signature(i) for i in paths]
+        entry = self.models.get(model_key)
+        if entry is not None and entry["signatures"] == signatures:
+            return entry["model_hash"]
+        keys_dict = {}
+        for file_path in paths:
+            keys_dict.update(self.fetch_keys_dict(file_path))
+        keys_str = convert_keys_dict_to_single_str(keys_dict, with_shape=with_shape)
+        model_hash = hashlib.md5(keys_str.encode(encoding="UTF-8")).hexdigest()
+        self.models[model_key] = {"signatures": signatures, "model_hash": model_hash}
+        if model_configs is not None:
+            self.models[model_key]["model_names"] = [config["model_name"] for config in model_configs if config["model_hash"] == model_hash]
+        self.save()
+        return model_hash
+
+    def fetch_model_fingerprint(self, path):
+        # Unlike the model hash, the fingerprint identifies the weights, e.g., for caching model outputs on disk.
+        paths = path if isinstance(path, list) else [path]
+        files = [[os.path.abspath(i)] + fetch_file_signature(i) for i in paths]
+        return hashlib.md5(json.dumps(files).encode(encoding="UTF-8")).hexdigest()
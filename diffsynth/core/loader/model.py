@@ -1,10 +1,38 @@
 from ..vram.initialization import skip_model_initialization
 from ..vram.disk_map import DiskMap
 from ..vram.layers import enable_vram_management
-from .file import load_state_dict
+from .file import load_keys_dict
+from .parallel import ParallelStateDictLoader
 import torch
 
 
+def fetch_rename_dict(path, state_dict_converter=None):
+    # Returns {target name: source name} if `state_dict_converter` only renames (and selects) the tensors, otherwise None.
+    names = {name: name for name in load_keys_dict(path)}
+    if state_dict_converter is None:
+        return names
+    try:
+        rename_dict = state_dict_converter(names)
+    except Exception:
+        # The converter computes on the tensors.
+        return None
+    if not all(isinstance(name, str) and name in names for name in rename_dict.values()):
+        return None
+    return rename_dict
+
+
+def load_converted_state_dict(path, torch_dtype=None, device="cpu", state_dict_converter=None):
+    # Like `DiskMap`, only the tensors used by the model are loaded, which matters when a file contains multiple models.
+    # The renaming is resolved before loading, so that the tensors are read in parallel.
+    rename_dict = fetch_rename_dict(path, state_dict_converter)
+    if rename_dict is None:
+        # The tensors are copied out of the mapping, since they are kept by the model.
+        state_dict = DiskMap(path, device, torch_dtype=torch_dtype, copy=True)
+        return state_dict_converter(state_dict)
+    state_dict = ParallelStateDictLoader().load(path, torch_dtype=torch_dtype, device=device, names=set(rename_dict.values()))
+    return {name: state_dict[name_] for name, name_ in rename_dict.items()}
+
+
 def load_model(model_class, path, config=None, torch_dtype=torch.bfloat16, device="cpu", state_dict_converter=None, use_disk_map=False, module_map=None, vram_config=None, vram_limit=None):
     config = {} if config is None else config
     # Why do we use `skip_model_initialization`?
@@ -20,36 +48,32 @@ def load_model(model_class, path, config=None, torch_dtype=torch.bfloat16, devic
         dtypes = [vram_config["offload_dtype"], vram_config["onload_dtype"], vram_config["preparing_dtype"], vram_config["computation_dtype"]]
         dtype = [d for d in dtypes if d != "disk"][0]
         if vram_config["offload_device"] != "disk":
-            state_dict = DiskMap(path, device, torch_dtype=dtype)
-            if state_dict_converter is not None:
-                state_dict = state_dict_converter(state_dict)
-            else:
-                state_dict = {i: state_dict[i] for i in state_dict}
+            state_dict = load_converted_state_dict(path, dtype, device, state_dict_converter=state_dict_converter)
             model.load_state_dict(state_dict, assign=True)
             model = enable_vram_management(model, module_map, vram_config=vram_config, disk_map=None, vram_limit=vram_limit)
         else:
             disk_map = DiskMap(path, device, state_dict_converter=state_dict_converter)
             model = enable_vram_management(model, module_map, vram_config=vram_config, disk_map=disk_map, vram_limit=vram_limit)
     else:
-        # Why do we use `DiskMap`?
+        # Why do we use `load_converted_state_dict`?
         # Sometimes a model file contains multiple models,
-        # and DiskMap can load only the parameters of a single model,
+        # and it loads only the parameters of a single model,
         # avoiding the need to load all parameters in the file.
-        if use_disk_map:
-            state_dict = DiskMap(path, device, torch_dtype=torch_dtype)
-        else:
-            state_dict = load_state_dict(path, torch_dtype, device)
+        # The shards are read in parallel, and the tensors are created in `torch_dtype` on `device` directly.
         # Why do we use `state_dict_converter`?
         # Some models are saved in complex formats,
         # and we need to convert the state dict into the appropriate format.
-        if state_dict_converter is not None:
-            state_dict = state_dict_converter(state_dict)
+        if use_disk_map:
+            state_dict = load_converted_state_dict(path, torch_dtype, device, state_dict_converter=state_dict_converter)
         else:
-            state_dict = {i: state_dict[i] for i in state_dict}
+            state_dict = ParallelStateDictLoader().load(path, torch_dtype=torch_dtype, device=device)
+            if state_dict_converter is not None:
+                state_dict = state_dict_converter(state_dict)
         model.load_state_dict(state_dict, assign=True)
         # Why do we call `to()`?
         # Because some models override the behavior of `to()`,
         # especially those from libraries like Transformers.
+        # The loaded parameters are already in `torch_dtype` on `device`, so they are not copied again.
         model = model.to(dtype=torch_dtype, device=device)
     if hasattr(model, "eval"):
         model = model.eval()
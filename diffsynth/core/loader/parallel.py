@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+import torch, os, time, threading
+from .file import load_state_dict_from_safetensors, load_state_dict_from_bin, map_safetensors_file, view_safetensors_tensor
+from .conversion import convert_to_safetensors
+
+
+class ParallelStateDictLoader:
+    # Loads the tensors of (sharded) model files on a thread pool.
+    # Safetensors files are memory-mapped, and each tensor is copied from the mapped pages into a tensor
+    # allocated with the target dtype on the target device, so that no intermediate copy is held.
+    # The number of bytes being read at the same time is bounded by `max_inflight_bytes`.
+
+    def __init__(self, num_workers=None, max_inflight_bytes=None, verbose=False):
+        if num_workers is None:
+            if os.environ.get('DIFFSYNTH_LOADER_NUM_WORKERS') is not None:
+                num_workers = int(os.environ.get('DIFFSYNTH_LOADER_NUM_WORKERS'))
+            else:
+                num_workers = min(8, os.cpu_count() or 1)
+        if max_inflight_bytes is None:
+            if os.environ.get('DIFFSYNTH_LOADER_MAX_INFLIGHT_BYTES') is not None:
+                max_inflight_bytes = int(os.environ.get('DIFFSYNTH_LOADER_MAX_INFLIGHT_BYTES'))
+            else:
+                max_inflight_bytes = 2 * 10**9
+        self.num_workers = max(num_workers, 1)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.verbose = verbose
+        self.inflight_bytes = 0
+        self.condition = threading.Condition()
+        self.stats = {"files": 0, "tensors": 0, "bytes": 0, "seconds": 0.0}
+
+    def acquire(self, num_bytes):
+        # A tensor larger than the limit is read alone.
+        with self.condition:
+            while self.inflight_bytes > 0 and self.inflight_bytes + num_bytes > self.max_inflight_bytes:
+                self.condition.wait()
+            self.inflight_bytes += num_bytes
+
+    def release(self, num_bytes):
+        with self.condition:
+            self.inflight_bytes -= num_bytes
+            self.condition.notify_all()
+
+    def read_tensor(self, shard, dtype, shape, begin, end, torch_dtype, device):
+        # Executed on the worker threads.
+        try:
+            source = view_safetensors_tensor(shard, dtype, shape, begin, end)
+            tensor = torch.empty(shape, dtype=source.dtype if torch_dtype is None else torch_dtype, device=device)
+            tensor.copy_(source)
+            return tensor
+        finally:
+            self.release(end - begin)
+
+    def read_file(self, file_path, torch_dtype, device, names):
+        # Executed on the worker threads, for files that cannot be memory-mapped.
+        num_bytes = os.path.getsize(file_path)
+        try:
+            if file_path.endswith(".safetensors"):
+                state_dict = load_state_dict_from_safetensors(file_path, torch_dtype=torch_dtype, device=device)
+            else:
+                state_dict = load_state_dict_from_bin(file_path, torch_dtype=torch_dtype, device=device)
+            if names is not None:
+                state_dict = {name: state_dict[name] for name in state_dict if name in names}
+            return state_dict
+        finally:
+            self.release(num_bytes)
+
+    def load(self, file_path, torch_dtype=None, device="cpu", names=None):
+        # names: the tensors to load. All tensors are loaded if it is None.
+        file_paths = convert_to_safetensors(file_path)
+        start_time = time.perf_counter()
+        tasks, num_bytes = [], 0
+        with ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="ParallelStateDictLoader") as pool:
+            for file_path in file_paths:
+                header, shard = map_safetensors_file(file_path) if file_path.endswith(".safetensors") else (None, None)
+                if shard is None:
+                    file_bytes = os.path.getsize(file_path)
+                    self.acquire(file_bytes)
+                    tasks.append((None, pool.submit(self.read_file, file_path, torch_dtype, device, names)))
+                    num_bytes += file_bytes
+                    continue
+                for name, (dtype, shape, begin, end) in header.items():
+                    if names is not None and name not in names:
+                        continue
+                    self.acquire(end - begin)
+                    tasks.append((name, pool.submit(self.read_tensor, shard, dtype, shape, begin, end, torch_dtype, device)))
+                    num_bytes += end - begin
+                del shard
+            state_dict = {}
+            for name, future in tasks:
+                if name is None:
+                    state_dict.update(future.result())
+                else:
+                    state_dict[name] = future.result()
+        if torch.device(device).type == "cuda":
+            torch.cuda.synchronize(device)
+        seconds = time.perf_counter() - start_time
+        self.stats["files"] += len(file_paths)
+        self.stats["tensors"] += len(state_dict)
+        self.stats["bytes"] += num_bytes
+        self.stats["seconds"] += seconds
+        if self.verbose:
+            print(f"Loaded {len(state_dict)} tensors ({num_bytes / 1024**3:.2f} GB) from {len(file_paths)} files in {seconds:.2f}s ({num_bytes / 1024**3 / max(seconds, 1e-9):.2f} GB/s).")
+        return state_dict
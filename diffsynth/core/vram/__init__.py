@@ -1,2 +1,4 @@
 from .initialization import skip_model_initialization
 from .layers import *
+from .scheduler import LayerwiseOnloadScheduler
+from .budget import VRAMBudget
@@ -0,0 +1,147 @@
+import torch, os, heapq
+from collections import OrderedDict
+from .layers import AutoWrappedNonRecurseModule
+from ..device import get_device_name, IS_NPU_AVAILABLE
+
+
+class VRAMBudget:
+    # Tracks the VRAM occupied by the layers in the `preparing` state, so that the promotion of a layer is decided without querying the driver.
+    # It is shared by all VRAM-managed layers of a pipeline.
+    # Policies:
+    #     "static": Layers are promoted until the budget is used up, and then stay resident.
+    #     "lru": The least recently used layers are evicted to make room for a new layer.
+    #     "priority": Layers with lower priority are evicted to make room for a layer with higher priority.
+
+    def __init__(self, vram_limit, policy=None, priorities=None):
+        if policy is None:
+            policy = os.environ.get('DIFFSYNTH_VRAM_BUDGET_POLICY', "static")
+        if policy not in ("static", "lru", "priority"):
+            raise ValueError(f"Unsupported VRAM budget policy: {policy}. Supported policies: static, lru, priority.")
+        # vram_limit (GB): the limit of the used VRAM, including the memory occupied before the budget is calibrated.
+        self.vram_limit = vram_limit
+        self.policy = policy
+        # priorities: {layer name prefix: priority}. The longest matching prefix is used, and the default priority is 0.
+        self.priorities = priorities or {}
+        self.capacity = None
+        # {id(layer): (layer, num_bytes)}, ordered from the least recently used.
+        self.residents = OrderedDict()
+        self.resident_bytes = 0
+        self.priority_heap = []
+        self.layer_bytes = {}
+        self.stats = {"promoted": 0, "evicted": 0, "rejected": 0, "promoted_bytes": 0, "evicted_bytes": 0}
+
+    def calibrate(self, layer=None):
+        # The memory used by others (e.g., models on the device, the CUDA context) is measured once.
+        # Without `layer`, the budget is calibrated again on the next request.
+        if layer is None:
+            self.capacity = None
+            return
+        device = layer.computation_device if not IS_NPU_AVAILABLE else get_device_name()
+        free_memory, total_memory = getattr(torch, layer.computation_device_type).mem_get_info(device)
+        used_memory = total_memory - free_memory - self.resident_bytes
+        self.capacity = self.vram_limit * (1024 ** 3) - used_memory
+
+    def fetch_layer_bytes(self, layer):
+        key = id(layer)
+        if key not in self.layer_bytes:
+            if hasattr(layer, "module"):
+                recurse = not isinstance(layer, AutoWrappedNonRecurseModule)
+                tensors = list(layer.module.parameters(recurse=recurse)) + list(layer.module.buffers(recurse=recurse))
+            else:
+                tensors = [tensor for tensor in (layer.weight, layer.bias) if tensor is not None]
+            num_bytes = 0
+            for tensor in tensors:
+                element_size = layer.preparing_dtype.itemsize if tensor.is_floating_point() and isinstance(layer.preparing_dtype, torch.dtype) else tensor.element_size()
+                num_bytes += tensor.numel() * element_size
+            self.layer_bytes[key] = num_bytes
+        return self.layer_bytes[key]
+
+    def fetch_priority(self, layer):
+        priority, matched = 0, -1
+        for prefix, priority_ in self.priorities.items():
+            if (layer.name == prefix or layer.name.startswith(prefix + ".") or prefix == "") and len(prefix) > matched:
+                priority, matched = priority_, len(prefix)
+        return priority
+
+    def fetch_lowest_priority(self):
+        # Entries of evicted layers are removed lazily.
+        while len(self.priority_heap) > 0 and self.priority_heap[0][2] not in self.residents:
+            heapq.heappop(self.priority_heap)
+        return self.priority_heap[0] if len(self.priority_heap) > 0 else None
+
+    def is_evictable(self, layer):
+        # The wrapped children of a non-recursive module are called during its forward pass, so it cannot be evicted by them.
+        return not isinstance(layer, AutoWrappedNonRecurseModule)
+
+    def evict(self, key):
+        layer, num_bytes = self.residents.pop(key)
+        self.resident_bytes -= num_bytes
+        self.stats["evicted"] += 1
+        self.stats["evicted_bytes"] += num_bytes
+        layer.demote()
+
+    def make_room(self, layer, num_bytes):
+        # The victims are evicted only if they free enough memory.
+        victims, freed_bytes = [], 0
+        if self.policy == "lru":
+            for key, (layer_, num_bytes_) in self.residents.items():
+                if self.resident_bytes - freed_bytes + num_bytes <= self.capacity:
+                    break
+                if self.is_evictable(layer_):
+                    victims.append(key)
+                    freed_bytes += num_bytes_
+        elif self.policy == "priority":
+            priority = self.fetch_priority(layer)
+            popped = []
+            while self.resident_bytes - freed_bytes + num_bytes > self.capacity:
+                lowest = self.fetch_lowest_priority()
+                if lowest is None or lowest[0] >= priority:
+                    break
+                popped.append(heapq.heappop(self.priority_heap))
+                victims.append(lowest[2])
+                freed_bytes += self.residents[lowest[2]][1]
+            if self.resident_bytes - freed_bytes + num_bytes > self.capacity:
+                for entry in popped:
+                    heapq.heappush(self.priority_heap, entry)
+        if self.resident_bytes - freed_bytes + num_bytes <= self.capacity:
+            for key in victims:
+                self.evict(key)
+
+    def request(self, layer):
+        # Returns True if the layer can be promoted to the `preparing` state, and records its memory.
+        if self.capacity is None:
+            self.calibrate(layer)
+        num_bytes = self.fetch_layer_bytes(layer)
+        if self.resident_bytes + num_bytes > self.capacity and num_bytes <= self.capacity:
+            self.make_room(layer, num_bytes)
+        if self.resident_bytes + num_bytes > self.capacity:
+            self.stats["rejected"] += 1
+            return False
+        key = id(layer)
+        self.residents[key] = (layer, num_bytes)
+        self.resident_bytes += num_bytes
+        if self.policy == "priority" and self.is_evictable(layer):
+            heapq.heappush(self.priority_heap, (self.fetch_priority(layer), self.stats["promoted"], key))
+        self.stats["promoted"] += 1
+        self.stats["promoted_bytes"] += num_bytes
+        return True
+
+    def touch(self, layer):
+        key = id(layer)
+        if key in self.residents:
+            self.residents.move_to_end(key)
+
+    def release(self, layer):
+        # Called when a resident layer is offloaded by the pipeline.
+        entry = self.residents.pop(id(layer), None)
+        if entry is not None:
+            self.resident_bytes -= entry[1]
+
+    def fetch_statistics(self):
+        return {
+            "policy": self.policy,
+            "capacity_bytes": self.capacity,
+            "resident_layers": len(self.residents),
+            "resident_bytes": self.resident_bytes,
+            **self.stats,
+        }
@@ -1,5 +1,12 @@
 from safetensors import safe_open
-import torch, os
+from concurrent.futures import ThreadPoolExecutor
+import torch, os, mmap
+from ..loader.conversion import convert_to_safetensors
+from ..loader.file import map_safetensors_file, view_safetensors_tensor
+
+
+MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", None)
+MADV_DONTNEED = getattr(mmap, "MADV_DONTNEED", None)
 
 
 class SafetensorsCompatibleTensor:
@@ -26,57 +33,240 @@ class SafetensorsCompatibleBinaryLoader:
 
 
 class DiskMap:
+    # Lazily loads the tensors of model files.
+    # Each safetensors file is memory-mapped once, and a tensor is a zero-copy view of the mapping (converted to `torch_dtype` and moved to `device` if needed),
+    # so the returned tensors should not be modified in place or kept unless `copy=True`.
+    # Instead of reopening the files, the pages of the tensors read so far are released with `madvise(MADV_DONTNEED)`
+    # every `buffer_size` bytes, which bounds the resident memory of the mappings. Released pages are read again on the next access.
 
-    def __init__(self, path, device, torch_dtype=None, state_dict_converter=None, buffer_size=10**9):
-        self.path = path if isinstance(path, list) else [path]
+    def __init__(self, path, device, torch_dtype=None, state_dict_converter=None, buffer_size=10**9, prefetch_size=0, prefetch_workers=4, prefetch_ram_budget=4 * 10**9, copy=False):
+        # Legacy checkpoints are replaced by the converted safetensors files, which are memory-mapped.
+        self.path = convert_to_safetensors(path)
         self.device = device
         self.torch_dtype = torch_dtype
+        self.copy = copy
         if os.environ.get('DIFFSYNTH_DISK_MAP_BUFFER_SIZE') is not None:
             self.buffer_size = int(os.environ.get('DIFFSYNTH_DISK_MAP_BUFFER_SIZE'))
         else:
             self.buffer_size = buffer_size
+        # files: the memory mappings, or the loaders of the files that cannot be mapped.
+        # tensor_index: {name: (file_id, dtype, shape, begin, end)}, built once for the mapped files.
         self.files = []
-        self.flush_files()
+        self.tensor_index = {}
         self.name_map = {}
-        for file_id, file in enumerate(self.files):
-            for name in file.keys():
-                self.name_map[name] = file_id
+        self.load_files()
         self.rename_dict = self.fetch_rename_dict(state_dict_converter)
-        
-    def flush_files(self):
-        if len(self.files) == 0:
-            for path in self.path:
+        # The ranges read since the last release: [(file_id, begin, end)]
+        self.mapped_ranges = []
+        self.mapped_bytes = 0
+        self.residency_stats = {"released": 0, "released_bytes": 0}
+        # Prefetching (disabled by default)
+        self.execution_order = []
+        self.group_map = {}
+        self.next_group = {}
+        self.last_group = None
+        self.prefetch_size = 0
+        self.prefetch_pool = None
+        self.prefetch_buffer = {}
+        self.prefetch_bytes = 0
+        self.prefetch_stats = {"hit": 0, "miss": 0, "prefetched_bytes": 0, "dropped_bytes": 0}
+        if os.environ.get('DIFFSYNTH_DISK_MAP_PREFETCH_SIZE') is not None:
+            prefetch_size = int(os.environ.get('DIFFSYNTH_DISK_MAP_PREFETCH_SIZE'))
+        if os.environ.get('DIFFSYNTH_DISK_MAP_PREFETCH_RAM_BUDGET') is not None:
+            prefetch_ram_budget = int(os.environ.get('DIFFSYNTH_DISK_MAP_PREFETCH_RAM_BUDGET'))
+        if prefetch_size > 0:
+            self.enable_prefetch(prefetch_size, prefetch_workers=prefetch_workers, prefetch_ram_budget=prefetch_ram_budget)
+
+    def load_files(self):
+        for file_id, path in enumerate(self.path):
+            header, buffer = map_safetensors_file(path) if path.endswith(".safetensors") else (None, None)
+            if buffer is not None:
+                for name, (dtype, shape, begin, end) in header.items():
+                    self.tensor_index[name] = (file_id, dtype, shape, begin, end)
+                self.files.append(buffer)
+                names = header.keys()
+            else:
                 if path.endswith(".safetensors"):
-                    self.files.append(safe_open(path, framework="pt", device=str(self.device)))
+                    file = safe_open(path, framework="pt", device=str(self.device))
                 else:
-                    self.files.append(SafetensorsCompatibleBinaryLoader(path, device=self.device))
-        else:
-            for i, path in enumerate(self.path):
-                if path.endswith(".safetensors"):
-                    self.files[i] = safe_open(path, framework="pt", device=str(self.device))
-        self.num_params = 0
+                    file = SafetensorsCompatibleBinaryLoader(path, device=self.device)
+                self.files.append(file)
+                names = file.keys()
+            for name in names:
+                self.name_map[name] = file_id
+
+    def madvise(self, option, file_id, begin, end):
+        # option is None if `madvise` is not supported on this platform.
+        if option is None or end <= begin:
+            return
+        start = begin - begin % mmap.PAGESIZE
+        self.files[file_id].madvise(option, start, end - start)
+
+    def record_read(self, name):
+        file_id, _, _, begin, end = self.tensor_index[name]
+        self.mapped_ranges.append((file_id, begin, end))
+        self.mapped_bytes += end - begin
+        if self.mapped_bytes > self.buffer_size:
+            self.release_pages()
+
+    def release_pages(self):
+        for file_id, begin, end in self.mapped_ranges:
+            self.madvise(MADV_DONTNEED, file_id, begin, end)
+        self.residency_stats["released"] += 1
+        self.residency_stats["released_bytes"] += self.mapped_bytes
+        self.mapped_ranges = []
+        self.mapped_bytes = 0
+
+    def read_tensor_view(self, name):
+        if name in self.tensor_index:
+            file_id, dtype, shape, begin, end = self.tensor_index[name]
+            return view_safetensors_tensor(self.files[file_id], dtype, shape, begin, end)
+        return self.files[self.name_map[name]].get_tensor(name)
 
     def __getitem__(self, name):
+        return self.get_tensor(name)
+
+    def get_tensor(self, name, torch_dtype=None, device=None, copy=None):
+        # The tensor is converted to `torch_dtype` and moved to `device` (`self.torch_dtype` and `self.device` by default).
+        # copy: whether the tensor must not share memory with the mapping (`self.copy` by default).
+        # It must be True if the tensor is kept, e.g., assigned as a parameter, since in-place writes to a view are lost when its pages are released.
+        torch_dtype = self.torch_dtype if torch_dtype is None else torch_dtype
+        device = self.device if device is None else device
+        copy = self.copy if copy is None else copy
+        if self.prefetch_size > 0:
+            self.schedule_prefetch(name)
         if self.rename_dict is not None: name = self.rename_dict[name]
-        file_id = self.name_map[name]
-        param = self.files[file_id].get_tensor(name)
-        if self.torch_dtype is not None and isinstance(param, torch.Tensor):
+        if name in self.prefetch_buffer:
+            # Prefetched tensors are copies.
+            param = self.fetch_prefetched_tensor(name)
+            self.prefetch_stats["hit"] += 1
+            return param.to(dtype=torch_dtype, device=device)
+        if self.prefetch_pool is not None:
+            self.prefetch_stats["miss"] += 1
+        param = self.read_tensor_view(name)
+        if not isinstance(param, torch.Tensor):
+            return param
+        if name in self.tensor_index:
+            self.record_read(name)
+            view = param
+            param = param.to(dtype=torch_dtype, device=device)
+            if copy and param.data_ptr() == view.data_ptr():
+                param = param.clone()
+        else:
+            param = param.to(dtype=torch_dtype, device=device)
+        return param
+
+    def enable_prefetch(self, prefetch_size=4, prefetch_workers=4, prefetch_ram_budget=4 * 10**9, pin_memory=True):
+        # Read the tensors of the next `prefetch_size` layers on a thread pool
+        # while the current layer is computing.
+        # The kernel is also advised to read their pages ahead (`MADV_WILLNEED`).
+        # With `prefetch_workers=0`, only the advice is given, and no tensor is copied.
+        self.prefetch_size = prefetch_size
+        self.prefetch_ram_budget = prefetch_ram_budget
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        if self.prefetch_pool is None and prefetch_workers > 0:
+            self.prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="DiskMapPrefetch")
+
+    def disable_prefetch(self):
+        if self.prefetch_pool is not None:
+            self.prefetch_pool.shutdown(wait=True)
+            self.prefetch_pool = None
+        self.prefetch_size = 0
+        self.prefetch_buffer.clear()
+        self.prefetch_bytes = 0
+
+    def set_execution_order(self, execution_order):
+        # `execution_order` is a list of parameter name groups, one group per layer.
+        # It is provided by `enable_vram_management` and refined by the observed access order.
+        self.execution_order = [list(group) for group in execution_order if len(group) > 0]
+        self.group_map = {}
+        for group_id, group in enumerate(self.execution_order):
+            for name in group:
+                self.group_map[name] = group_id
+        self.next_group = {}
+        self.last_group = None
+
+    def predict_groups(self, group_id):
+        group_ids = []
+        for _ in range(min(self.prefetch_size, len(self.execution_order) - 1)):
+            group_id = self.next_group.get(group_id, (group_id + 1) % len(self.execution_order))
+            group_ids.append(group_id)
+        return group_ids
+
+    def tensor_bytes(self, name):
+        _, dtype, shape, begin, end = self.tensor_index[name]
+        if self.torch_dtype is not None:
+            numel = 1
+            for i in shape:
+                numel *= i
+            return numel * self.torch_dtype.itemsize
+        return end - begin
+
+    def read_tensor(self, name):
+        # Executed on the prefetching threads.
+        param = self.read_tensor_view(name)
+        if self.torch_dtype is not None:
             param = param.to(self.torch_dtype)
-        if isinstance(param, torch.Tensor) and param.device == "cpu":
+        if self.pin_memory:
+            param = param.pin_memory()
+        else:
             param = param.clone()
-        if isinstance(param, torch.Tensor):
-            self.num_params += param.numel()
-        if self.num_params > self.buffer_size:
-            self.flush_files()
+        return param
+
+    def schedule_prefetch(self, name):
+        group_id = self.group_map.get(name)
+        if group_id is None or group_id == self.last_group:
+            return
+        # Learn the real execution order.
+        if self.last_group is not None:
+            self.next_group[self.last_group] = group_id
+        self.last_group = group_id
+        current, upcoming = self.fetch_prefetchable_names([group_id]), self.fetch_prefetchable_names(self.predict_groups(group_id))
+        # Drop the tensors that were mispredicted.
+        keep = set(current + upcoming)
+        for name in list(self.prefetch_buffer.keys()):
+            future, num_bytes = self.prefetch_buffer[name]
+            if name not in keep and future.done():
+                self.prefetch_buffer.pop(name)
+                self.prefetch_bytes -= num_bytes
+                self.prefetch_stats["dropped_bytes"] += num_bytes
+        for name in upcoming:
+            if name in self.prefetch_buffer:
+                continue
+            file_id, _, _, begin, end = self.tensor_index[name]
+            self.madvise(MADV_WILLNEED, file_id, begin, end)
+            if self.prefetch_pool is None:
+                continue
+            num_bytes = self.tensor_bytes(name)
+            if self.prefetch_bytes + num_bytes > self.prefetch_ram_budget:
+                break
+            future = self.prefetch_pool.submit(self.read_tensor, name)
+            self.prefetch_buffer[name] = (future, num_bytes)
+            self.prefetch_bytes += num_bytes
+            self.prefetch_stats["prefetched_bytes"] += num_bytes
+            self.record_read(name)
+
+    def fetch_prefetchable_names(self, group_ids):
+        names = []
+        for group_id in group_ids:
+            for name in self.execution_order[group_id]:
+                if self.rename_dict is not None: name = self.rename_dict[name]
+                if name in self.tensor_index:
+                    names.append(name)
+        return names
+
+    def fetch_prefetched_tensor(self, name):
+        future, num_bytes = self.prefetch_buffer.pop(name)
+        self.prefetch_bytes -= num_bytes
+        param = future.result()
+        if str(self.device) != "cpu":
+            param = param.to(self.device, non_blocking=self.pin_memory)
         return param
 
     def fetch_rename_dict(self, state_dict_converter):
         if state_dict_converter is None:
             return None
-        state_dict = {}
-        for file in self.files:
-            for name in file.keys():
-                state_dict[name] = name
+        state_dict = {name: name for name in self.name_map}
         state_dict = state_dict_converter(state_dict)
         return state_dict
     
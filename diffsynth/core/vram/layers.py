@@ -1,4 +1,5 @@
-import torch, copy
+import torch, copy, contextvars
+from collections import OrderedDict
 from typing import Union
 from .initialization import skip_model_initialization
 from .disk_map import DiskMap
@@ -34,6 +35,8 @@ class AutoTorchModule(torch.nn.Module):
         self.state = 0
         self.name = ""
         self.computation_device_type = parse_device_type(self.computation_device)
+        self.onload_scheduler = None
+        self.vram_budget = None
 
     def set_dtype_and_device(
         self,
@@ -68,10 +71,18 @@ class AutoTorchModule(torch.nn.Module):
         used_memory = (gpu_mem_state[1] - gpu_mem_state[0]) / (1024**3)
         return used_memory < self.vram_limit
 
+    def request_vram(self):
+        # The VRAM budget shared by the pipeline avoids querying the driver in every forward pass.
+        if self.vram_budget is not None:
+            return self.vram_budget.request(self)
+        return self.check_free_vram()
+
     def offload(self):
         if self.state != 0:
             self.to(dtype=self.offload_dtype, device=self.offload_device)
             self.state = 0
+            if self.vram_budget is not None:
+                self.vram_budget.release(self)
 
     def onload(self):
         if self.state != 1:
@@ -115,8 +126,8 @@ class AutoWrappedModule(AutoTorchModule):
             vram_limit,
         )
         self.module = module
+        self.name = name
         if offload_dtype == "disk":
-            self.name = name
             self.disk_map = disk_map
             self.required_params = [name for name, _ in self.module.named_parameters()]
             self.disk_offload = True
@@ -130,9 +141,8 @@ class AutoWrappedModule(AutoTorchModule):
             module = self.module
         state_dict = {}
         for name in self.required_params:
-            param = self.disk_map[self.param_name(name)]
-            param = param.to(dtype=torch_dtype, device=device)
-            state_dict[name] = param
+            # The parameters of `self.module` are kept, so they are copied out of the memory-mapped files.
+            state_dict[name] = self.disk_map.get_tensor(self.param_name(name), torch_dtype=torch_dtype, device=device, copy=not copy_module)
         module.load_state_dict(state_dict, assign=True)
         module.to(dtype=torch_dtype, device=device)
         return module
@@ -155,6 +165,8 @@ class AutoWrappedModule(AutoTorchModule):
             else:
                 self.to(dtype=self.offload_dtype, device=self.offload_device)
             self.state = 0
+            if self.vram_budget is not None:
+                self.vram_budget.release(self)
 
     def onload(self):
         # offload / onload / preparing -> onload
@@ -174,6 +186,15 @@ class AutoWrappedModule(AutoTorchModule):
                 self.to(dtype=self.preparing_dtype, device=self.preparing_device)
             self.state = 2
 
+    def demote(self):
+        # preparing -> onload, when the layer is evicted by `VRAMBudget`
+        if self.state == 2:
+            if self.disk_offload and self.onload_device == "disk":
+                self.offload_to_disk(self.module)
+            elif self.onload_device != "disk":
+                self.to(dtype=self.onload_dtype, device=self.onload_device)
+            self.state = 1
+
     def cast_to(self, module, dtype, device):
         return copy.deepcopy(module).to(dtype=dtype, device=device)
             
@@ -188,12 +209,19 @@ class AutoWrappedModule(AutoTorchModule):
         elif self.disk_offload and device == "disk":
             module = self.load_from_disk(self.computation_dtype, self.computation_device, copy_module=True)
         else:
-            module = self.cast_to(self.module, dtype=self.computation_dtype, device=self.computation_device)
+            tensors = None if self.onload_scheduler is None else self.onload_scheduler.fetch(self)
+            if tensors is None:
+                module = self.cast_to(self.module, dtype=self.computation_dtype, device=self.computation_device)
+            else:
+                # The prefetched parameters and buffers replace those of the wrapped module only in this call.
+                module = lambda *args, **kwargs: torch.func.functional_call(self.module, tensors, args, kwargs)
         return module
 
     def forward(self, *args, **kwargs):
-        if self.state == 1 and (self.vram_limit is None or self.check_free_vram()):
+        if self.state == 1 and (self.vram_limit is None or self.request_vram()):
             self.preparing()
+        elif self.state == 2 and self.vram_budget is not None:
+            self.vram_budget.touch(self)
         module = self.computation()
         return module(*args, **kwargs)
     
@@ -247,9 +275,8 @@ class AutoWrappedNonRecurseModule(AutoWrappedModule):
             module = self.module
         state_dict = {}
         for name in self.required_params:
-            param = self.disk_map[self.param_name(name)]
-            param = param.to(dtype=torch_dtype, device=device)
-            state_dict[name] = param
+            # The parameters of `self.module` are kept, so they are copied out of the memory-mapped files.
+            state_dict[name] = self.disk_map.get_tensor(self.param_name(name), torch_dtype=torch_dtype, device=device, copy=not copy_module)
         module.load_state_dict(state_dict, assign=True, strict=False)
         return module
     
@@ -268,6 +295,42 @@ class AutoWrappedNonRecurseModule(AutoWrappedModule):
             return getattr(self.module, name)
 
 
+class LoRAAdapterSelection:
+    # Selects the hotloaded LoRA adapters for each row of the batch, so that one forward pass can serve requests with different LoRA sets.
+    # adapter_names: one entry per row, each a list of adapter names, or None for all adapters.
+    # A single entry is broadcast to the whole batch.
+    # Usage:
+    #     with LoRAAdapterSelection([["style"], ["style", "character"], []]):
+    #         model(...)
+    current = contextvars.ContextVar("lora_adapter_selection", default=None)
+
+    def __init__(self, adapter_names):
+        self.adapter_names = adapter_names
+        self.row_scales = {}
+        self.token = None
+
+    def fetch_row_scale(self, lora_adapter_names, ranks, batch_size, dtype, device):
+        # Returns a (batch_size, sum of ranks) tensor of 0/1, cached for layers with the same adapters.
+        key = (tuple(lora_adapter_names), tuple(ranks), dtype, device)
+        if key not in self.row_scales:
+            mask = [[1.0 if (row is None or name in row) else 0.0 for name in lora_adapter_names] for row in self.adapter_names]
+            mask = torch.tensor(mask, dtype=dtype, device=device)
+            self.row_scales[key] = mask.repeat_interleave(torch.tensor(ranks, device=device), dim=1)
+        row_scale = self.row_scales[key]
+        if row_scale.shape[0] == 1:
+            return row_scale
+        if row_scale.shape[0] != batch_size:
+            raise ValueError(f"LoRA adapters are selected for {row_scale.shape[0]} rows, but the batch size is {batch_size}.")
+        return row_scale
+
+    def __enter__(self):
+        self.token = LoRAAdapterSelection.current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        LoRAAdapterSelection.current.reset(self.token)
+
+
 class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
     def __init__(
         self,
@@ -306,11 +369,14 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
         self.bias = module.bias
         self.state = 0
         self.name = name
-        self.lora_A_weights = []
-        self.lora_B_weights = []
+        # Hotloaded LoRA: {adapter_name: (lora_A, lora_B, scale)}
+        self.lora_adapters = OrderedDict()
+        self.stacked_lora = None
         self.lora_merger = None
         self.enable_fp8 = computation_dtype in [torch.float8_e4m3fn, torch.float8_e4m3fnuz]
         self.computation_device_type = parse_device_type(self.computation_device)
+        self.onload_scheduler = None
+        self.vram_budget = None
         
         if offload_dtype == "disk":
             self.disk_map = disk_map
@@ -357,8 +423,9 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
         return result
             
     def load_from_disk(self, torch_dtype, device, assign=True):
-        weight = self.disk_map[self.name + ".weight"].to(dtype=torch_dtype, device=device)
-        bias = None if self.bias is None else self.disk_map[self.name + ".bias"].to(dtype=torch_dtype, device=device)
+        # The assigned parameters are kept (e.g., a LoRA may be fused into them), so they are copied out of the memory-mapped files.
+        weight = self.disk_map.get_tensor(self.name + ".weight", torch_dtype=torch_dtype, device=device, copy=assign)
+        bias = None if self.bias is None else self.disk_map.get_tensor(self.name + ".bias", torch_dtype=torch_dtype, device=device, copy=assign)
         if assign:
             state_dict = {"weight": weight}
             if bias is not None: state_dict["bias"] = bias
@@ -373,6 +440,8 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
             else:
                 self.to(dtype=self.offload_dtype, device=self.offload_device)
             self.state = 0
+            if self.vram_budget is not None:
+                self.vram_budget.release(self)
 
     def onload(self):
         # offload / onload / preparing -> onload
@@ -391,6 +460,15 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
             elif self.preparing_device != "disk":
                 self.to(dtype=self.preparing_dtype, device=self.preparing_device)
             self.state = 2
+
+    def demote(self):
+        # preparing -> onload, when the layer is evicted by `VRAMBudget`
+        if self.state == 2:
+            if self.disk_offload and self.onload_device == "disk":
+                self.to("meta")
+            elif self.onload_device != "disk":
+                self.to(dtype=self.onload_dtype, device=self.onload_device)
+            self.state = 1
             
     def computation(self):
         # onload / preparing -> computation (temporary)
@@ -403,8 +481,12 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
         elif self.disk_offload and device == "disk":
             weight, bias = self.load_from_disk(self.computation_dtype, self.computation_device, assign=False)
         else:
-            weight = self.cast_to(self.weight, self.computation_dtype, self.computation_device)
-            bias = None if self.bias is None else self.cast_to(self.bias, self.computation_dtype, self.computation_device)
+            tensors = None if self.onload_scheduler is None else self.onload_scheduler.fetch(self)
+            if tensors is None:
+                weight = self.cast_to(self.weight, self.computation_dtype, self.computation_device)
+                bias = None if self.bias is None else self.cast_to(self.bias, self.computation_dtype, self.computation_device)
+            else:
+                weight, bias = tensors["weight"], tensors.get("bias")
         return weight, bias
 
     def linear_forward(self, x, weight, bias):
@@ -414,24 +496,70 @@ class AutoWrappedLinear(torch.nn.Linear, AutoTorchModule):
             out = torch.nn.functional.linear(x, weight, bias)
         return out
 
+    def add_lora_adapter(self, adapter_name, lora_A, lora_B, scale=1.0):
+        # An adapter with the same name is replaced.
+        self.lora_adapters[adapter_name] = (lora_A, lora_B, scale)
+        self.stacked_lora = None
+
+    def remove_lora_adapter(self, adapter_name):
+        if adapter_name not in self.lora_adapters:
+            return False
+        self.lora_adapters.pop(adapter_name)
+        self.stacked_lora = None
+        return True
+
+    def set_lora_adapter_scale(self, adapter_name, scale):
+        if adapter_name not in self.lora_adapters:
+            return False
+        lora_A, lora_B, _ = self.lora_adapters[adapter_name]
+        self.lora_adapters[adapter_name] = (lora_A, lora_B, scale)
+        self.stacked_lora = None
+        return True
+
+    def clear_lora_adapters(self):
+        self.lora_adapters.clear()
+        self.stacked_lora = None
+
+    def fetch_stacked_lora(self):
+        # The adapters are concatenated along the rank dimension, and rebuilt only when they are changed.
+        # lora_A: (sum of ranks, in_features), lora_B: (out_features, sum of ranks), lora_scale: (sum of ranks,)
+        if self.stacked_lora is None:
+            adapters = list(self.lora_adapters.values())
+            lora_A = torch.concat([lora_A for lora_A, _, _ in adapters], dim=0)
+            lora_B = torch.concat([lora_B for _, lora_B, _ in adapters], dim=1)
+            lora_scale = torch.concat([
+                torch.full((lora_A.shape[0],), scale, dtype=lora_A.dtype, device=lora_A.device)
+                for lora_A, _, scale in adapters
+            ])
+            ranks = [lora_A.shape[0] for lora_A, _, _ in adapters]
+            self.stacked_lora = (lora_A, lora_B, lora_scale, ranks)
+        return self.stacked_lora
+
     def lora_forward(self, x, out):
+        # Two GEMMs for all adapters. The per-adapter scales are applied as a diagonal matrix between them.
+        lora_A, lora_B, lora_scale, ranks = self.fetch_stacked_lora()
+        hidden_states = (x @ lora_A.T) * lora_scale
+        selection = LoRAAdapterSelection.current.get()
+        if selection is not None:
+            # Each row only keeps the ranks of its own adapters.
+            row_scale = selection.fetch_row_scale(self.lora_adapters.keys(), ranks, x.shape[0], hidden_states.dtype, hidden_states.device)
+            hidden_states = hidden_states * row_scale.view(row_scale.shape[0], *([1] * (x.ndim - 2)), -1)
         if self.lora_merger is None:
-            for lora_A, lora_B in zip(self.lora_A_weights, self.lora_B_weights):
-                out = out + x @ lora_A.T @ lora_B.T
+            out = out + hidden_states @ lora_B.T
         else:
-            lora_output = []
-            for lora_A, lora_B in zip(self.lora_A_weights, self.lora_B_weights):
-                lora_output.append(x @ lora_A.T @ lora_B.T)
+            lora_output = [h @ B.T for h, B in zip(hidden_states.split(ranks, dim=-1), lora_B.split(ranks, dim=1))]
             lora_output = torch.stack(lora_output)
             out = self.lora_merger(out, lora_output)
         return out
     
     def forward(self, x, *args, **kwargs):
-        if self.state == 1 and (self.vram_limit is None or self.check_free_vram()):
+        if self.state == 1 and (self.vram_limit is None or self.request_vram()):
             self.preparing()
+        elif self.state == 2 and self.vram_budget is not None:
+            self.vram_budget.touch(self)
         weight, bias = self.computation()
         out = self.linear_forward(x, weight, bias)
-        if len(self.lora_A_weights) > 0:
+        if len(self.lora_adapters) > 0:
             out = self.lora_forward(x, out)
         return out
 
@@ -452,6 +580,19 @@ def enable_vram_management_recursively(model: torch.nn.Module, module_map: dict,
             enable_vram_management_recursively(module, module_map, vram_config, vram_limit=vram_limit, name_prefix=layer_name, disk_map=disk_map, **kwargs)
 
 
+def fetch_disk_offload_param_names(model: torch.nn.Module):
+    param_names = []
+    for module in model.modules():
+        if isinstance(module, AutoWrappedLinear) and module.disk_offload:
+            names = [module.name + ".weight"]
+            if module.bias is not None:
+                names.append(module.name + ".bias")
+            param_names.append(names)
+        elif isinstance(module, AutoWrappedModule) and module.disk_offload:
+            param_names.append([module.param_name(name) for name in module.required_params])
+    return param_names
+
+
 def fill_vram_config(model, vram_config):
     vram_config_ = vram_config.copy()
     vram_config_["onload_dtype"] = vram_config["computation_dtype"]
@@ -474,6 +615,9 @@ def enable_vram_management(model: torch.nn.Module, module_map: dict, vram_config
             break
     else:
         enable_vram_management_recursively(model, module_map, vram_config, vram_limit=vram_limit, disk_map=disk_map, **kwargs)
+    # The registration order of layers is used as the initial execution order for prefetching in `DiskMap`.
+    if disk_map is not None:
+        disk_map.set_execution_order(fetch_disk_offload_param_names(model))
     # `vram_management_enabled` is a flag that allows the pipeline to determine whether VRAM management is enabled.
     model.vram_management_enabled = True
     return model
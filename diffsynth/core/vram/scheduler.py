@@ -0,0 +1,162 @@
+import torch
+from collections import OrderedDict
+from .layers import AutoWrappedLinear, AutoWrappedModule, AutoWrappedNonRecurseModule
+from ..device import parse_device_type
+
+
+class LayerwiseOnloadScheduler:
+    # Overlaps the host-to-device weight transfers of VRAM-managed layers with computation.
+    # The call order of the layers is recorded in the first step. In the following steps, when layer k is called,
+    # the weights of the next `prefetch_size` layers are copied from pinned memory on a side stream,
+    # and the prefetched weights that are no longer ahead of layer k are evicted.
+    # Only layers whose weights are stored in memory (`onload` / `preparing` on CPU) are scheduled.
+
+    def __init__(self, prefetch_size=2, vram_limit=None, pin_memory=True):
+        self.prefetch_size = prefetch_size
+        # vram_limit (GB): prefetching is skipped if the allocated memory would exceed it.
+        self.vram_limit = vram_limit
+        self.pin_memory = pin_memory
+        self.layers = []
+        self.execution_order = []
+        self.position = {}
+        self.recording = True
+        self.stream = None
+        # {id(layer): (tensors, event, num_bytes)}
+        self.prefetched = OrderedDict()
+        self.prefetched_bytes = 0
+        self.stats = {"hit": 0, "miss": 0, "prefetched_bytes": 0, "evicted_bytes": 0}
+
+    def is_schedulable(self, layer):
+        if isinstance(layer, AutoWrappedNonRecurseModule) or not isinstance(layer, (AutoWrappedLinear, AutoWrappedModule)):
+            return False
+        if layer.disk_offload or "disk" in (layer.onload_device, layer.preparing_device):
+            # Disk offload is prefetched by `DiskMap`.
+            return False
+        return parse_device_type(layer.computation_device) == "cuda"
+
+    def attach(self, model):
+        if not torch.cuda.is_available():
+            return 0
+        for layer in model.modules():
+            if self.is_schedulable(layer):
+                layer.onload_scheduler = self
+                self.layers.append(layer)
+        if len(self.layers) > 0:
+            self.stream = torch.cuda.Stream(self.layers[0].computation_device)
+            if self.vram_limit is None:
+                self.vram_limit = self.layers[0].vram_limit
+        return len(self.layers)
+
+    def detach(self):
+        self.clear()
+        for layer in self.layers:
+            layer.onload_scheduler = None
+        self.layers = []
+        self.reset()
+
+    def reset(self):
+        # The call order is recorded again, e.g., after the model architecture is patched.
+        self.execution_order = []
+        self.position = {}
+        self.recording = True
+        self.clear()
+
+    def clear(self):
+        self.prefetched.clear()
+        self.prefetched_bytes = 0
+
+    def requires_transfer(self, layer):
+        if layer.state == 2:
+            torch_dtype, device = layer.preparing_dtype, layer.preparing_device
+        elif layer.state == 1:
+            torch_dtype, device = layer.onload_dtype, layer.onload_device
+        else:
+            return False
+        return not (torch_dtype == layer.computation_dtype and device == layer.computation_device)
+
+    def fetch_source_tensors(self, layer):
+        if isinstance(layer, AutoWrappedLinear):
+            tensors = {"weight": layer.weight, "bias": layer.bias}
+        else:
+            tensors = dict(layer.module.named_parameters())
+            tensors.update(layer.module.named_buffers())
+        return {name: tensor for name, tensor in tensors.items() if tensor is not None}
+
+    def pin_layer(self, layer):
+        # Copies from pageable memory are synchronous, so the weights are pinned once when the call order is recorded.
+        if not self.pin_memory:
+            return
+        try:
+            for tensor in self.fetch_source_tensors(layer).values():
+                if tensor.device.type == "cpu" and not tensor.is_pinned():
+                    tensor.data = tensor.data.pin_memory()
+        except RuntimeError as e:
+            print(f"Cannot pin the weights in memory: {e}. The weights will be copied from pageable memory.")
+            self.pin_memory = False
+
+    def transfer(self, layer):
+        tensors = {}
+        for name, tensor in self.fetch_source_tensors(layer).items():
+            tensor = tensor.to(device=layer.computation_device, non_blocking=True)
+            if tensor.is_floating_point():
+                tensor = tensor.to(dtype=layer.computation_dtype)
+            tensors[name] = tensor
+        return tensors
+
+    def record(self, layer):
+        key = id(layer)
+        if key in self.position:
+            # The first layer is called again, so the call order of a whole step has been recorded.
+            self.recording = False
+            return
+        self.position[key] = len(self.execution_order)
+        self.execution_order.append(layer)
+        self.pin_layer(layer)
+
+    def prefetch(self, layer):
+        num_layers = len(self.execution_order)
+        position = self.position[id(layer)]
+        upcoming = [self.execution_order[(position + i) % num_layers] for i in range(1, min(self.prefetch_size, num_layers - 1) + 1)]
+        upcoming_keys = set(id(i) for i in upcoming)
+        # Evict the layers that are not ahead of this layer, e.g., prefetched for a branch that is not executed.
+        for key in list(self.prefetched.keys()):
+            if key not in upcoming_keys:
+                _, _, num_bytes = self.prefetched.pop(key)
+                self.prefetched_bytes -= num_bytes
+                self.stats["evicted_bytes"] += num_bytes
+        for layer_ in upcoming:
+            if id(layer_) in self.prefetched or not self.requires_transfer(layer_):
+                continue
+            num_bytes = sum(tensor.numel() * tensor.element_size() for tensor in self.fetch_source_tensors(layer_).values())
+            if self.vram_limit is not None and (torch.cuda.memory_allocated(layer_.computation_device) + num_bytes) / (1024 ** 3) > self.vram_limit:
+                break
+            with torch.cuda.stream(self.stream):
+                tensors = self.transfer(layer_)
+                event = torch.cuda.Event()
+                event.record(self.stream)
+            self.prefetched[id(layer_)] = (tensors, event, num_bytes)
+            self.prefetched_bytes += num_bytes
+            self.stats["prefetched_bytes"] += num_bytes
+
+    def fetch(self, layer):
+        # Returns the tensors of the layer on the computation device, or None if the layer is not scheduled.
+        if self.recording:
+            self.record(layer)
+        if id(layer) not in self.position or not self.requires_transfer(layer):
+            return None
+        entry = self.prefetched.pop(id(layer), None)
+        if entry is None:
+            tensors = self.transfer(layer)
+            self.stats["miss"] += 1
+        else:
+            tensors, event, num_bytes = entry
+            self.prefetched_bytes -= num_bytes
+            stream = torch.cuda.current_stream(layer.computation_device)
+            stream.wait_event(event)
+            # The tensors are released after this call, so they should not be reused until the computation is done.
+            for tensor in tensors.values():
+                tensor.record_stream(stream)
+            self.stats["hit"] += 1
+        if not self.recording:
+            self.prefetch(layer)
+        return tensors
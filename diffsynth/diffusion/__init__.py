@@ -1,6 +1,8 @@
 from .flow_match import FlowMatchScheduler
 from .training_module import DiffusionTrainingModule
 from .logger import ModelLogger
+from .prompt_cache import PromptEmbeddingCache
+from .step_cache import StepCache, StepCacheCalibrator
 from .runner import launch_training_task, launch_data_process_task
 from .parsers import *
 from .loss import *
@@ -1,13 +1,14 @@
 from PIL import Image
-import torch
+import torch, os
 import numpy as np
 from einops import repeat, reduce
 from typing import Union
-from ..core import AutoTorchModule, AutoWrappedLinear, load_state_dict, ModelConfig, parse_device_type
+from ..core import AutoTorchModule, AutoWrappedLinear, LoRAAdapterSelection, LayerwiseOnloadScheduler, VRAMBudget, load_state_dict, ModelConfig, parse_device_type
 from ..utils.lora import GeneralLoRALoader
 from ..models.model_loader import ModelPool
 from ..utils.controlnet import ControlNetInput
 from ..core.device import get_device_name, IS_NPU_AVAILABLE
+from .prompt_cache import PromptEmbeddingCache
 
 
 class PipelineUnit:
@@ -77,10 +78,14 @@ class BasePipeline(torch.nn.Module):
         self.time_division_remainder = time_division_remainder
         # VRAM management
         self.vram_management_enabled = False
+        self.onload_schedulers = {}
+        self.vram_budget = None
         # Pipeline Unit Runner
         self.unit_runner = PipelineUnitRunner()
         # LoRA Loader
         self.lora_loader = GeneralLoRALoader
+        # Prompt Embedding Cache
+        self.prompt_cache = PromptEmbeddingCache()
         
         
     def to(self, *args, **kwargs):
@@ -120,9 +125,17 @@ class BasePipeline(torch.nn.Module):
 
 
     def preprocess_video(self, video, torch_dtype=None, device=None, pattern="B C T H W", min_value=-1, max_value=1):
-        # Transform a list of PIL.Image to torch.Tensor
-        video = [self.preprocess_image(image, torch_dtype=torch_dtype, device=device, min_value=min_value, max_value=max_value) for image in video]
-        video = torch.stack(video, dim=pattern.index("T") // 2)
+        # Transform a list of PIL.Image (or a uint8 np.ndarray / torch.Tensor in the shape (T, H, W, C)) to torch.Tensor
+        # The frames are transferred to the device as uint8 at once and converted together.
+        if isinstance(video, torch.Tensor):
+            video = video.to(device=device or self.device)
+        else:
+            if not isinstance(video, np.ndarray):
+                video = np.stack([np.asarray(image) for image in video])
+            video = torch.from_numpy(video).to(device=device or self.device)
+        video = video.to(dtype=torch_dtype or self.torch_dtype)
+        video = video * ((max_value - min_value) / 255) + min_value
+        video = repeat(video, f"T H W C -> {pattern}", **({"B": 1} if "B" in pattern else {}))
         return video
 
 
@@ -136,12 +149,19 @@ class BasePipeline(torch.nn.Module):
         return image
 
 
-    def vae_output_to_video(self, vae_output, pattern="B C T H W", min_value=-1, max_value=1):
-        # Transform a torch.Tensor to list of PIL.Image
+    def vae_output_to_video(self, vae_output, pattern="B C T H W", min_value=-1, max_value=1, output_type="pil"):
+        # Transform a torch.Tensor to list of PIL.Image, or a uint8 np.ndarray / torch.Tensor in the shape (T, H, W, C)
+        # The whole video is quantized on its device and copied to CPU at once.
         if pattern != "T H W C":
             vae_output = reduce(vae_output, f"{pattern} -> T H W C", reduction="mean")
-        video = [self.vae_output_to_image(image, pattern="H W C", min_value=min_value, max_value=max_value) for image in vae_output]
-        return video
+        video = ((vae_output - min_value) * (255 / (max_value - min_value))).clip(0, 255)
+        video = video.to(dtype=torch.uint8).to(device="cpu")
+        if output_type == "tensor":
+            return video
+        video = video.numpy()
+        if output_type == "numpy":
+            return video
+        return [Image.fromarray(frame) for frame in video]
 
 
     def load_models_to_device(self, model_names):
@@ -156,7 +176,11 @@ class BasePipeline(torch.nn.Module):
                             for module in model.modules():
                                 if hasattr(module, "offload"):
                                     module.offload()
+                    if name in self.onload_schedulers:
+                        self.onload_schedulers[name].clear()
             getattr(torch, self.device_type).empty_cache()
+            if self.vram_budget is not None:
+                self.vram_budget.calibrate()
             # onload models
             for name, model in self.named_children():
                 if name in model_names:
@@ -169,6 +193,41 @@ class BasePipeline(torch.nn.Module):
                                     module.onload()
 
 
+    def enable_layerwise_onload(self, model_names=None, prefetch_size=2, vram_limit=None, pin_memory=True):
+        # Overlaps the weight transfers of the layers stored in memory with computation. See `LayerwiseOnloadScheduler`.
+        for name, model in self.named_children():
+            if model_names is not None and name not in model_names:
+                continue
+            if not (hasattr(model, "vram_management_enabled") and model.vram_management_enabled) or name in self.onload_schedulers:
+                continue
+            scheduler = LayerwiseOnloadScheduler(prefetch_size=prefetch_size, vram_limit=vram_limit, pin_memory=pin_memory)
+            if scheduler.attach(model) > 0:
+                self.onload_schedulers[name] = scheduler
+
+
+    def disable_layerwise_onload(self):
+        for scheduler in self.onload_schedulers.values():
+            scheduler.detach()
+        self.onload_schedulers = {}
+
+
+    def encode_prompt_with_cache(self, unit: PipelineUnit, encode_fn, prompt, tokenizers, text_encoders, onload=True, **kwargs):
+        # The text encoders are onloaded only if the prompt embeddings are not cached.
+        # Extra keyword arguments (e.g., sequence length) are a part of the cache key.
+        use_cache = self.prompt_cache is not None and self.prompt_cache.enabled() and not getattr(self.scheduler, "training", False)
+        if use_cache:
+            key, persistable = self.prompt_cache.build_key(prompt, tokenizers, text_encoders, self.torch_dtype, unit=type(unit).__name__, **kwargs)
+            outputs = self.prompt_cache.fetch(key, persistable, self.device)
+            if outputs is not None:
+                return outputs
+        if onload:
+            self.load_models_to_device(unit.onload_model_names)
+        outputs = encode_fn()
+        if use_cache:
+            self.prompt_cache.store(key, persistable, outputs)
+        return outputs
+
+
     def generate_noise(self, shape, seed=None, rand_device="cpu", rand_torch_dtype=torch.float32, device=None, torch_dtype=None):
         # Initialize Gaussian noise
         generator = None if seed is None else torch.Generator(rand_device).manual_seed(seed)
@@ -210,9 +269,9 @@ class BasePipeline(torch.nn.Module):
     def step(self, scheduler, latents, progress_id, noise_pred, input_latents=None, inpaint_mask=None, **kwargs):
         timestep = scheduler.timesteps[progress_id]
         if inpaint_mask is not None:
-            noise_pred_expected = scheduler.return_to_timestep(scheduler.timesteps[progress_id], latents, input_latents)
+            noise_pred_expected = scheduler.return_to_timestep(scheduler.timesteps[progress_id], latents, input_latents, progress_id=progress_id)
             noise_pred = self.blend_with_mask(noise_pred_expected, noise_pred, inpaint_mask)
-        latents_next = scheduler.step(noise_pred, timestep, latents)
+        latents_next = scheduler.step(noise_pred, timestep, latents, progress_id=progress_id)
         return latents_next
     
     
@@ -237,6 +296,7 @@ class BasePipeline(torch.nn.Module):
         hotload=None,
         state_dict=None,
         verbose=1,
+        adapter_name=None,
     ):
         if state_dict is None:
             if isinstance(lora_config, str):
@@ -250,9 +310,14 @@ class BasePipeline(torch.nn.Module):
         lora = lora_loader.convert_state_dict(lora)
         if hotload is None:
             hotload = hasattr(module, "vram_management_enabled") and getattr(module, "vram_management_enabled")
+        # `lora_version` allows cached intermediate results (e.g., cross-attention K/V) to detect LoRA changes.
+        module.lora_version = getattr(module, "lora_version", 0) + 1
         if hotload:
             if not (hasattr(module, "vram_management_enabled") and getattr(module, "vram_management_enabled")):
                 raise ValueError("VRAM Management is not enabled. LoRA hotloading is not supported.")
+            if adapter_name is None:
+                self.num_lora_adapters = getattr(self, "num_lora_adapters", 0) + 1
+                adapter_name = f"lora_{self.num_lora_adapters}"
             updated_num = 0
             for _, module in module.named_modules():
                 if isinstance(module, AutoWrappedLinear):
@@ -261,10 +326,11 @@ class BasePipeline(torch.nn.Module):
                     lora_b_name = f'{name}.lora_B.weight'
                     if lora_a_name in lora and lora_b_name in lora:
                         updated_num += 1
-                        module.lora_A_weights.append(lora[lora_a_name] * alpha)
-                        module.lora_B_weights.append(lora[lora_b_name])
+                        module.add_lora_adapter(adapter_name, lora[lora_a_name], lora[lora_b_name], scale=alpha)
+            self.negative_lora_adapter_names = None
             if verbose >= 1:
-                print(f"{updated_num} tensors are patched by LoRA. You can use `pipe.clear_lora()` to clear all LoRA layers.")
+                print(f"{updated_num} tensors are patched by LoRA (adapter `{adapter_name}`). You can use `pipe.remove_lora(\"{adapter_name}\")` or `pipe.clear_lora()` to clear LoRA layers.")
+            return adapter_name
         else:
             lora_loader.fuse_lora_to_base_model(module, lora, alpha=alpha)
             
@@ -273,14 +339,35 @@ class BasePipeline(torch.nn.Module):
         cleared_num = 0
         for name, module in self.named_modules():
             if isinstance(module, AutoWrappedLinear):
-                if hasattr(module, "lora_A_weights"):
-                    if len(module.lora_A_weights) > 0:
-                        cleared_num += 1
-                    module.lora_A_weights.clear()
-                if hasattr(module, "lora_B_weights"):
-                    module.lora_B_weights.clear()
+                if len(module.lora_adapters) > 0:
+                    cleared_num += 1
+                module.clear_lora_adapters()
+        self.negative_lora_adapter_names = None
+        for model in self.children():
+            model.lora_version = getattr(model, "lora_version", 0) + 1
         if verbose >= 1:
             print(f"{cleared_num} LoRA layers are cleared.")
+
+
+    def remove_lora(self, adapter_name, verbose=1):
+        # Remove a hotloaded LoRA by its name. The other adapters are kept.
+        removed_num = 0
+        for model in self.children():
+            removed = sum(module.remove_lora_adapter(adapter_name) for module in model.modules() if isinstance(module, AutoWrappedLinear))
+            if removed > 0:
+                model.lora_version = getattr(model, "lora_version", 0) + 1
+            removed_num += removed
+        self.negative_lora_adapter_names = None
+        if verbose >= 1:
+            print(f"{removed_num} LoRA layers of adapter `{adapter_name}` are removed.")
+
+
+    def set_lora_scale(self, adapter_name, alpha):
+        # Change the scale of a hotloaded LoRA without reloading it.
+        for model in self.children():
+            updated = sum(module.set_lora_adapter_scale(adapter_name, alpha) for module in model.modules() if isinstance(module, AutoWrappedLinear))
+            if updated > 0:
+                model.lora_version = getattr(model, "lora_version", 0) + 1
         
     
     def download_and_load_models(self, model_configs: list[ModelConfig] = [], vram_limit: float = None):
@@ -296,9 +383,35 @@ class BasePipeline(torch.nn.Module):
                 vram_limit=vram_limit,
                 clear_parameters=model_config.clear_parameters,
             )
+        if vram_limit is not None and os.environ.get('DIFFSYNTH_VRAM_BUDGET_POLICY') is not None:
+            self.enable_vram_budget(vram_limit, models=model_pool.model)
         return model_pool
     
     
+    def enable_vram_budget(self, vram_limit=None, policy=None, priorities=None, models=None):
+        # Opt-in. All layers share one VRAM budget, so the promotion of a layer does not query the driver.
+        # The budget is calibrated before the activations are allocated, so `vram_limit` must leave room for them.
+        # By default, each layer checks the free VRAM (`check_free_vram`) instead.
+        modules = [module for model in (models if models is not None else self.children()) for module in model.modules() if isinstance(module, AutoTorchModule)]
+        if vram_limit is None:
+            vram_limit = next((module.vram_limit for module in modules if module.vram_limit is not None), None)
+        if vram_limit is None:
+            raise ValueError("`vram_limit` is required by the VRAM budget.")
+        self.vram_budget = VRAMBudget(vram_limit, policy=policy, priorities=priorities)
+        for module in modules:
+            module.vram_budget = self.vram_budget
+    
+    
+    def disable_vram_budget(self):
+        for model in self.children():
+            for module in model.modules():
+                if isinstance(module, AutoTorchModule):
+                    if module.vram_budget is not None:
+                        module.vram_budget.release(module)
+                    module.vram_budget = None
+        self.vram_budget = None
+    
+    
     def check_vram_management_state(self):
         vram_management_enabled = False
         for module in self.children():
@@ -307,15 +420,47 @@ class BasePipeline(torch.nn.Module):
         return vram_management_enabled
     
     
+    def fetch_lora_adapter_names(self, model):
+        adapter_names = {}
+        for module in model.modules():
+            if isinstance(module, AutoWrappedLinear):
+                adapter_names.update(dict.fromkeys(module.lora_adapters))
+        return list(adapter_names)
+
+
+    def load_positive_only_lora(self, state_dict):
+        # The LoRA is hotloaded once and kept until `state_dict` is changed or `clear_positive_only_lora` is called.
+        # It is excluded from the negative side by `LoRAAdapterSelection` instead of being cleared and reloaded in every step.
+        # The loaded `state_dict` itself is kept, so that it cannot be confused with another one reusing its `id()`.
+        if getattr(self, "positive_only_lora_state_dict", None) is not state_dict:
+            self.load_lora(self.dit, state_dict=state_dict, hotload=True, verbose=0, adapter_name="positive_only_lora")
+            self.positive_only_lora_state_dict = state_dict
+
+
+    def fetch_negative_lora_adapter_names(self):
+        # All adapters of the DiT except the positive-only LoRA.
+        # Computed once and reset by `load_lora`, `remove_lora` and `clear_lora`, instead of walking the modules in every step.
+        if getattr(self, "negative_lora_adapter_names", None) is None:
+            self.negative_lora_adapter_names = [name for name in self.fetch_lora_adapter_names(self.dit) if name != "positive_only_lora"]
+        return self.negative_lora_adapter_names
+
+
+    def clear_positive_only_lora(self):
+        if getattr(self, "positive_only_lora_state_dict", None) is not None:
+            self.remove_lora("positive_only_lora", verbose=0)
+            self.positive_only_lora_state_dict = None
+
+
     def cfg_guided_model_fn(self, model_fn, cfg_scale, inputs_shared, inputs_posi, inputs_nega, **inputs_others):
         if inputs_shared.get("positive_only_lora", None) is not None:
-            self.clear_lora(verbose=0)
-            self.load_lora(self.dit, state_dict=inputs_shared["positive_only_lora"], verbose=0)
+            self.load_positive_only_lora(inputs_shared["positive_only_lora"])
         noise_pred_posi = model_fn(**inputs_posi, **inputs_shared, **inputs_others)
         if cfg_scale != 1.0:
             if inputs_shared.get("positive_only_lora", None) is not None:
-                self.clear_lora(verbose=0)
-            noise_pred_nega = model_fn(**inputs_nega, **inputs_shared, **inputs_others)
+                with LoRAAdapterSelection([self.fetch_negative_lora_adapter_names()]):
+                    noise_pred_nega = model_fn(**inputs_nega, **inputs_shared, **inputs_others)
+            else:
+                noise_pred_nega = model_fn(**inputs_nega, **inputs_shared, **inputs_others)
             noise_pred = noise_pred_nega + cfg_scale * (noise_pred_posi - noise_pred_nega)
         else:
             noise_pred = noise_pred_posi
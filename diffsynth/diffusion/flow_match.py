@@ -128,44 +128,102 @@ class FlowMatchScheduler():
             bsmntw_weighing = bsmntw_weighing * (len(self.timesteps) / steps)
             bsmntw_weighing = bsmntw_weighing + bsmntw_weighing[1]
         self.linear_timesteps_weights = bsmntw_weighing
+        self.device_tables = {}
         
+    def build_index(self):
+        # sigma_deltas[i] = sigmas[i + 1] - sigmas[i], where the sigma after the last step is 0.
+        sigmas_next = torch.concat([self.sigmas[1:], torch.zeros((1,), dtype=self.sigmas.dtype)])
+        self.sigma_deltas = sigmas_next - self.sigmas
+        self.sigma_final_deltas = 0 - self.sigmas
+        # 0-dim CPU tensors for `progress_id`, so that a denoising step does not launch any lookup.
+        # Python floats are not used, since they are rounded differently from 0-dim tensors in low-precision arithmetic.
+        self.sigma_list = list(self.sigmas.unbind())
+        self.sigma_delta_list = list(self.sigma_deltas.unbind())
+        self.sigma_final_delta_list = list(self.sigma_final_deltas.unbind())
+        # The nearest timestep is found by binary search over the midpoints of the sorted timesteps,
+        # and resolved among the neighbors with the same arithmetic and tie-breaking as `argmin` over all timesteps.
+        sorted_timesteps, timestep_order = torch.sort(self.timesteps, stable=True)
+        # Equal timesteps resolve to the first one in `timesteps`.
+        positions = torch.arange(len(sorted_timesteps))
+        is_first = torch.concat([torch.ones((1,), dtype=torch.bool), sorted_timesteps[1:] != sorted_timesteps[:-1]])
+        self.timestep_order = timestep_order[torch.cummax(torch.where(is_first, positions, 0), dim=0).values]
+        self.sorted_timesteps = sorted_timesteps
+        self.timestep_boundaries = (sorted_timesteps[1:] + sorted_timesteps[:-1]) / 2
+        self.device_tables = {}
+
     def set_timesteps(self, num_inference_steps=100, denoising_strength=1.0, training=False, **kwargs):
         self.sigmas, self.timesteps = self.set_timesteps_fn(
             num_inference_steps=num_inference_steps,
             denoising_strength=denoising_strength,
             **kwargs,
         )
+        self.build_index()
         if training:
             self.set_training_weight()
             self.training = True
         else:
             self.training = False
 
-    def step(self, model_output, timestep, sample, to_final=False, **kwargs):
-        if isinstance(timestep, torch.Tensor):
-            timestep = timestep.cpu()
-        timestep_id = torch.argmin((self.timesteps - timestep).abs())
-        sigma = self.sigmas[timestep_id]
-        if to_final or timestep_id + 1 >= len(self.timesteps):
-            sigma_ = 0
+    def fetch_table(self, name, device):
+        # Lookup tables are copied to each device once, so that the lookups do not synchronize with the host.
+        key = (name, str(device))
+        if key not in self.device_tables:
+            self.device_tables[key] = getattr(self, name).to(device)
+        return self.device_tables[key]
+
+    def fetch_timestep_id(self, timestep):
+        # Supports Python scalars, 0-dim tensors and per-sample timesteps of shape (batch_size,).
+        if not isinstance(timestep, torch.Tensor):
+            timestep = torch.tensor(timestep, dtype=torch.float32)
+        device = timestep.device
+        boundaries = self.fetch_table("timestep_boundaries", device)
+        sorted_timesteps = self.fetch_table("sorted_timesteps", device)
+        timestep_order = self.fetch_table("timestep_order", device)
+        timestep = timestep.to(torch.promote_types(timestep.dtype, sorted_timesteps.dtype)).unsqueeze(-1)
+        candidates = torch.searchsorted(boundaries, timestep) + torch.arange(-1, 2, device=device)
+        candidates = candidates.clamp(0, len(sorted_timesteps) - 1)
+        distances = (sorted_timesteps[candidates] - timestep).abs()
+        timestep_ids = timestep_order[candidates]
+        # The nearest timestep, and the first one in `timesteps` among equally near ones.
+        nearest = distances == distances.min(dim=-1, keepdim=True).values
+        return torch.where(nearest, timestep_ids, len(sorted_timesteps)).min(dim=-1).values
+
+    def fetch_sigma(self, name, timestep, sample, progress_id=None):
+        # Returns the entry of a sigma table on the device of the timestep, broadcastable to `sample`.
+        if progress_id is None:
+            timestep_id = self.fetch_timestep_id(timestep)
+            value = self.fetch_table(name, timestep_id.device)[timestep_id]
         else:
-            sigma_ = self.sigmas[timestep_id + 1]
-        prev_sample = sample + model_output * (sigma_ - sigma)
+            value = self.fetch_table(name, sample.device)[progress_id.to(sample.device)]
+        if value.numel() == 1:
+            value = value.reshape(())
+        else:
+            # Per-sample timesteps
+            value = value.view(-1, *([1] * (sample.dim() - 1))).to(dtype=sample.dtype, device=sample.device)
+        return value
+
+    def step(self, model_output, timestep, sample, to_final=False, progress_id=None, **kwargs):
+        # If `progress_id` is provided, the sigmas are precomputed and the timestep is not looked up.
+        if progress_id is not None and not isinstance(progress_id, torch.Tensor):
+            sigma_delta = self.sigma_final_delta_list[progress_id] if to_final else self.sigma_delta_list[progress_id]
+        else:
+            sigma_delta = self.fetch_sigma("sigma_final_deltas" if to_final else "sigma_deltas", timestep, sample, progress_id=progress_id)
+        prev_sample = sample + model_output * sigma_delta
         return prev_sample
     
-    def return_to_timestep(self, timestep, sample, sample_stablized):
-        if isinstance(timestep, torch.Tensor):
-            timestep = timestep.cpu()
-        timestep_id = torch.argmin((self.timesteps - timestep).abs())
-        sigma = self.sigmas[timestep_id]
+    def return_to_timestep(self, timestep, sample, sample_stablized, progress_id=None):
+        if progress_id is not None and not isinstance(progress_id, torch.Tensor):
+            sigma = self.sigma_list[progress_id]
+        else:
+            sigma = self.fetch_sigma("sigmas", timestep, sample, progress_id=progress_id)
         model_output = (sample - sample_stablized) / sigma
         return model_output
     
-    def add_noise(self, original_samples, noise, timestep):
-        if isinstance(timestep, torch.Tensor):
-            timestep = timestep.cpu()
-        timestep_id = torch.argmin((self.timesteps - timestep).abs())
-        sigma = self.sigmas[timestep_id]
+    def add_noise(self, original_samples, noise, timestep, progress_id=None):
+        if progress_id is not None and not isinstance(progress_id, torch.Tensor):
+            sigma = self.sigma_list[progress_id]
+        else:
+            sigma = self.fetch_sigma("sigmas", timestep, original_samples, progress_id=progress_id)
         sample = (1 - sigma) * original_samples + sigma * noise
         return sample
     
@@ -173,7 +231,11 @@ class FlowMatchScheduler():
         target = noise - sample
         return target
     
-    def training_weight(self, timestep):
-        timestep_id = torch.argmin((self.timesteps - timestep.to(self.timesteps.device)).abs())
-        weights = self.linear_timesteps_weights[timestep_id]
+    def training_weight(self, timestep, progress_id=None):
+        if progress_id is None:
+            progress_id = self.fetch_timestep_id(timestep)
+        if isinstance(progress_id, torch.Tensor):
+            weights = self.fetch_table("linear_timesteps_weights", progress_id.device)[progress_id]
+        else:
+            weights = self.linear_timesteps_weights[progress_id]
         return weights
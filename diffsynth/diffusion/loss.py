@@ -6,18 +6,22 @@ def FlowMatchSFTLoss(pipe: BasePipeline, **inputs):
     max_timestep_boundary = int(inputs.get("max_timestep_boundary", 1) * len(pipe.scheduler.timesteps))
     min_timestep_boundary = int(inputs.get("min_timestep_boundary", 0) * len(pipe.scheduler.timesteps))
 
-    timestep_id = torch.randint(min_timestep_boundary, max_timestep_boundary, (1,))
+    # Each sample in the batch has its own timestep.
+    batch_size = inputs["input_latents"].shape[0]
+    timestep_id = torch.randint(min_timestep_boundary, max_timestep_boundary, (batch_size,))
     timestep = pipe.scheduler.timesteps[timestep_id].to(dtype=pipe.torch_dtype, device=pipe.device)
     
     noise = torch.randn_like(inputs["input_latents"])
+    # The sigma and the weight are looked up by the timestep in `torch_dtype`, which is the timestep seen by the model.
     inputs["latents"] = pipe.scheduler.add_noise(inputs["input_latents"], noise, timestep)
     training_target = pipe.scheduler.training_target(inputs["input_latents"], noise, timestep)
     
     models = {name: getattr(pipe, name) for name in pipe.in_iteration_models}
     noise_pred = pipe.model_fn(**models, **inputs, timestep=timestep)
     
-    loss = torch.nn.functional.mse_loss(noise_pred.float(), training_target.float())
-    loss = loss * pipe.scheduler.training_weight(timestep)
+    loss = torch.nn.functional.mse_loss(noise_pred.float(), training_target.float(), reduction="none")
+    loss = loss.reshape(batch_size, -1).mean(dim=1)
+    loss = (loss * pipe.scheduler.training_weight(timestep).to(loss.device)).mean()
     return loss
 
 
@@ -33,6 +33,7 @@ def add_model_config(parser: argparse.ArgumentParser):
 def add_training_config(parser: argparse.ArgumentParser):
     parser.add_argument("--learning_rate", type=float, default=1e-4, help="Learning rate.")
     parser.add_argument("--num_epochs", type=int, default=1, help="Number of epochs.")
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size. If it is larger than 1, samples with the same shape are grouped into batches (bucketing).")
     parser.add_argument("--trainable_models", type=str, default=None, help="Models to train, e.g., dit, vae, text_encoder.")
     parser.add_argument("--find_unused_parameters", default=False, action="store_true", help="Whether to find unused parameters in DDP.")
     parser.add_argument("--weight_decay", type=float, default=0.01, help="Weight decay.")
@@ -43,6 +44,8 @@ def add_output_config(parser: argparse.ArgumentParser):
     parser.add_argument("--output_path", type=str, default="./models", help="Output save path.")
     parser.add_argument("--remove_prefix_in_ckpt", type=str, default="pipe.dit.", help="Remove prefix in ckpt.")
     parser.add_argument("--save_steps", type=int, default=None, help="Number of checkpoint saving invervals. If None, checkpoints will be saved every epoch.")
+    parser.add_argument("--data_cache_format", type=str, default="safetensors", choices=["safetensors", "pth"], help="Format of the cached data in the data processing task. `safetensors`: memory-mapped shards with an index. `pth`: one pickle file per sample.")
+    parser.add_argument("--data_cache_shard_size", type=float, default=1e9, help="Number of bytes per shard of the cached data.")
     return parser
 
 def add_lora_config(parser: argparse.ArgumentParser):
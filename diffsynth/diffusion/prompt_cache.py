@@ -0,0 +1,141 @@
+import os, json, hashlib, itertools, torch
+from collections import OrderedDict
+from safetensors.torch import save_file, load_file, safe_open
+
+
+# Tokens identifying the text encoders without `model_fingerprint`. Unlike `id()`, a token is never reused after the model is released.
+TEXT_ENCODER_TOKENS = itertools.count()
+
+
+class PromptEmbeddingCache:
+    # An LRU cache of prompt embeddings.
+    # Entries are keyed by (prompt, tokenizer, text encoder weights, dtype), so the text encoder is not even onloaded on a hit.
+
+    def __init__(self, ram_budget=None, cache_dir=None):
+        if ram_budget is None:
+            ram_budget = float(os.environ.get('DIFFSYNTH_PROMPT_CACHE_RAM_BUDGET', 1e9))
+        if cache_dir is None:
+            cache_dir = os.environ.get('DIFFSYNTH_PROMPT_CACHE_DIR')
+        self.ram_budget = ram_budget
+        # An empty path disables the disk persistence.
+        self.cache_dir = cache_dir if cache_dir != "" else None
+        self.entries = OrderedDict()
+        self.ram_usage = 0
+        self.stats = {"hit": 0, "disk_hit": 0, "miss": 0}
+
+    def enabled(self):
+        return self.ram_budget > 0 or self.cache_dir is not None
+
+    def fetch_tokenizer_id(self, tokenizer):
+        if tokenizer is None:
+            return None
+        name = getattr(tokenizer, "name", None) or getattr(tokenizer, "name_or_path", None)
+        if isinstance(name, str) and os.path.exists(name):
+            name = os.path.abspath(name)
+        return [type(tokenizer).__name__, name, getattr(tokenizer, "seq_len", None), getattr(tokenizer, "clean", None)]
+
+    def fetch_text_encoder_id(self, text_encoder):
+        # `model_fingerprint` identifies the weight files and is set by `ModelPool`.
+        # Models without it are identified by a token assigned on their first use, and their embeddings are kept in memory only.
+        if text_encoder is None:
+            return None, True
+        fingerprint = getattr(text_encoder, "model_fingerprint", None)
+        lora_version = getattr(text_encoder, "lora_version", 0)
+        if fingerprint is None:
+            if getattr(text_encoder, "prompt_cache_token", None) is None:
+                text_encoder.prompt_cache_token = next(TEXT_ENCODER_TOKENS)
+            return [f"token-{text_encoder.prompt_cache_token}", lora_version], False
+        else:
+            # Fused LoRA changes the weights, so the embeddings cannot be shared across processes.
+            return [fingerprint, lora_version], lora_version == 0
+
+    def build_key(self, prompt, tokenizers, text_encoders, torch_dtype, **kwargs):
+        text_encoder_ids, persistable = [], True
+        for text_encoder in text_encoders:
+            text_encoder_id, persistable_ = self.fetch_text_encoder_id(text_encoder)
+            text_encoder_ids.append(text_encoder_id)
+            persistable = persistable and persistable_
+        key = json.dumps({
+            "prompt": prompt,
+            "tokenizers": [self.fetch_tokenizer_id(tokenizer) for tokenizer in tokenizers],
+            "text_encoders": text_encoder_ids,
+            "torch_dtype": str(torch_dtype),
+            **kwargs,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(key.encode(encoding="UTF-8")).hexdigest(), persistable
+
+    def flatten(self, value, name, tensors):
+        if isinstance(value, torch.Tensor):
+            tensors[name] = value.detach().to(device="cpu", copy=True).contiguous()
+            return {"type": "tensor", "name": name}
+        elif isinstance(value, (list, tuple)):
+            return {"type": "list", "items": [self.flatten(v, f"{name}.{i}", tensors) for i, v in enumerate(value)]}
+        elif isinstance(value, dict):
+            return {"type": "dict", "items": {k: self.flatten(v, f"{name}.{k}", tensors) for k, v in value.items()}}
+        elif value is None or isinstance(value, (bool, int, float, str)):
+            return {"type": "value", "value": value}
+        else:
+            raise TypeError(f"Unsupported type in prompt embeddings: {type(value)}")
+
+    def unflatten(self, structure, tensors, device):
+        if structure["type"] == "tensor":
+            # Copy the tensor so that in-place operations in the pipeline cannot modify the cache.
+            return tensors[structure["name"]].to(device=device, copy=True)
+        elif structure["type"] == "list":
+            return [self.unflatten(i, tensors, device) for i in structure["items"]]
+        elif structure["type"] == "dict":
+            return {k: self.unflatten(v, tensors, device) for k, v in structure["items"].items()}
+        else:
+            return structure["value"]
+
+    def file_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def insert(self, key, structure, tensors):
+        size = sum(tensor.numel() * tensor.element_size() for tensor in tensors.values())
+        if size > self.ram_budget:
+            return
+        if key in self.entries:
+            self.ram_usage -= self.entries.pop(key)[2]
+        self.entries[key] = (structure, tensors, size)
+        self.ram_usage += size
+        while self.ram_usage > self.ram_budget:
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.ram_usage -= size
+
+    def fetch(self, key, persistable, device):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            structure, tensors, _ = self.entries[key]
+            self.stats["hit"] += 1
+            return self.unflatten(structure, tensors, device)
+        if persistable and self.cache_dir is not None and os.path.exists(self.file_path(key)):
+            try:
+                with safe_open(self.file_path(key), framework="pt", device="cpu") as f:
+                    structure = json.loads(f.metadata()["structure"])
+                tensors = load_file(self.file_path(key), device="cpu")
+            except Exception as e:
+                print(f"Cannot load prompt embeddings from {self.file_path(key)}: {e}")
+            else:
+                self.insert(key, structure, tensors)
+                self.stats["disk_hit"] += 1
+                return self.unflatten(structure, tensors, device)
+        self.stats["miss"] += 1
+        return None
+
+    def store(self, key, persistable, value):
+        tensors = {}
+        structure = self.flatten(value, "value", tensors)
+        self.insert(key, structure, tensors)
+        if persistable and self.cache_dir is not None:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f"{self.file_path(key)}.{os.getpid()}.tmp"
+                save_file(tensors, tmp_path, metadata={"structure": json.dumps(structure)})
+                os.replace(tmp_path, self.file_path(key))
+            except OSError as e:
+                print(f"Cannot save prompt embeddings to {self.cache_dir}: {e}")
+
+    def clear(self):
+        self.entries.clear()
+        self.ram_usage = 0
@@ -3,6 +3,7 @@ from tqdm import tqdm
 from accelerate import Accelerator
 from .training_module import DiffusionTrainingModule
 from .logger import ModelLogger
+from ..core.data import LatentCacheWriter, BucketBatchSampler
 
 
 def launch_training_task(
@@ -15,6 +16,7 @@ def launch_training_task(
     num_workers: int = 1,
     save_steps: int = None,
     num_epochs: int = 1,
+    batch_size: int = 1,
     args = None,
 ):
     if args is not None:
@@ -23,10 +25,16 @@ def launch_training_task(
         num_workers = args.dataset_num_workers
         save_steps = args.save_steps
         num_epochs = args.num_epochs
+        batch_size = args.batch_size
     
     optimizer = torch.optim.AdamW(model.trainable_modules(), lr=learning_rate, weight_decay=weight_decay)
     scheduler = torch.optim.lr_scheduler.ConstantLR(optimizer)
-    dataloader = torch.utils.data.DataLoader(dataset, shuffle=True, collate_fn=lambda x: x[0], num_workers=num_workers)
+    if batch_size > 1:
+        # Samples with the same shape are grouped into batches. Each batch is a list of samples.
+        batch_sampler = BucketBatchSampler(dataset, batch_size=batch_size)
+        dataloader = torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=lambda x: x, num_workers=num_workers)
+    else:
+        dataloader = torch.utils.data.DataLoader(dataset, shuffle=True, collate_fn=lambda x: x[0], num_workers=num_workers)
     
     model, optimizer, dataloader, scheduler = accelerator.prepare(model, optimizer, dataloader, scheduler)
     
@@ -53,19 +61,30 @@ def launch_data_process_task(
     model: DiffusionTrainingModule,
     model_logger: ModelLogger,
     num_workers: int = 8,
+    data_cache_format: str = "safetensors",
+    data_cache_shard_size: float = 1e9,
     args = None,
 ):
     if args is not None:
         num_workers = args.dataset_num_workers
+        data_cache_format = args.data_cache_format
+        data_cache_shard_size = args.data_cache_shard_size
         
     dataloader = torch.utils.data.DataLoader(dataset, shuffle=False, collate_fn=lambda x: x[0], num_workers=num_workers)
     model, dataloader = accelerator.prepare(model, dataloader)
+    folder = os.path.join(model_logger.output_path, str(accelerator.process_index))
+    os.makedirs(folder, exist_ok=True)
+    if data_cache_format == "safetensors":
+        writer = LatentCacheWriter(folder, shard_size=data_cache_shard_size)
     
     for data_id, data in enumerate(tqdm(dataloader)):
         with accelerator.accumulate(model):
             with torch.no_grad():
-                folder = os.path.join(model_logger.output_path, str(accelerator.process_index))
-                os.makedirs(folder, exist_ok=True)
-                save_path = os.path.join(model_logger.output_path, str(accelerator.process_index), f"{data_id}.pth")
                 data = model(data)
-                torch.save(data, save_path)
+                if data_cache_format == "safetensors":
+                    writer.write(data)
+                else:
+                    save_path = os.path.join(folder, f"{data_id}.pth")
+                    torch.save(data, save_path)
+    if data_cache_format == "safetensors":
+        writer.close()
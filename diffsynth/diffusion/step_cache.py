@@ -0,0 +1,287 @@
+import os, json
+import numpy as np
+
+
+# Rescale coefficients of TeaCache, fitted on the modulated input of each model.
+BUILTIN_STEP_CACHE_CONFIGS = {
+    "Wan2.1-T2V-1.3B": {"policy": "teacache", "coefficients": [-5.21862437e+04, 9.23041404e+03, -5.28275948e+02, 1.36987616e+01, -4.99875664e-02]},
+    "Wan2.1-T2V-14B": {"policy": "teacache", "coefficients": [-3.03318725e+05, 4.90537029e+04, -2.65530556e+03, 5.87365115e+01, -3.15583525e-01]},
+    "Wan2.1-I2V-14B-480P": {"policy": "teacache", "coefficients": [2.57151496e+05, -3.54229917e+04, 1.40286849e+03, -1.35890334e+01, 1.32517977e-01]},
+    "Wan2.1-I2V-14B-720P": {"policy": "teacache", "coefficients": [8.10705460e+03, 2.13393892e+03, -3.72934672e+02, 1.66203073e+01, -4.17769401e-02]},
+    "FLUX.1-dev": {"policy": "teacache", "coefficients": [4.98651651e+02, -2.83781631e+02, 5.58554382e+01, -3.82021401e+00, 2.64230861e-01]},
+}
+
+
+def fetch_step_cache_config_path(config_path=None):
+    if config_path is None:
+        if os.environ.get('DIFFSYNTH_STEP_CACHE_CONFIG_PATH') is not None:
+            config_path = os.environ.get('DIFFSYNTH_STEP_CACHE_CONFIG_PATH')
+        else:
+            config_path = os.path.join(os.path.expanduser("~"), ".cache", "diffsynth", "step_cache_configs.json")
+    return config_path
+
+
+def load_step_cache_configs(config_path=None):
+    # The calibrated configs on disk override the built-in configs.
+    configs = dict(BUILTIN_STEP_CACHE_CONFIGS)
+    config_path = fetch_step_cache_config_path(config_path)
+    if config_path != "" and os.path.exists(config_path):
+        try:
+            with open(config_path, "r", encoding="utf-8") as f:
+                configs.update(json.load(f).get("configs", {}))
+        except (OSError, ValueError) as e:
+            print(f"Cannot load the step cache configs from {config_path}: {e}")
+    return configs
+
+
+def relative_l1_distance(x, y):
+    return ((x - y).abs().mean() / y.abs().mean()).item()
+
+
+class StepCachePolicy:
+    # Decides whether the transformer blocks of a step can be skipped.
+    # `decide` is called before the blocks if `requires_first_block` is False, otherwise after the first block.
+    requires_modulated_input = False
+    requires_first_block = False
+
+    def reset(self):
+        pass
+
+    def decide(self, step_id, value, forced=False):
+        # value: the modulated input, or the residual of the first block.
+        # forced: the step is computed anyway, e.g., the first and the last steps.
+        return False
+
+
+class TeaCachePolicy(StepCachePolicy):
+    # Skips the steps until the accumulated (rescaled) relative L1 distance of the modulated input exceeds the threshold.
+    requires_modulated_input = True
+
+    def __init__(self, rel_l1_thresh, coefficients=None):
+        self.rel_l1_thresh = rel_l1_thresh
+        # Without coefficients, the distance is not rescaled.
+        self.rescale_func = np.poly1d(coefficients if coefficients is not None else [1.0, 0.0])
+        self.reset()
+
+    def reset(self):
+        self.accumulated_rel_l1_distance = 0
+        self.previous_value = None
+
+    def decide(self, step_id, value, forced=False):
+        skip = False
+        if forced or self.previous_value is None or self.previous_value.shape != value.shape:
+            self.accumulated_rel_l1_distance = 0
+        else:
+            self.accumulated_rel_l1_distance += self.rescale_func(relative_l1_distance(value, self.previous_value))
+            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
+                skip = True
+            else:
+                self.accumulated_rel_l1_distance = 0
+        self.previous_value = value
+        return skip
+
+
+class FirstBlockCachePolicy(StepCachePolicy):
+    # Runs the first block in every step, and skips the remaining blocks if its residual barely changes.
+    # It requires no calibration.
+    requires_first_block = True
+
+    def __init__(self, rel_l1_thresh=0.08):
+        self.rel_l1_thresh = rel_l1_thresh
+        self.reset()
+
+    def reset(self):
+        self.previous_value = None
+
+    def decide(self, step_id, value, forced=False):
+        skip = False
+        if not forced and self.previous_value is not None and self.previous_value.shape == value.shape:
+            skip = relative_l1_distance(value, self.previous_value) < self.rel_l1_thresh
+        self.previous_value = value
+        return skip
+
+
+class FixedIntervalPolicy(StepCachePolicy):
+    # Computes one step out of `interval` steps.
+
+    def __init__(self, interval=2):
+        self.interval = max(int(interval), 1)
+        self.reset()
+
+    def reset(self):
+        self.num_skipped_steps = 0
+
+    def decide(self, step_id, value, forced=False):
+        skip = not forced and self.num_skipped_steps < self.interval - 1
+        self.num_skipped_steps = self.num_skipped_steps + 1 if skip else 0
+        return skip
+
+
+class StepCacheCalibrationPolicy(StepCachePolicy):
+    # Never skips. The relative L1 distances of the modulated input and of the residual between consecutive steps are recorded.
+    requires_modulated_input = True
+
+    def __init__(self, calibrator):
+        self.calibrator = calibrator
+        self.reset()
+
+    def reset(self):
+        self.previous_value = None
+        self.previous_residual = None
+        self.input_distance = None
+
+    def decide(self, step_id, value, forced=False):
+        if step_id == 0:
+            self.reset()
+        if self.previous_value is not None and self.previous_value.shape == value.shape:
+            self.input_distance = relative_l1_distance(value, self.previous_value)
+        self.previous_value = value
+        return False
+
+    def observe(self, residual):
+        if self.input_distance is not None and self.previous_residual is not None and self.previous_residual.shape == residual.shape:
+            self.calibrator.record(self.input_distance, relative_l1_distance(residual, self.previous_residual))
+        self.previous_residual = residual
+        self.input_distance = None
+
+
+class StepCache:
+    # Skips the transformer blocks of a DiT in some denoising steps and reuses the residual of the last computed step.
+    # Usage in `model_fn`:
+    #     if step_cache.check(x, modulated_input, model=dit): x = step_cache.update(x)
+    #     else: run the blocks, calling `check_first_block` after the first block, and then `step_cache.store(x)`.
+    # The first `warmup_steps` steps and the last step are always computed.
+    # A StepCache should not be shared by the positive and negative sides of classifier-free guidance.
+
+    def __init__(self, num_inference_steps, policy="teacache", thresh=None, model_id=None, coefficients=None, warmup_steps=1, config_path=None):
+        self.num_inference_steps = num_inference_steps
+        self.warmup_steps = warmup_steps
+        if isinstance(policy, StepCacheCalibrator):
+            policy = policy.create_policy()
+        elif isinstance(policy, str):
+            policy = self.create_policy(policy, thresh, model_id, coefficients, config_path)
+        self.policy = policy
+        self.step = 0
+        self.step_id = 0
+        self.skipped = False
+        self.model_key = None
+        self.previous_hidden_states = None
+        self.previous_residual = None
+
+    @staticmethod
+    def create_policy(policy, thresh=None, model_id=None, coefficients=None, config_path=None):
+        if policy == "teacache":
+            if coefficients is None and model_id:
+                configs = load_step_cache_configs(config_path)
+                if model_id not in configs:
+                    raise ValueError(f"{model_id} is not a supported step cache model id. Please choose a valid model id in ({', '.join(configs)}), or calibrate it with `StepCacheCalibrator`.")
+                coefficients = configs[model_id]["coefficients"]
+            return TeaCachePolicy(rel_l1_thresh=0.2 if thresh is None else thresh, coefficients=coefficients)
+        elif policy == "first_block":
+            return FirstBlockCachePolicy(rel_l1_thresh=0.08 if thresh is None else thresh)
+        elif policy == "interval":
+            return FixedIntervalPolicy(interval=2 if thresh is None else thresh)
+        else:
+            raise ValueError(f"Unsupported step cache policy: {policy}. Supported policies: teacache, first_block, interval.")
+
+    def reset(self):
+        self.step = 0
+        self.skipped = False
+        self.previous_hidden_states = None
+        self.previous_residual = None
+        self.policy.reset()
+
+    def is_forced(self, step_id):
+        return step_id < self.warmup_steps or step_id == self.num_inference_steps - 1 or self.previous_residual is None
+
+    def check(self, hidden_states, modulated_input=None, model=None):
+        # Returns True if all blocks are skipped in this step.
+        # modulated_input: a tensor, or a function returning it, which is only called if the policy requires it.
+        step_id = self.step
+        self.step = (self.step + 1) % self.num_inference_steps
+        if model is not None and id(model) != self.model_key:
+            # The residual of another model (e.g., the low-noise DiT of Wan2.2) cannot be reused.
+            self.model_key = id(model)
+            self.previous_residual = None
+            self.policy.reset()
+        self.step_id = step_id
+        self.skipped = False
+        if self.policy.requires_first_block:
+            self.previous_hidden_states = None
+            return False
+        if self.policy.requires_modulated_input:
+            if callable(modulated_input):
+                modulated_input = modulated_input()
+            modulated_input = modulated_input.detach().clone()
+        if self.policy.decide(step_id, modulated_input, forced=self.is_forced(step_id)):
+            self.skipped = True
+            return True
+        self.previous_hidden_states = hidden_states.clone()
+        return False
+
+    def check_first_block(self, hidden_states, block_input):
+        # Called after the first block. Returns True if the remaining blocks are skipped.
+        if not self.policy.requires_first_block:
+            return False
+        if self.policy.decide(self.step_id, (hidden_states - block_input).detach(), forced=self.is_forced(self.step_id)):
+            self.skipped = True
+            return True
+        self.previous_hidden_states = hidden_states.clone()
+        return False
+
+    def store(self, hidden_states):
+        if self.skipped or self.previous_hidden_states is None:
+            return
+        self.previous_residual = hidden_states - self.previous_hidden_states
+        self.previous_hidden_states = None
+        if isinstance(self.policy, StepCacheCalibrationPolicy):
+            self.policy.observe(self.previous_residual.detach())
+
+    def update(self, hidden_states):
+        return hidden_states + self.previous_residual
+
+
+class StepCacheCalibrator:
+    # Fits the rescale coefficients of TeaCache for a DiT.
+    # Pass it as the step cache policy of a pipeline, generate a few samples with the target settings, then call `save`.
+    # The rescale function maps the relative L1 distance of the modulated input to that of the block residual between consecutive steps.
+
+    def __init__(self, model_id, order=4):
+        self.model_id = model_id
+        self.order = order
+        self.samples = []
+
+    def create_policy(self):
+        return StepCacheCalibrationPolicy(self)
+
+    def record(self, input_distance, residual_distance):
+        self.samples.append((input_distance, residual_distance))
+
+    def fit(self):
+        if len(self.samples) <= self.order:
+            raise ValueError(f"At least {self.order + 1} samples are required to fit the coefficients, but only {len(self.samples)} samples are recorded.")
+        x, y = np.array(self.samples, dtype=np.float64).T
+        coefficients = np.polyfit(x, y, self.order)
+        error = float(np.abs(np.poly1d(coefficients)(x) - y).mean() / max(np.abs(y).mean(), 1e-12))
+        return {"policy": "teacache", "coefficients": coefficients.tolist(), "num_samples": len(self.samples), "relative_fitting_error": error}
+
+    def save(self, config_path=None):
+        # Merge with the configs written by other processes, then replace the file atomically.
+        config = self.fit()
+        config_path = fetch_step_cache_config_path(config_path)
+        if config_path == "":
+            return config
+        configs = {}
+        if os.path.exists(config_path):
+            try:
+                with open(config_path, "r", encoding="utf-8") as f:
+                    configs = json.load(f).get("configs", {})
+            except (OSError, ValueError):
+                configs = {}
+        configs[self.model_id] = config
+        os.makedirs(os.path.dirname(os.path.abspath(config_path)), exist_ok=True)
+        tmp_path = f"{config_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"configs": configs}, f, indent=4)
+        os.replace(tmp_path, config_path)
+        return config
@@ -84,6 +84,63 @@ class DiffusionTrainingModule(torch.nn.Module):
         else:
             return data
     
+    def run_pipeline_units(self, data, inputs=None):
+        if isinstance(data, list) or isinstance(inputs, list):
+            # A bucketed batch. The samples are processed by the pipeline units one by one, then stacked along the batch dimension.
+            if inputs is None: inputs = [None] * len(data)
+            if not isinstance(data, list): data = [data] * len(inputs)
+            return self.collate_pipeline_inputs([self.run_pipeline_units(data_, inputs_) for data_, inputs_ in zip(data, inputs)])
+        if inputs is None: inputs = self.get_pipeline_inputs(data)
+        inputs = self.transfer_data_to_device(inputs, self.pipe.device, self.pipe.torch_dtype)
+        for unit in self.pipe.units:
+            inputs = self.pipe.unit_runner(unit, self.pipe, *inputs)
+        return inputs
+    
+    
+    def forward_per_sample(self, data, inputs=None):
+        # For the models whose `model_fn` only processes one sample, the samples of a bucketed batch are computed one by one and the losses are averaged.
+        if inputs is None: inputs = [None] * len(data)
+        if not isinstance(data, list): data = [data] * len(inputs)
+        return torch.stack([self.forward(data_, inputs_) for data_, inputs_ in zip(data, inputs)]).mean()
+    
+    
+    def collate_pipeline_inputs(self, batch, name="inputs"):
+        data = batch[0]
+        if isinstance(data, torch.Tensor):
+            if data.dim() > 0 and data.shape[0] == 1:
+                if any(i.shape != data.shape for i in batch):
+                    raise ValueError(f"`{name}` cannot be stacked into a batch. Shapes: {[tuple(i.shape) for i in batch]}")
+                return torch.concat(batch, dim=0)
+            elif all(torch.equal(i, data) for i in batch):
+                return data
+            else:
+                raise ValueError(f"`{name}` cannot be stacked into a batch.")
+        elif isinstance(data, dict):
+            return {key: self.collate_pipeline_inputs([i[key] for i in batch], name=key) for key in data}
+        elif isinstance(data, tuple):
+            return tuple(self.collate_pipeline_inputs([i[j] for i in batch], name=name) for j in range(len(data)))
+        elif isinstance(data, list) and len(data) > 0 and isinstance(data[0], torch.Tensor):
+            # Lists of tensors (e.g., variable-length prompt embeddings) are concatenated.
+            return sum(batch, [])
+        elif all(self.is_same_pipeline_input(i, data) for i in batch):
+            # Other inputs (e.g., height and width) are identical in a bucket.
+            return data
+        else:
+            # Inputs that differ between the samples (e.g., prompts) are not dropped but kept per sample.
+            return list(batch)
+    
+    
+    @staticmethod
+    def is_same_pipeline_input(x, y):
+        if x is y:
+            return True
+        try:
+            return bool(x == y)
+        except (TypeError, ValueError, RuntimeError):
+            # E.g., arrays or dataclasses containing tensors.
+            return False
+    
+    
     def parse_vram_config(self, fp8=False, offload=False, device="cpu"):
         if fp8:
             return {
@@ -954,6 +954,7 @@ class Flux2DiT(torch.nn.Module):
         guidance: torch.Tensor = None,
         joint_attention_kwargs: Optional[Dict[str, Any]] = None,
         return_dict: bool = True,
+        step_cache=None,
         use_gradient_checkpointing=False,
         use_gradient_checkpointing_offload=False,
     ) -> Union[torch.Tensor]:
@@ -1019,8 +1020,14 @@ class Flux2DiT(torch.nn.Module):
             torch.cat([text_rotary_emb[1], image_rotary_emb[1]], dim=0),
         )
 
+        # Step cache: the transformer blocks are skipped and the residual of image tokens is reused.
+        step_cache_update = step_cache is not None and step_cache.check(hidden_states, temb, model=self)
+        if step_cache_update:
+            hidden_states = step_cache.update(hidden_states)
+        first_block_input = hidden_states
+
         # 4. Double Stream Transformer Blocks
-        for index_block, block in enumerate(self.transformer_blocks):
+        for index_block, block in enumerate([] if step_cache_update else self.transformer_blocks):
             encoder_hidden_states, hidden_states = gradient_checkpoint_forward(
                 block,
                 use_gradient_checkpointing=use_gradient_checkpointing,
@@ -1032,11 +1039,15 @@ class Flux2DiT(torch.nn.Module):
                 image_rotary_emb=concat_rotary_emb,
                 joint_attention_kwargs=joint_attention_kwargs,
             )
+            if index_block == 0 and step_cache is not None and step_cache.check_first_block(hidden_states, first_block_input):
+                hidden_states = step_cache.update(hidden_states)
+                step_cache_update = True
+                break
         # Concatenate text and image streams for single-block inference
         hidden_states = torch.cat([encoder_hidden_states, hidden_states], dim=1)
 
         # 5. Single Stream Transformer Blocks
-        for index_block, block in enumerate(self.single_transformer_blocks):
+        for index_block, block in enumerate([] if step_cache_update else self.single_transformer_blocks):
             hidden_states = gradient_checkpoint_forward(
                 block,
                 use_gradient_checkpointing=use_gradient_checkpointing,
@@ -1049,6 +1060,8 @@ class Flux2DiT(torch.nn.Module):
             )
         # Remove text tokens from concatenated stream
         hidden_states = hidden_states[:, num_txt_tokens:, ...]
+        if step_cache is not None:
+            step_cache.store(hidden_states)
 
         # 6. Output layers
         hidden_states = self.norm_out(hidden_states, temb)
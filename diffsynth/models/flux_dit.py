@@ -1,12 +1,11 @@
 import torch
 from .general_modules import TimestepEmbeddings, AdaLayerNorm, RMSNorm
 from einops import rearrange
+from ..core.attention import attention_forward
 
 
 def interact_with_ipadapter(hidden_states, q, ip_k, ip_v, scale=1.0):
-    batch_size, num_tokens = hidden_states.shape[0:2]
-    ip_hidden_states = torch.nn.functional.scaled_dot_product_attention(q, ip_k, ip_v)
-    ip_hidden_states = ip_hidden_states.transpose(1, 2).reshape(batch_size, num_tokens, -1)
+    ip_hidden_states = attention_forward(q, ip_k, ip_v, out_pattern="b s (n d)", implementation="torch")
     hidden_states = hidden_states + scale * ip_hidden_states
     return hidden_states
 
@@ -90,8 +89,7 @@ class FluxJointAttention(torch.nn.Module):
 
         q, k = self.apply_rope(q, k, image_rotary_emb)
 
-        hidden_states = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
-        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, self.num_heads * self.head_dim)
+        hidden_states = attention_forward(q, k, v, out_pattern="b s (n d)", dims={"n": self.num_heads}, attn_mask=attn_mask, implementation="torch")
         hidden_states = hidden_states.to(q.dtype)
         hidden_states_b, hidden_states_a = hidden_states[:, :hidden_states_b.shape[1]], hidden_states[:, hidden_states_b.shape[1]:]
         if ipadapter_kwargs_list is not None:
@@ -179,8 +177,7 @@ class FluxSingleAttention(torch.nn.Module):
 
         q, k = self.apply_rope(q_a, k_a, image_rotary_emb)
 
-        hidden_states = torch.nn.functional.scaled_dot_product_attention(q, k, v)
-        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, self.num_heads * self.head_dim)
+        hidden_states = attention_forward(q, k, v, out_pattern="b s (n d)", dims={"n": self.num_heads}, implementation="torch")
         hidden_states = hidden_states.to(q.dtype)
         return hidden_states
 
@@ -234,8 +231,7 @@ class FluxSingleTransformerBlock(torch.nn.Module):
 
         q, k = self.apply_rope(q, k, image_rotary_emb)
 
-        hidden_states = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask)
-        hidden_states = hidden_states.transpose(1, 2).reshape(batch_size, -1, self.num_heads * self.head_dim)
+        hidden_states = attention_forward(q, k, v, out_pattern="b s (n d)", dims={"n": self.num_heads}, attn_mask=attn_mask, implementation="torch")
         hidden_states = hidden_states.to(q.dtype)
         if ipadapter_kwargs_list is not None:
             hidden_states = interact_with_ipadapter(hidden_states, q, **ipadapter_kwargs_list)
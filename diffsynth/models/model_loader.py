@@ -1,4 +1,4 @@
-from ..core.loader import load_model, hash_model_file
+from ..core.loader import load_model, ModelFingerprintIndex
 from ..core.vram import AutoWrappedModule
 from ..configs import MODEL_CONFIGS, VRAM_MANAGEMENT_MODULE_MAPS
 import importlib, json, torch
@@ -9,6 +9,7 @@ class ModelPool:
         self.model = []
         self.model_name = []
         self.model_path = []
+        self.fingerprint_index = ModelFingerprintIndex()
         
     def import_model_class(self, model_class):
         split = model_class.rfind(".")
@@ -63,12 +64,13 @@ class ModelPool:
         print(f"Loading models from: {json.dumps(path, indent=4)}")
         if vram_config is None:
             vram_config = self.default_vram_config()
-        model_hash = hash_model_file(path)
+        model_hash = self.fingerprint_index.hash_model_file(path, model_configs=MODEL_CONFIGS)
         loaded = False
         for config in MODEL_CONFIGS:
             if config["model_hash"] == model_hash:
                 model = self.load_model_file(config, path, vram_config, vram_limit=vram_limit)
                 if clear_parameters: self.clear_parameters(model)
+                model.model_fingerprint = self.fingerprint_index.fetch_model_fingerprint(path)
                 self.model.append(model)
                 model_name = config["model_name"]
                 self.model_name.append(model_name)
@@ -85,15 +87,16 @@ class ModelPool:
         loaded = False
         model = self.load_model_file(model_config, model_config["path"], vram_config, vram_limit=vram_limit)
         if clear_parameters: self.clear_parameters(model)
+        model.model_fingerprint = self.fingerprint_index.fetch_model_fingerprint(model_config["path"])
         self.model.append(model)
         model_name = model_config["model_name"]
         self.model_name.append(model_name)
         self.model_path.append(model_config["path"])
         model_info = {"model_name": model_name, "model_class": model_config["model_class"], "extra_kwargs": model_config.get("extra_kwargs")}
-        print(f"Loaded model: {json.dumps(model_info, indent=4)},Model Hash: {hash_model_file(model_config['path'])}")
+        print(f"Loaded model: {json.dumps(model_info, indent=4)},Model Hash: {self.fingerprint_index.hash_model_file(model_config['path'])}")
         loaded = True
         if not loaded:
-            raise ValueError(f"Cannot detect the model type. File: {model_config['path']}. Model hash: {hash_model_file(model_config['path'])}")
+            raise ValueError(f"Cannot detect the model type. File: {model_config['path']}. Model hash: {self.fingerprint_index.hash_model_file(model_config['path'])}")
 
     def fetch_model(self, model_name, index=None):
         fetched_models = []
@@ -3,6 +3,7 @@ import torch.nn as nn
 from typing import Tuple, Optional, Union, List
 from einops import rearrange
 from .general_modules import TimestepEmbeddings, RMSNorm, AdaLayerNorm
+from ..core.attention import attention_forward
 
 try:
     import flash_attn_interface
@@ -12,30 +13,20 @@ except ModuleNotFoundError:
 
 
 def qwen_image_flash_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, num_heads: int, attention_mask = None, enable_fp8_attention: bool = False):
-    if FLASH_ATTN_3_AVAILABLE and attention_mask is None:
-        if not enable_fp8_attention:
-            q = rearrange(q, "b n s d -> b s n d", n=num_heads)
-            k = rearrange(k, "b n s d -> b s n d", n=num_heads)
-            v = rearrange(v, "b n s d -> b s n d", n=num_heads)
-            x = flash_attn_interface.flash_attn_func(q, k, v)
-            if isinstance(x, tuple):
-                x = x[0]
-            x = rearrange(x, "b s n d -> b s (n d)", n=num_heads)
-        else:
-            origin_dtype = q.dtype
-            q_std, k_std, v_std = q.std(), k.std(), v.std()
-            q, k, v = (q / q_std).to(torch.float8_e4m3fn), (k / k_std).to(torch.float8_e4m3fn), (v / v_std).to(torch.float8_e4m3fn)
-            q = rearrange(q, "b n s d -> b s n d", n=num_heads)
-            k = rearrange(k, "b n s d -> b s n d", n=num_heads)
-            v = rearrange(v, "b n s d -> b s n d", n=num_heads)
-            x = flash_attn_interface.flash_attn_func(q, k, v, softmax_scale=q_std * k_std / math.sqrt(q.size(-1)))
-            if isinstance(x, tuple):
-                x = x[0]
-            x = x.to(origin_dtype) * v_std
-            x = rearrange(x, "b s n d -> b s (n d)", n=num_heads)
+    if FLASH_ATTN_3_AVAILABLE and attention_mask is None and enable_fp8_attention:
+        origin_dtype = q.dtype
+        q_std, k_std, v_std = q.std(), k.std(), v.std()
+        q, k, v = (q / q_std).to(torch.float8_e4m3fn), (k / k_std).to(torch.float8_e4m3fn), (v / v_std).to(torch.float8_e4m3fn)
+        q = rearrange(q, "b n s d -> b s n d", n=num_heads)
+        k = rearrange(k, "b n s d -> b s n d", n=num_heads)
+        v = rearrange(v, "b n s d -> b s n d", n=num_heads)
+        x = flash_attn_interface.flash_attn_func(q, k, v, softmax_scale=q_std * k_std / math.sqrt(q.size(-1)))
+        if isinstance(x, tuple):
+            x = x[0]
+        x = x.to(origin_dtype) * v_std
+        x = rearrange(x, "b s n d -> b s (n d)", n=num_heads)
     else:
-        x = torch.nn.functional.scaled_dot_product_attention(q, k, v, attn_mask=attention_mask)
-        x = rearrange(x, "b n s d -> b s (n d)", n=num_heads)
+        x = attention_forward(q, k, v, out_pattern="b s (n d)", dims={"n": num_heads}, attn_mask=attention_mask, implementation="flash_attention_3" if FLASH_ATTN_3_AVAILABLE else "torch")
     return x
 
 
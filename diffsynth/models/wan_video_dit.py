@@ -5,59 +5,32 @@ import math
 from typing import Tuple, Optional
 from einops import rearrange
 from .wan_video_camera_controller import SimpleAdapter
-try:
-    import flash_attn_interface
-    FLASH_ATTN_3_AVAILABLE = True
-except ModuleNotFoundError:
-    FLASH_ATTN_3_AVAILABLE = False
-
-try:
-    import flash_attn
-    FLASH_ATTN_2_AVAILABLE = True
-except ModuleNotFoundError:
-    FLASH_ATTN_2_AVAILABLE = False
-
-try:
-    from sageattention import sageattn
-    SAGE_ATTN_AVAILABLE = True
-except ModuleNotFoundError:
-    SAGE_ATTN_AVAILABLE = False
-    
-    
-def flash_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, num_heads: int, compatibility_mode=False):
-    if compatibility_mode:
-        q = rearrange(q, "b s (n d) -> b n s d", n=num_heads)
-        k = rearrange(k, "b s (n d) -> b n s d", n=num_heads)
-        v = rearrange(v, "b s (n d) -> b n s d", n=num_heads)
-        x = F.scaled_dot_product_attention(q, k, v)
-        x = rearrange(x, "b n s d -> b s (n d)", n=num_heads)
-    elif FLASH_ATTN_3_AVAILABLE:
-        q = rearrange(q, "b s (n d) -> b s n d", n=num_heads)
-        k = rearrange(k, "b s (n d) -> b s n d", n=num_heads)
-        v = rearrange(v, "b s (n d) -> b s n d", n=num_heads)
-        x = flash_attn_interface.flash_attn_func(q, k, v)
-        if isinstance(x,tuple):
-            x = x[0]
-        x = rearrange(x, "b s n d -> b s (n d)", n=num_heads)
+from ..core.attention import attention_forward
+from ..core.attention.attention import FLASH_ATTN_3_AVAILABLE, FLASH_ATTN_2_AVAILABLE, SAGE_ATTN_AVAILABLE
+
+
+def fetch_wan_attention_implementation():
+    # Wan keeps its own priority, which does not include xformers: flash attention 3, flash attention 2, sage attention, torch.
+    if FLASH_ATTN_3_AVAILABLE:
+        return "flash_attention_3"
     elif FLASH_ATTN_2_AVAILABLE:
-        q = rearrange(q, "b s (n d) -> b s n d", n=num_heads)
-        k = rearrange(k, "b s (n d) -> b s n d", n=num_heads)
-        v = rearrange(v, "b s (n d) -> b s n d", n=num_heads)
-        x = flash_attn.flash_attn_func(q, k, v)
-        x = rearrange(x, "b s n d -> b s (n d)", n=num_heads)
+        return "flash_attention_2"
     elif SAGE_ATTN_AVAILABLE:
-        q = rearrange(q, "b s (n d) -> b n s d", n=num_heads)
-        k = rearrange(k, "b s (n d) -> b n s d", n=num_heads)
-        v = rearrange(v, "b s (n d) -> b n s d", n=num_heads)
-        x = sageattn(q, k, v)
-        x = rearrange(x, "b n s d -> b s (n d)", n=num_heads)
+        return "sage_attention"
     else:
-        q = rearrange(q, "b s (n d) -> b n s d", n=num_heads)
-        k = rearrange(k, "b s (n d) -> b n s d", n=num_heads)
-        v = rearrange(v, "b s (n d) -> b n s d", n=num_heads)
-        x = F.scaled_dot_product_attention(q, k, v)
-        x = rearrange(x, "b n s d -> b s (n d)", n=num_heads)
-    return x
+        return "torch"
+
+
+WAN_ATTENTION_IMPLEMENTATION = fetch_wan_attention_implementation()
+
+
+def flash_attention(q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, num_heads: int, compatibility_mode=False):
+    # `DIFFSYNTH_ATTENTION_IMPLEMENTATION` (including "auto") overrides the priority of Wan.
+    return attention_forward(
+        q, k, v,
+        q_pattern="b s (n d)", k_pattern="b s (n d)", v_pattern="b s (n d)", out_pattern="b s (n d)",
+        dims={"n": num_heads}, compatibility_mode=compatibility_mode, implementation=WAN_ATTENTION_IMPLEMENTATION,
+    )
 
 
 def modulate(x: torch.Tensor, shift: torch.Tensor, scale: torch.Tensor):
@@ -88,12 +61,56 @@ def precompute_freqs_cis(dim: int, end: int = 1024, theta: float = 10000.0):
     return freqs_cis
 
 
+def split_freqs_cis(freqs_cis):
+    # complex freqs -> (cos, sin) in float32
+    return freqs_cis.real.float(), freqs_cis.imag.float()
+
+
 def rope_apply(x, freqs, num_heads):
-    x = rearrange(x, "b s (n d) -> b s n d", n=num_heads)
-    x_out = torch.view_as_complex(x.to(torch.float64).reshape(
-        x.shape[0], x.shape[1], x.shape[2], -1, 2))
-    x_out = torch.view_as_real(x_out * freqs).flatten(2)
-    return x_out.to(x.dtype)
+    # freqs: (cos, sin) of shape (s, 1 or n, head_dim // 2), or complex freqs.
+    # The rotation is computed with real arithmetic in float32 and rounded to the dtype of x once.
+    if isinstance(freqs, torch.Tensor):
+        freqs = split_freqs_cis(freqs)
+    cos, sin = freqs
+    x_ = x.reshape(x.shape[0], x.shape[1], num_heads, -1, 2).float()
+    x_real, x_imag = x_.unbind(-1)
+    if torch.is_grad_enabled():
+        x_out = torch.stack([x_real * cos - x_imag * sin, x_real * sin + x_imag * cos], dim=-1)
+    else:
+        # Fused in-place operations, which are not supported by autograd.
+        x_out = torch.empty_like(x_)
+        torch.mul(x_real, cos, out=x_out[..., 0]).addcmul_(x_imag, sin, value=-1)
+        torch.mul(x_real, sin, out=x_out[..., 1]).addcmul_(x_imag, cos)
+    return x_out.flatten(2).to(x.dtype)
+
+
+class WanRotaryEmbedding:
+    # 3D RoPE tables of a (f, h, w) grid, cached across steps and blocks.
+    # The angles are computed in float64 as before, and only cos/sin in float32 are stored.
+
+    def __init__(self, head_dim: int, theta: float = 10000.0, max_cache_size: int = 16):
+        self.dims = [head_dim - 2 * (head_dim // 3), head_dim // 3, head_dim // 3]
+        self.theta = theta
+        self.max_cache_size = max_cache_size
+        self.cache = {}
+
+    def compute_angles(self, dim, positions):
+        freqs = 1.0 / (self.theta ** (torch.arange(0, dim, 2)[: (dim // 2)].double() / dim))
+        return torch.outer(positions.double(), freqs)
+
+    def __call__(self, f, h, w, device="cpu", f_start=0):
+        key = (f, h, w, f_start, str(device))
+        if key not in self.cache:
+            angles = [
+                self.compute_angles(self.dims[0], torch.arange(f_start, f_start + f)).view(f, 1, 1, -1).expand(f, h, w, -1),
+                self.compute_angles(self.dims[1], torch.arange(h)).view(1, h, 1, -1).expand(f, h, w, -1),
+                self.compute_angles(self.dims[2], torch.arange(w)).view(1, 1, w, -1).expand(f, h, w, -1),
+            ]
+            angles = torch.cat(angles, dim=-1).reshape(f * h * w, 1, -1)
+            if len(self.cache) >= self.max_cache_size:
+                self.cache.clear()
+            self.cache[key] = (torch.cos(angles).float().to(device), torch.sin(angles).float().to(device))
+        return self.cache[key]
 
 
 class RMSNorm(nn.Module):
@@ -167,24 +184,62 @@ class CrossAttention(nn.Module):
             
         self.attn = AttentionModule(self.num_heads)
 
-    def forward(self, x: torch.Tensor, y: torch.Tensor):
+    def compute_kv(self, y: torch.Tensor):
         if self.has_image_input:
             img = y[:, :257]
             ctx = y[:, 257:]
         else:
             ctx = y
+        kv = {"k": self.norm_k(self.k(ctx)), "v": self.v(ctx)}
+        if self.has_image_input:
+            kv["k_img"] = self.norm_k_img(self.k_img(img))
+            kv["v_img"] = self.v_img(img)
+        return kv
+
+    def forward(self, x: torch.Tensor, y: torch.Tensor, kv_cache: dict = None):
+        if kv_cache is None:
+            kv = self.compute_kv(y)
+        elif len(kv_cache) == 0:
+            kv = self.compute_kv(y)
+            kv_cache.update(kv)
+        else:
+            kv = kv_cache
         q = self.norm_q(self.q(x))
-        k = self.norm_k(self.k(ctx))
-        v = self.v(ctx)
-        x = self.attn(q, k, v)
+        x = self.attn(q, kv["k"], kv["v"])
         if self.has_image_input:
-            k_img = self.norm_k_img(self.k_img(img))
-            v_img = self.v_img(img)
-            y = flash_attention(q, k_img, v_img, num_heads=self.num_heads)
+            y = flash_attention(q, kv["k_img"], kv["v_img"], num_heads=self.num_heads)
             x = x + y
         return self.o(x)
 
 
+class CrossAttentionKVCache:
+    # The context of cross-attention is constant during a generation,
+    # so the normalized K/V projections of each block can be reused across steps.
+    def __init__(self):
+        self.kv = {}
+        self.signature = None
+
+    def check(self, dit, context: torch.Tensor, clip_feature: torch.Tensor = None):
+        # Any change of the model, LoRA, prompt or image condition invalidates the cache.
+        # References are kept in the signature, so identity comparison is safe.
+        lora_version = getattr(dit, "lora_version", 0)
+        if self.signature is not None:
+            dit_, lora_version_, context_, clip_feature_ = self.signature
+            if dit_ is dit and lora_version_ == lora_version and context_ is context and clip_feature_ is clip_feature:
+                return
+        self.clear()
+        self.signature = (dit, lora_version, context, clip_feature)
+
+    def fetch(self, block_id: int):
+        if block_id not in self.kv:
+            self.kv[block_id] = {}
+        return self.kv[block_id]
+
+    def clear(self):
+        self.kv.clear()
+        self.signature = None
+
+
 class GateModule(nn.Module):
     def __init__(self,):
         super().__init__()
@@ -210,7 +265,7 @@ class DiTBlock(nn.Module):
         self.modulation = nn.Parameter(torch.randn(1, 6, dim) / dim**0.5)
         self.gate = GateModule()
 
-    def forward(self, x, context, t_mod, freqs):
+    def forward(self, x, context, t_mod, freqs, kv_cache: dict = None):
         has_seq = len(t_mod.shape) == 4
         chunk_dim = 2 if has_seq else 1
         # msa: multi-head self-attention  mlp: multi-layer perceptron
@@ -223,7 +278,7 @@ class DiTBlock(nn.Module):
             )
         input_x = modulate(self.norm1(x), shift_msa, scale_msa)
         x = self.gate(x, gate_msa, self.self_attn(input_x, freqs))
-        x = x + self.cross_attn(self.norm3(x), context)
+        x = x + self.cross_attn(self.norm3(x), context, kv_cache=kv_cache)
         input_x = modulate(self.norm2(x), shift_mlp, scale_mlp)
         x = self.gate(x, gate_mlp, self.ffn(input_x))
         return x
@@ -323,6 +378,7 @@ class WanModel(torch.nn.Module):
         self.head = Head(dim, out_dim, patch_size, eps)
         head_dim = dim // num_heads
         self.freqs = precompute_freqs_cis_3d(head_dim)
+        self.rope = WanRotaryEmbedding(head_dim)
 
         if has_image_input:
             self.img_emb = MLP(1280, dim, has_pos_emb=has_image_pos_emb)  # clip_feature_dim = 1280
@@ -372,11 +428,7 @@ class WanModel(torch.nn.Module):
         
         x, (f, h, w) = self.patchify(x)
         
-        freqs = torch.cat([
-            self.freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            self.freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            self.freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ], dim=-1).reshape(f * h * w, 1, -1).to(x.device)
+        freqs = self.rope(f, h, w, device=x.device)
         
         def create_custom_forward(module):
             def custom_forward(*inputs):
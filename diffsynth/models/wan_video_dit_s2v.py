@@ -3,7 +3,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from typing import Tuple
-from .wan_video_dit import rearrange, precompute_freqs_cis_3d, DiTBlock, Head, CrossAttention, modulate, sinusoidal_embedding_1d
+from .wan_video_dit import rearrange, precompute_freqs_cis_3d, split_freqs_cis, DiTBlock, Head, CrossAttention, modulate, sinusoidal_embedding_1d
 
 
 def torch_dfs(model: nn.Module, parent_name='root'):
@@ -537,6 +537,7 @@ class WanS2VModel(torch.nn.Module):
         )
         # motion
         x, pre_compute_freqs, mask = self.inject_motion(x, pre_compute_freqs, mask, motion_latents, add_last_motion=2)
+        freqs = split_freqs_cis(pre_compute_freqs[0])
 
         x = x + self.trainable_cond_mask(mask).to(x.dtype)
 
@@ -559,7 +560,7 @@ class WanS2VModel(torch.nn.Module):
                         context,
                         t_mod,
                         seq_len_x,
-                        pre_compute_freqs[0],
+                        freqs,
                         use_reentrant=False,
                     )
                     x = torch.utils.checkpoint.checkpoint(
@@ -574,7 +575,7 @@ class WanS2VModel(torch.nn.Module):
                     context,
                     t_mod,
                     seq_len_x,
-                    pre_compute_freqs[0],
+                    freqs,
                     use_reentrant=False,
                 )
                 x = torch.utils.checkpoint.checkpoint(
@@ -583,7 +584,7 @@ class WanS2VModel(torch.nn.Module):
                     use_reentrant=False,
                 )
             else:
-                x = block(x, context, t_mod, seq_len_x, pre_compute_freqs[0])
+                x = block(x, context, t_mod, seq_len_x, freqs)
                 x = self.after_transformer_block(block_id, x, audio_emb_global, merged_audio_emb, seq_len_x)
 
         x = x[:, :seq_len_x]
@@ -31,6 +31,30 @@ class Residual3DBlock(nn.Module):
         return out + self.skip(x)
 
 
+class FlowLineFeatureCache:
+    # The flow-line latents stay unchanged during sampling,
+    # so the adapter features only need to be computed once per generation.
+    def __init__(self):
+        self.flow_line_latents = None
+        self.features = None
+
+    def check(self, flow_line_latents: torch.Tensor):
+        # Keeping a reference to the cached latents prevents `id` from being reused by another tensor.
+        return (
+            self.flow_line_latents is not None
+            and self.flow_line_latents is flow_line_latents
+            and self.flow_line_latents.shape == flow_line_latents.shape
+        )
+
+    def store(self, flow_line_latents: torch.Tensor, features: torch.Tensor):
+        self.flow_line_latents = flow_line_latents
+        self.features = features
+
+    def clear(self):
+        self.flow_line_latents = None
+        self.features = None
+
+
 class WanFlowLineAdapter(nn.Module):
     def __init__(self):
         super().__init__()
@@ -54,12 +78,22 @@ class WanFlowLineAdapter(nn.Module):
         # 最终投影到 5120
         self.flow_line_patch_embedding = nn.Conv3d(in_ch, 5120, kernel_size=(1,2,2), stride=(1,2,2))
 
-    def after_patch_embedding(self, x: torch.Tensor, flow_line_latents: torch.Tensor):
+    def compute_features(self, flow_line_latents: torch.Tensor):
         for block in self.flow_line_blocks:
             flow_line_latents = block(flow_line_latents)
         flow_line_latents = self.flow_line_patch_embedding(flow_line_latents)
-
-        x[:, :, 1:] += flow_line_latents[:, :, 1:]
+        return flow_line_latents
+
+    def after_patch_embedding(self, x: torch.Tensor, flow_line_latents: torch.Tensor, flow_line_cache: FlowLineFeatureCache = None):
+        if flow_line_cache is None:
+            features = self.compute_features(flow_line_latents)
+        elif flow_line_cache.check(flow_line_latents):
+            features = flow_line_cache.features
+        else:
+            features = self.compute_features(flow_line_latents)
+            flow_line_cache.store(flow_line_latents, features)
+
+        x[:, :, 1:] += features[:, :, 1:]
         return x
 
     @staticmethod
@@ -1,5 +1,5 @@
 import torch
-from .wan_video_dit import DiTBlock, SelfAttention, rope_apply, flash_attention, modulate, MLP
+from .wan_video_dit import DiTBlock, SelfAttention, WanRotaryEmbedding, rope_apply, flash_attention, modulate, MLP
 import einops
 import torch.nn as nn
 
@@ -113,6 +113,7 @@ class MotWanModel(torch.nn.Module):
 
         self.mot_layers_mapping = {i: n for n, i in enumerate(self.mot_layers)}
         self.head_dim = dim // num_heads
+        self.rope = WanRotaryEmbedding(self.head_dim)
 
         self.patch_embedding = nn.Conv3d(
             in_dim, dim, kernel_size=patch_size, stride=patch_size)
@@ -143,25 +144,9 @@ class MotWanModel(torch.nn.Module):
         x = self.patch_embedding(x)
         return x
 
-    def compute_freqs_mot(self, f, h, w, end: int = 1024, theta: float = 10000.0):
-        def precompute_freqs_cis(dim: int, start: int = 0, end: int = 1024, theta: float = 10000.0):
-            # 1d rope precompute
-            freqs = 1.0 / (theta ** (torch.arange(0, dim, 2)
-                        [: (dim // 2)].double() / dim))
-            freqs = torch.outer(torch.arange(start, end, device=freqs.device), freqs)
-            freqs_cis = torch.polar(torch.ones_like(freqs), freqs)  # complex64
-            return freqs_cis
-
-        f_freqs_cis = precompute_freqs_cis(self.head_dim - 2 * (self.head_dim // 3), -f, end, theta)
-        h_freqs_cis = precompute_freqs_cis(self.head_dim // 3, 0, end, theta)
-        w_freqs_cis = precompute_freqs_cis(self.head_dim // 3, 0, end, theta)
-
-        freqs = torch.cat([
-            f_freqs_cis[:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            h_freqs_cis[:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            w_freqs_cis[:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ], dim=-1).reshape(f * h * w, 1, -1)
-        return freqs
+    def compute_freqs_mot(self, f, h, w, device="cpu"):
+        # The frames of the MoT branch take the positions before the video frames.
+        return self.rope(f, h, w, device=device, f_start=-f)
 
     def forward(self, wan_block, x, context, t_mod, freqs, x_mot, context_mot, t_mod_mot, freqs_mot, block_id):
         block = self.blocks[self.mot_layers_mapping[block_id]]
@@ -948,6 +948,12 @@ def count_conv3d(model):
     return count
 
 
+def move_feat_cache(feat_cache, device):
+    for i, feat in enumerate(feat_cache):
+        if isinstance(feat, torch.Tensor):
+            feat_cache[i] = feat.to(device)
+
+
 class VideoVAE_(nn.Module):
 
     def __init__(self,
@@ -987,17 +993,18 @@ class VideoVAE_(nn.Module):
         t = x.shape[2]
         iter_ = 1 + (t - 1) // 4
 
+        out = []
         for i in range(iter_):
             self._enc_conv_idx = [0]
             if i == 0:
-                out = self.encoder(x[:, :, :1, :, :],
-                                   feat_cache=self._enc_feat_map,
-                                   feat_idx=self._enc_conv_idx)
+                out.append(self.encoder(x[:, :, :1, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
             else:
-                out_ = self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                                    feat_cache=self._enc_feat_map,
-                                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+                out.append(self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
+        out = torch.cat(out, 2)
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             scale = [s.to(dtype=mu.dtype, device=mu.device) for s in scale]
@@ -1009,8 +1016,9 @@ class VideoVAE_(nn.Module):
         return mu
 
     def decode(self, z, scale):
-        self.clear_cache()
-        # z: [b,c,t,h,w]
+        return torch.cat(list(self.decode_stream(z, scale)), 2)
+
+    def unscale_latents(self, z, scale):
         if isinstance(scale[0], torch.Tensor):
             scale = [s.to(dtype=z.dtype, device=z.device) for s in scale]
             z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
@@ -1018,20 +1026,24 @@ class VideoVAE_(nn.Module):
         else:
             scale = scale.to(dtype=z.dtype, device=z.device)
             z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
-        x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(x[:, :, i:i + 1, :, :],
-                                   feat_cache=self._feat_map,
-                                   feat_idx=self._conv_idx)
-            else:
-                out_ = self.decoder(x[:, :, i:i + 1, :, :],
-                                    feat_cache=self._feat_map,
-                                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2) # may add tensor offload
-        return out
+        return z
+
+    def decode_stream(self, z, scale, device=None, cache_device=None):
+        # Yields the decoded frames of each latent frame: 1 frame for the first one, 4 frames for the others.
+        # The causal cache is local to the generator, so that several generators (e.g., spatial tiles) can run in lockstep.
+        # The latent frames are moved to `device` one by one. If `cache_device` is set, the causal cache is kept there between frames.
+        # z: [b,c,t,h,w]
+        device = z.device if device is None else device
+        feat_map = [None] * count_conv3d(self.decoder)
+        for i in range(z.shape[2]):
+            # conv2 is a 1x1x1 convolution, so it can be applied frame by frame.
+            x = self.conv2(self.unscale_latents(z[:, :, i:i + 1].to(device), scale))
+            if cache_device is not None:
+                move_feat_cache(feat_map, device)
+            out = self.decoder(x, feat_cache=feat_map, feat_idx=[0])
+            if cache_device is not None:
+                move_feat_cache(feat_map, cache_device)
+            yield out
 
     def reparameterize(self, mu, log_var):
         std = torch.exp(0.5 * log_var)
@@ -1100,12 +1112,9 @@ class WanVideoVAE(nn.Module):
         return mask
 
 
-    def tiled_decode(self, hidden_states, device, tile_size, tile_stride):
-        _, _, T, H, W = hidden_states.shape
+    def split_tiles(self, H, W, tile_size, tile_stride):
         size_h, size_w = tile_size
         stride_h, stride_w = tile_stride
-
-        # Split tasks
         tasks = []
         for h in range(0, H, stride_h):
             if (h-stride_h >= 0 and h-stride_h+size_h >= H): continue
@@ -1113,6 +1122,186 @@ class WanVideoVAE(nn.Module):
                 if (w-stride_w >= 0 and w-stride_w+size_w >= W): continue
                 h_, w_ = h + size_h, w + size_w
                 tasks.append((h, h_, w, w_))
+        return tasks
+
+
+    def estimate_tile_batch_size(self, peak_memory, num_tiles, device):
+        # `peak_memory` is the measured peak memory of one tile.
+        # Without memory statistics (e.g., on CPU), tiles are processed one by one.
+        device_type = torch.device(device).type
+        if device_type not in ("cuda", "npu") or peak_memory <= 0:
+            return 1
+        free_memory, _ = getattr(torch, device_type).mem_get_info(device)
+        return max(1, min(num_tiles, int(free_memory * 0.9 // peak_memory)))
+
+
+    def batched_tiled_forward(self, forward_fn, data, device, tile_size, tile_stride, out_channels, out_T, convert_coordinate, desc, tile_batch_size=None):
+        # Equal-shaped tiles are grouped and processed in batches.
+        # Results are accumulated on the computation device and copied to CPU only once.
+        _, _, T, H, W = data.shape
+        size_h, size_w = tile_size
+        stride_h, stride_w = tile_stride
+        device_type = torch.device(device).type
+        border_width = (convert_coordinate(size_h - stride_h), convert_coordinate(size_w - stride_w))
+
+        tile_groups = {}
+        for h, h_, w, w_ in self.split_tiles(H, W, tile_size, tile_stride):
+            tile_groups.setdefault((min(h_, H) - h, min(w_, W) - w), []).append((h, h_, w, w_))
+
+        weight = torch.zeros((1, 1, out_T, convert_coordinate(H), convert_coordinate(W)), dtype=data.dtype, device=device)
+        values = torch.zeros((1, out_channels, out_T, convert_coordinate(H), convert_coordinate(W)), dtype=data.dtype, device=device)
+        masks = {}
+
+        progress_bar = tqdm(total=sum(len(tasks) for tasks in tile_groups.values()), desc=desc)
+        for tasks in tile_groups.values():
+            batch_size = tile_batch_size
+            task_id = 0
+            while task_id < len(tasks):
+                measure_memory = batch_size is None and device_type in ("cuda", "npu")
+                if measure_memory:
+                    # The peak memory statistics are not reset, since they belong to the caller.
+                    # If this tile peaks below an earlier peak, the difference overestimates its memory, and the batch size is only smaller.
+                    base_memory = getattr(torch, device_type).memory_allocated(device)
+                batch_tasks = tasks[task_id: task_id + (1 if batch_size is None else batch_size)]
+                batch = torch.concat([data[:, :, :, h:h_, w:w_] for h, h_, w, w_ in batch_tasks], dim=0).to(device)
+                batch = forward_fn(batch)
+                if batch_size is None:
+                    peak_memory = getattr(torch, device_type).max_memory_allocated(device) - base_memory if measure_memory else 0
+                    batch_size = self.estimate_tile_batch_size(peak_memory, len(tasks), device)
+                for (h, h_, w, w_), output in zip(batch_tasks, batch.split(1, dim=0)):
+                    is_bound = (h==0, h_>=H, w==0, w_>=W)
+                    mask_key = (output.shape[3], output.shape[4], is_bound)
+                    if mask_key not in masks:
+                        masks[mask_key] = self.build_mask(output, is_bound=is_bound, border_width=border_width).to(dtype=data.dtype, device=device)
+                    mask = masks[mask_key]
+                    target_h, target_w = convert_coordinate(h), convert_coordinate(w)
+                    values[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += output * mask
+                    weight[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += mask
+                task_id += len(batch_tasks)
+                progress_bar.update(len(batch_tasks))
+        progress_bar.close()
+        values = values / weight
+        return values.to("cpu")
+
+
+    def pipelined_tiled_forward(self, forward_fn, data, device, tile_size, tile_stride, out_channels, out_T, convert_coordinate, desc, tile_batch_size=1):
+        # Tile i+1 is uploaded and tile i-1 is downloaded on dedicated copy streams while tile i is computing.
+        # Results are accumulated on CPU, the same as the synchronous mode.
+        _, _, T, H, W = data.shape
+        size_h, size_w = tile_size
+        stride_h, stride_w = tile_stride
+        border_width = (convert_coordinate(size_h - stride_h), convert_coordinate(size_w - stride_w))
+
+        tile_groups = {}
+        for h, h_, w, w_ in self.split_tiles(H, W, tile_size, tile_stride):
+            tile_groups.setdefault((min(h_, H) - h, min(w_, W) - w), []).append((h, h_, w, w_))
+        batch_size = tile_batch_size or 1
+        batches = [tasks[i: i + batch_size] for tasks in tile_groups.values() for i in range(0, len(tasks), batch_size)]
+
+        weight = torch.zeros((1, 1, out_T, convert_coordinate(H), convert_coordinate(W)), dtype=data.dtype, device="cpu")
+        values = torch.zeros((1, out_channels, out_T, convert_coordinate(H), convert_coordinate(W)), dtype=data.dtype, device="cpu")
+        masks = {}
+
+        compute_stream = torch.cuda.current_stream(device)
+        upload_stream = torch.cuda.Stream(device)
+        download_stream = torch.cuda.Stream(device)
+        new_event = lambda: torch.cuda.Event(enable_timing=True)
+
+        def upload(batch_tasks):
+            batch = torch.concat([data[:, :, :, h:h_, w:w_] for h, h_, w, w_ in batch_tasks], dim=0).pin_memory()
+            events = (new_event(), new_event())
+            with torch.cuda.stream(upload_stream):
+                events[0].record(upload_stream)
+                batch = batch.to(device, non_blocking=True)
+                events[1].record(upload_stream)
+            return batch, events
+
+        def accumulate(batch_tasks, output):
+            for (h, h_, w, w_), output in zip(batch_tasks, output.split(1, dim=0)):
+                is_bound = (h==0, h_>=H, w==0, w_>=W)
+                mask_key = (output.shape[3], output.shape[4], is_bound)
+                if mask_key not in masks:
+                    masks[mask_key] = self.build_mask(output, is_bound=is_bound, border_width=border_width).to(dtype=data.dtype)
+                mask = masks[mask_key]
+                target_h, target_w = convert_coordinate(h), convert_coordinate(w)
+                values[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += output * mask
+                weight[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += mask
+
+        start_event, end_event = new_event(), new_event()
+        start_event.record(compute_stream)
+        timing_events = []
+        next_upload = upload(batches[0])
+        pending_download = None
+        progress_bar = tqdm(total=sum(len(batch_tasks) for batch_tasks in batches), desc=desc)
+        for batch_id, batch_tasks in enumerate(batches):
+            batch, upload_events = next_upload
+            if batch_id + 1 < len(batches):
+                next_upload = upload(batches[batch_id + 1])
+            # Compute
+            compute_events = (new_event(), new_event())
+            compute_stream.wait_event(upload_events[1])
+            batch.record_stream(compute_stream)
+            compute_events[0].record(compute_stream)
+            output = forward_fn(batch)
+            compute_events[1].record(compute_stream)
+            # Download
+            download_events = (new_event(), new_event())
+            output_cpu = torch.empty(output.shape, dtype=output.dtype, device="cpu", pin_memory=True)
+            with torch.cuda.stream(download_stream):
+                download_stream.wait_event(compute_events[1])
+                output.record_stream(download_stream)
+                download_events[0].record(download_stream)
+                output_cpu.copy_(output, non_blocking=True)
+                download_events[1].record(download_stream)
+            timing_events.append((upload_events, compute_events, download_events))
+            # Accumulate the previous tile on CPU while the current tile is computing.
+            if pending_download is not None:
+                pending_download[2].synchronize()
+                accumulate(pending_download[0], pending_download[1])
+                progress_bar.update(len(pending_download[0]))
+            pending_download = (batch_tasks, output_cpu, download_events[1])
+        pending_download[2].synchronize()
+        accumulate(pending_download[0], pending_download[1])
+        progress_bar.update(len(pending_download[0]))
+        progress_bar.close()
+        end_event.record(compute_stream)
+        end_event.synchronize()
+
+        # Measured time (ms). The overlap is effective if `total` is less than `transfer + compute`.
+        self.tiling_stats = {
+            "upload": sum(u[0].elapsed_time(u[1]) for u, _, _ in timing_events),
+            "compute": sum(c[0].elapsed_time(c[1]) for _, c, _ in timing_events),
+            "download": sum(d[0].elapsed_time(d[1]) for _, _, d in timing_events),
+            "total": start_event.elapsed_time(end_event),
+        }
+        self.tiling_stats["transfer"] = self.tiling_stats["upload"] + self.tiling_stats["download"]
+        values = values / weight
+        return values
+
+
+    def tiled_decode(self, hidden_states, device, tile_size, tile_stride, tile_batch_size=1, pipelined=False):
+        if pipelined and torch.device(device).type == "cuda":
+            values = self.pipelined_tiled_forward(
+                lambda x: self.model.decode(x, self.scale), hidden_states, device, tile_size, tile_stride,
+                out_channels=3, out_T=hidden_states.shape[2] * 4 - 3,
+                convert_coordinate=lambda x: x * self.upsampling_factor, desc="VAE decoding",
+                tile_batch_size=tile_batch_size,
+            )
+            return values.clamp_(-1, 1)
+        if tile_batch_size != 1:
+            values = self.batched_tiled_forward(
+                lambda x: self.model.decode(x, self.scale), hidden_states, device, tile_size, tile_stride,
+                out_channels=3, out_T=hidden_states.shape[2] * 4 - 3,
+                convert_coordinate=lambda x: x * self.upsampling_factor, desc="VAE decoding",
+                tile_batch_size=tile_batch_size,
+            )
+            return values.clamp_(-1, 1)
+        _, _, T, H, W = hidden_states.shape
+        size_h, size_w = tile_size
+        stride_h, stride_w = tile_stride
+
+        # Split tasks
+        tasks = self.split_tiles(H, W, tile_size, tile_stride)
 
         data_device = "cpu"
         computation_device = device
@@ -1152,19 +1341,27 @@ class WanVideoVAE(nn.Module):
         return values
 
 
-    def tiled_encode(self, video, device, tile_size, tile_stride):
+    def tiled_encode(self, video, device, tile_size, tile_stride, tile_batch_size=1, pipelined=False):
+        if pipelined and torch.device(device).type == "cuda":
+            return self.pipelined_tiled_forward(
+                lambda x: self.model.encode(x, self.scale), video, device, tile_size, tile_stride,
+                out_channels=self.z_dim, out_T=(video.shape[2] + 3) // 4,
+                convert_coordinate=lambda x: x // self.upsampling_factor, desc="VAE encoding",
+                tile_batch_size=tile_batch_size,
+            )
+        if tile_batch_size != 1:
+            return self.batched_tiled_forward(
+                lambda x: self.model.encode(x, self.scale), video, device, tile_size, tile_stride,
+                out_channels=self.z_dim, out_T=(video.shape[2] + 3) // 4,
+                convert_coordinate=lambda x: x // self.upsampling_factor, desc="VAE encoding",
+                tile_batch_size=tile_batch_size,
+            )
         _, _, T, H, W = video.shape
         size_h, size_w = tile_size
         stride_h, stride_w = tile_stride
 
         # Split tasks
-        tasks = []
-        for h in range(0, H, stride_h):
-            if (h-stride_h >= 0 and h-stride_h+size_h >= H): continue
-            for w in range(0, W, stride_w):
-                if (w-stride_w >= 0 and w-stride_w+size_w >= W): continue
-                h_, w_ = h + size_h, w + size_w
-                tasks.append((h, h_, w, w_))
+        tasks = self.split_tiles(H, W, tile_size, tile_stride)
 
         data_device = "cpu"
         computation_device = device
@@ -1215,7 +1412,7 @@ class WanVideoVAE(nn.Module):
         return video.clamp_(-1, 1)
 
 
-    def encode(self, videos, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16)):
+    def encode(self, videos, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16), tile_batch_size=1, pipelined=False):
         videos = [video.to("cpu") for video in videos]
         hidden_states = []
         for video in videos:
@@ -1223,7 +1420,7 @@ class WanVideoVAE(nn.Module):
             if tiled:
                 tile_size = (tile_size[0] * self.upsampling_factor, tile_size[1] * self.upsampling_factor)
                 tile_stride = (tile_stride[0] * self.upsampling_factor, tile_stride[1] * self.upsampling_factor)
-                hidden_state = self.tiled_encode(video, device, tile_size, tile_stride)
+                hidden_state = self.tiled_encode(video, device, tile_size, tile_stride, tile_batch_size=tile_batch_size, pipelined=pipelined)
             else:
                 hidden_state = self.single_encode(video, device)
             hidden_state = hidden_state.squeeze(0)
@@ -1232,13 +1429,13 @@ class WanVideoVAE(nn.Module):
         return hidden_states
 
 
-    def decode(self, hidden_states, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16)):
+    def decode(self, hidden_states, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16), tile_batch_size=1, pipelined=False):
         hidden_states = [hidden_state.to("cpu") for hidden_state in hidden_states]
         videos = []
         for hidden_state in hidden_states:
             hidden_state = hidden_state.unsqueeze(0)
             if tiled:
-                video = self.tiled_decode(hidden_state, device, tile_size, tile_stride)
+                video = self.tiled_decode(hidden_state, device, tile_size, tile_stride, tile_batch_size=tile_batch_size, pipelined=pipelined)
             else:
                 video = self.single_decode(hidden_state, device)
             video = video.squeeze(0)
@@ -1247,6 +1444,60 @@ class WanVideoVAE(nn.Module):
         return videos
 
 
+    def tiled_decode_stream(self, hidden_states, device, tile_size, tile_stride, tile_batch_size=1, offload_cache=False):
+        # Each group of equal-shaped tiles is decoded by its own generator, and the generators run in lockstep along the time axis.
+        # Only the frames of one latent frame are blended at a time.
+        # The latents of each tile are moved to `device` frame by frame. The causal caches stay on `device`.
+        # With `offload_cache=True`, the caches of several generators are kept on CPU between frames, so that only one of them is on `device`.
+        _, _, T, H, W = hidden_states.shape
+        size_h, size_w = tile_size
+        stride_h, stride_w = tile_stride
+        border_width = ((size_h - stride_h) * self.upsampling_factor, (size_w - stride_w) * self.upsampling_factor)
+
+        tile_groups = {}
+        for h, h_, w, w_ in self.split_tiles(H, W, tile_size, tile_stride):
+            tile_groups.setdefault((min(h_, H) - h, min(w_, W) - w), []).append((h, h_, w, w_))
+        batch_size = tile_batch_size or 1
+        batches = [tasks[i: i + batch_size] for tasks in tile_groups.values() for i in range(0, len(tasks), batch_size)]
+        cache_device = "cpu" if offload_cache and len(batches) > 1 else None
+        streams = [
+            self.model.decode_stream(torch.concat([hidden_states[:, :, :, h:h_, w:w_] for h, h_, w, w_ in batch_tasks], dim=0), self.scale, device=device, cache_device=cache_device)
+            for batch_tasks in batches
+        ]
+
+        masks = {}
+        for _ in tqdm(range(T), desc="VAE decoding"):
+            values, weight = None, None
+            for batch_tasks, stream in zip(batches, streams):
+                batch = next(stream)
+                for (h, h_, w, w_), output in zip(batch_tasks, batch.split(hidden_states.shape[0], dim=0)):
+                    if values is None:
+                        shape = (output.shape[0], 3, output.shape[2], H * self.upsampling_factor, W * self.upsampling_factor)
+                        values = torch.zeros(shape, dtype=output.dtype, device=device)
+                        weight = torch.zeros((1, 1, *shape[2:]), dtype=output.dtype, device=device)
+                    is_bound = (h==0, h_>=H, w==0, w_>=W)
+                    mask_key = (output.shape[3], output.shape[4], is_bound)
+                    if mask_key not in masks:
+                        masks[mask_key] = self.build_mask(output, is_bound=is_bound, border_width=border_width).to(dtype=output.dtype, device=device)
+                    mask = masks[mask_key]
+                    target_h, target_w = h * self.upsampling_factor, w * self.upsampling_factor
+                    values[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += output * mask
+                    weight[:, :, :, target_h: target_h + output.shape[3], target_w: target_w + output.shape[4]] += mask
+            yield (values / weight).clamp_(-1, 1)
+
+
+    def decode_stream(self, hidden_states, device, tiled=False, tile_size=(34, 34), tile_stride=(18, 16), tile_batch_size=1, offload_cache=False):
+        # Yields the decoded video chunk by chunk on CPU, each of shape (B, 3, T_i, H, W).
+        # T_i is 1 for the first latent frame and 4 (the temporal upsampling factor) for the others.
+        # Unlike `decode`, the decoded video is never held in memory as a whole.
+        if tiled:
+            chunks = self.tiled_decode_stream(hidden_states, device, tile_size, tile_stride, tile_batch_size=tile_batch_size, offload_cache=offload_cache)
+        else:
+            chunks = (chunk.clamp_(-1, 1) for chunk in self.model.decode_stream(hidden_states, self.scale, device=device))
+        for chunk in chunks:
+            yield chunk.to("cpu")
+
+
     @staticmethod
     def state_dict_converter():
         return WanVideoVAEStateDictConverter()
@@ -1300,17 +1551,18 @@ class VideoVAE38_(VideoVAE_):
         x = patchify(x, patch_size=2)
         t = x.shape[2]
         iter_ = 1 + (t - 1) // 4
+        out = []
         for i in range(iter_):
             self._enc_conv_idx = [0]
             if i == 0:
-                out = self.encoder(x[:, :, :1, :, :],
-                                   feat_cache=self._enc_feat_map,
-                                   feat_idx=self._enc_conv_idx)
+                out.append(self.encoder(x[:, :, :1, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
             else:
-                out_ = self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                                    feat_cache=self._enc_feat_map,
-                                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+                out.append(self.encoder(x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
+                                        feat_cache=self._enc_feat_map,
+                                        feat_idx=self._enc_conv_idx))
+        out = torch.cat(out, 2)
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             scale = [s.to(dtype=mu.dtype, device=mu.device) for s in scale]
@@ -1323,32 +1575,17 @@ class VideoVAE38_(VideoVAE_):
         return mu
 
 
-    def decode(self, z, scale):
-        self.clear_cache()
-        if isinstance(scale[0], torch.Tensor):
-            scale = [s.to(dtype=z.dtype, device=z.device) for s in scale]
-            z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
-                1, self.z_dim, 1, 1, 1)
-        else:
-            scale = scale.to(dtype=z.dtype, device=z.device)
-            z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
-        x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(x[:, :, i:i + 1, :, :],
-                                   feat_cache=self._feat_map,
-                                   feat_idx=self._conv_idx,
-                                   first_chunk=True)
-            else:
-                out_ = self.decoder(x[:, :, i:i + 1, :, :],
-                                    feat_cache=self._feat_map,
-                                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2)
-        out = unpatchify(out, patch_size=2)
-        self.clear_cache()
-        return out
+    def decode_stream(self, z, scale, device=None, cache_device=None):
+        device = z.device if device is None else device
+        feat_map = [None] * count_conv3d(self.decoder)
+        for i in range(z.shape[2]):
+            x = self.conv2(self.unscale_latents(z[:, :, i:i + 1].to(device), scale))
+            if cache_device is not None:
+                move_feat_cache(feat_map, device)
+            out = self.decoder(x, feat_cache=feat_map, feat_idx=[0], first_chunk=(i == 0))
+            if cache_device is not None:
+                move_feat_cache(feat_map, cache_device)
+            yield unpatchify(out, patch_size=2)
 
 
 class WanVideoVAE38(WanVideoVAE):
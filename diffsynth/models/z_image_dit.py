@@ -7,7 +7,7 @@ import torch.nn.functional as F
 from torch.nn.utils.rnn import pad_sequence
 
 from .general_modules import RMSNorm
-from ..core.attention import attention_forward
+from ..core.attention import attention_forward, attention_forward_padded
 from ..core.device.npu_compatible_device import IS_NPU_AVAILABLE
 from ..core.gradient import gradient_checkpoint_forward
 
@@ -120,13 +120,23 @@ class Attention(torch.nn.Module):
         query, key = query.to(dtype), key.to(dtype)
 
         # Compute joint attention
-        hidden_states = attention_forward(
-            query,
-            key,
-            value,
-            q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d",
-            attn_mask=attention_mask,
-        )
+        if attention_mask is not None and attention_mask.dtype == torch.bool and attention_mask.ndim == 2:
+            # Padding mask (batch, seq_len): padding tokens are skipped by packed attention.
+            hidden_states = attention_forward_padded(
+                query,
+                key,
+                value,
+                attention_mask,
+                q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d",
+            )
+        else:
+            hidden_states = attention_forward(
+                query,
+                key,
+                value,
+                q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d",
+                attn_mask=attention_mask,
+            )
 
         # Reshape back
         hidden_states = hidden_states.flatten(2, 3)
@@ -1010,6 +1020,7 @@ class ZImageDiT(nn.Module):
         image_noise_mask = None,
         patch_size=2,
         f_patch_size=1,
+        step_cache=None,
         use_gradient_checkpointing=False,
         use_gradient_checkpointing_offload=False,
     ):
@@ -1130,13 +1141,24 @@ class ZImageDiT(nn.Module):
         )
 
         # Main transformer layers
-        for layer_idx, layer in enumerate(self.layers):
+        if step_cache is not None and step_cache.check(unified, t_noisy if omni_mode else adaln_input, model=self):
+            unified = step_cache.update(unified)
+            layers = []
+        else:
+            layers = self.layers
+        first_layer_input = unified
+        for layer_idx, layer in enumerate(layers):
             unified = gradient_checkpoint_forward(
                 layer,
                 use_gradient_checkpointing=use_gradient_checkpointing,
                 use_gradient_checkpointing_offload=use_gradient_checkpointing_offload,
                 x=unified, attn_mask=unified_mask, freqs_cis=unified_freqs, adaln_input=adaln_input, noise_mask=unified_noise_tensor, adaln_noisy=t_noisy, adaln_clean=t_clean
             )
+            if layer_idx == 0 and step_cache is not None and step_cache.check_first_block(unified, first_layer_input):
+                unified = step_cache.update(unified)
+                break
+        if step_cache is not None:
+            step_cache.store(unified)
 
         unified = (
             self.all_final_layer[f"{patch_size}-{f_patch_size}"](
@@ -7,6 +7,7 @@ import numpy as np
 from typing import Union, List, Optional, Tuple
 
 from ..diffusion import FlowMatchScheduler
+from ..diffusion.step_cache import StepCache
 from ..core import ModelConfig, gradient_checkpoint_forward
 from ..diffusion.base_pipeline import BasePipeline, PipelineUnit, ControlNetInput
 
@@ -35,6 +36,7 @@ class Flux2ImagePipeline(BasePipeline):
             Flux2Unit_NoiseInitializer(),
             Flux2Unit_InputImageEmbedder(),
             Flux2Unit_ImageIDs(),
+            Flux2Unit_StepCache(),
         ]
         self.model_fn = model_fn_flux2
     
@@ -83,6 +85,10 @@ class Flux2ImagePipeline(BasePipeline):
         rand_device: str = "cpu",
         # Steps
         num_inference_steps: int = 30,
+        # Step cache
+        step_cache_policy: str = None,
+        step_cache_thresh: float = None,
+        step_cache_model_id: str = None,
         # Progress bar
         progress_bar_cmd = tqdm,
     ):
@@ -101,6 +107,7 @@ class Flux2ImagePipeline(BasePipeline):
             "height": height, "width": width,
             "seed": seed, "rand_device": rand_device,
             "num_inference_steps": num_inference_steps,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
         }
         for unit in self.units:
             inputs_shared, inputs_posi, inputs_nega = self.unit_runner(unit, self, inputs_shared, inputs_posi, inputs_nega)
@@ -274,14 +281,19 @@ class Flux2Unit_PromptEmbedder(PipelineUnit):
         text_ids = text_ids.to(device)
         return prompt_embeds, text_ids
 
-    def process(self, pipe: Flux2ImagePipeline, prompt):
-        pipe.load_models_to_device(self.onload_model_names)
+    def process_uncached(self, pipe: Flux2ImagePipeline, prompt):
         prompt_embeds, text_ids = self.encode_prompt(
             pipe.text_encoder, pipe.tokenizer, prompt,
             dtype=pipe.torch_dtype, device=pipe.device,
         )
         return {"prompt_embeds": prompt_embeds, "text_ids": text_ids}
 
+    def process(self, pipe: Flux2ImagePipeline, prompt):
+        return pipe.encode_prompt_with_cache(
+            self, lambda: self.process_uncached(pipe, prompt),
+            prompt, tokenizers=(pipe.tokenizer,), text_encoders=(pipe.text_encoder,),
+        )
+
 
 class Flux2Unit_NoiseInitializer(PipelineUnit):
     def __init__(self):
@@ -344,6 +356,21 @@ class Flux2Unit_ImageIDs(PipelineUnit):
         return {"image_ids": image_ids}
 
 
+class Flux2Unit_StepCache(PipelineUnit):
+    def __init__(self):
+        super().__init__(
+            seperate_cfg=True,
+            input_params=("num_inference_steps", "step_cache_policy", "step_cache_thresh", "step_cache_model_id"),
+            input_params_posi={}, input_params_nega={},
+            output_params=("step_cache",)
+        )
+
+    def process(self, pipe: Flux2ImagePipeline, num_inference_steps, step_cache_policy, step_cache_thresh, step_cache_model_id):
+        if step_cache_policy is None:
+            return {}
+        return {"step_cache": StepCache(num_inference_steps, policy=step_cache_policy, thresh=step_cache_thresh, model_id=step_cache_model_id)}
+
+
 def model_fn_flux2(
     dit: Flux2DiT,
     latents=None,
@@ -352,6 +379,7 @@ def model_fn_flux2(
     prompt_embeds=None,
     text_ids=None,
     image_ids=None,
+    step_cache: StepCache = None,
     use_gradient_checkpointing=False,
     use_gradient_checkpointing_offload=False,
     **kwargs,
@@ -364,6 +392,7 @@ def model_fn_flux2(
         encoder_hidden_states=prompt_embeds,
         txt_ids=text_ids,
         img_ids=image_ids,
+        step_cache=step_cache,
         use_gradient_checkpointing=use_gradient_checkpointing,
         use_gradient_checkpointing_offload=use_gradient_checkpointing_offload,
     )
@@ -7,6 +7,7 @@ import numpy as np
 from transformers import CLIPTokenizer, T5TokenizerFast
 
 from ..diffusion import FlowMatchScheduler
+from ..diffusion.step_cache import StepCache
 from ..core import ModelConfig, gradient_checkpoint_forward, load_state_dict
 from ..diffusion.base_pipeline import BasePipeline, PipelineUnit, ControlNetInput
 from ..utils.lora.flux import FluxLoRALoader
@@ -95,7 +96,7 @@ class FluxImagePipeline(BasePipeline):
             FluxImageUnit_IPAdapter(),
             FluxImageUnit_EntityControl(),
             FluxImageUnit_NexusGen(),
-            FluxImageUnit_TeaCache(),
+            FluxImageUnit_StepCache(),
             FluxImageUnit_Flex(),
             FluxImageUnit_Step1x(),
             FluxImageUnit_ValueControl(),
@@ -231,6 +232,10 @@ class FluxImagePipeline(BasePipeline):
         # LoRA Encoder
         lora_encoder_inputs: Union[list[ModelConfig], ModelConfig, str] = None,
         lora_encoder_scale: float = 1.0,
+        # Step cache
+        step_cache_policy: str = None,
+        step_cache_thresh: float = None,
+        step_cache_model_id: str = None,
         # TeaCache
         tea_cache_l1_thresh: float = None,
         # Tile
@@ -266,6 +271,7 @@ class FluxImagePipeline(BasePipeline):
             "step1x_reference_image": step1x_reference_image,
             "nexus_gen_reference_image": nexus_gen_reference_image,
             "lora_encoder_inputs": lora_encoder_inputs, "lora_encoder_scale": lora_encoder_scale,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
             "tea_cache_l1_thresh": tea_cache_l1_thresh,
             "tiled": tiled, "tile_size": tile_size, "tile_stride": tile_stride,
             "progress_bar_cmd": progress_bar_cmd,
@@ -385,14 +391,21 @@ class FluxImageUnit_PromptEmbedder(PipelineUnit):
         text_ids = torch.zeros(prompt_emb.shape[0], prompt_emb.shape[1], 3).to(device=device, dtype=prompt_emb.dtype)
         return prompt_emb, pooled_prompt_emb, text_ids
 
+    def process_uncached(self, pipe: FluxImagePipeline, prompt, t5_sequence_length, positive) -> dict:
+        prompt_emb, pooled_prompt_emb, text_ids = self.encode_prompt(
+            tokenizer_1=pipe.tokenizer_1, tokenizer_2=pipe.tokenizer_2,
+            text_encoder_1=pipe.text_encoder_1, text_encoder_2=pipe.text_encoder_2,
+            prompt=prompt, device=pipe.device, positive=positive, t5_sequence_length=t5_sequence_length,
+        )
+        return {"prompt_emb": prompt_emb, "pooled_prompt_emb": pooled_prompt_emb, "text_ids": text_ids}
+
     def process(self, pipe: FluxImagePipeline, prompt, t5_sequence_length, positive) -> dict:
         if pipe.text_encoder_1 is not None and pipe.text_encoder_2 is not None:
-            prompt_emb, pooled_prompt_emb, text_ids = self.encode_prompt(
-                tokenizer_1=pipe.tokenizer_1, tokenizer_2=pipe.tokenizer_2,
-                text_encoder_1=pipe.text_encoder_1, text_encoder_2=pipe.text_encoder_2,
-                prompt=prompt, device=pipe.device, positive=positive, t5_sequence_length=t5_sequence_length,
+            return pipe.encode_prompt_with_cache(
+                self, lambda: self.process_uncached(pipe, prompt, t5_sequence_length, positive),
+                prompt, tokenizers=(pipe.tokenizer_1, pipe.tokenizer_2), text_encoders=(pipe.text_encoder_1, pipe.text_encoder_2),
+                onload=False, t5_sequence_length=t5_sequence_length,
             )
-            return {"prompt_emb": prompt_emb, "pooled_prompt_emb": pooled_prompt_emb, "text_ids": text_ids}
         else:
             return {}
 
@@ -695,15 +708,23 @@ class FluxImageUnit_Step1x(PipelineUnit):
             return inputs_shared, inputs_posi, inputs_nega
 
             
-class FluxImageUnit_TeaCache(PipelineUnit):
+class FluxImageUnit_StepCache(PipelineUnit):
     def __init__(self):
-        super().__init__(input_params=("num_inference_steps","tea_cache_l1_thresh"), output_params=("tea_cache",))
+        super().__init__(
+            seperate_cfg=True,
+            input_params=("num_inference_steps", "step_cache_policy", "step_cache_thresh", "step_cache_model_id", "tea_cache_l1_thresh"),
+            input_params_posi={}, input_params_nega={},
+            output_params=("step_cache",)
+        )
     
-    def process(self, pipe: FluxImagePipeline, num_inference_steps, tea_cache_l1_thresh):
-        if tea_cache_l1_thresh is None:
+    def process(self, pipe: FluxImagePipeline, num_inference_steps, step_cache_policy, step_cache_thresh, step_cache_model_id, tea_cache_l1_thresh):
+        if step_cache_policy is None and tea_cache_l1_thresh is not None:
+            step_cache_policy, step_cache_thresh = "teacache", tea_cache_l1_thresh
+        if step_cache_policy is None:
             return {}
-        else:
-            return {"tea_cache": TeaCache(num_inference_steps=num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh)}
+        if step_cache_policy == "teacache" and step_cache_model_id is None:
+            step_cache_model_id = "FLUX.1-dev"
+        return {"step_cache": StepCache(num_inference_steps, policy=step_cache_policy, thresh=step_cache_thresh, model_id=step_cache_model_id)}
 
 class FluxImageUnit_Flex(PipelineUnit):
     def __init__(self):
@@ -904,49 +925,6 @@ class FluxImageUnit_LoRAEncode(PipelineUnit):
 
 
 
-class TeaCache:
-    def __init__(self, num_inference_steps, rel_l1_thresh):
-        self.num_inference_steps = num_inference_steps
-        self.step = 0
-        self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = None
-        self.rel_l1_thresh = rel_l1_thresh
-        self.previous_residual = None
-        self.previous_hidden_states = None
-
-    def check(self, dit: FluxDiT, hidden_states, conditioning):
-        inp = hidden_states.clone()
-        temb_ = conditioning.clone()
-        modulated_inp, _, _, _, _ = dit.blocks[0].norm1_a(inp, emb=temb_)
-        if self.step == 0 or self.step == self.num_inference_steps - 1:
-            should_calc = True
-            self.accumulated_rel_l1_distance = 0
-        else: 
-            coefficients = [4.98651651e+02, -2.83781631e+02,  5.58554382e+01, -3.82021401e+00, 2.64230861e-01]
-            rescale_func = np.poly1d(coefficients)
-            self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
-            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
-                should_calc = False
-            else:
-                should_calc = True
-                self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = modulated_inp 
-        self.step += 1
-        if self.step == self.num_inference_steps:
-            self.step = 0
-        if should_calc:
-            self.previous_hidden_states = hidden_states.clone()
-        return not should_calc
-    
-    def store(self, hidden_states):
-        self.previous_residual = hidden_states - self.previous_hidden_states
-        self.previous_hidden_states = None
-
-    def update(self, hidden_states):
-        hidden_states = hidden_states + self.previous_residual
-        return hidden_states
-
-
 class FastTileWorker:
     def __init__(self):
         pass
@@ -1029,7 +1007,7 @@ def model_fn_flux_image(
     step1x_llm_embedding=None,
     step1x_mask=None,
     step1x_reference_latents=None,
-    tea_cache: TeaCache = None,
+    step_cache: StepCache = None,
     progress_id=0,
     num_inference_steps=1,
     use_gradient_checkpointing=False,
@@ -1091,10 +1069,9 @@ def model_fn_flux_image(
         
     # Flex
     if flex_condition is not None:
-        if timestep.tolist()[0] >= flex_control_stop_timestep:
-            hidden_states = torch.concat([hidden_states, flex_condition], dim=1)
-        else:
-            hidden_states = torch.concat([hidden_states, flex_uncondition], dim=1)
+        # Each sample has its own timestep in training.
+        use_flex_condition = (timestep >= flex_control_stop_timestep).reshape(-1, 1, 1, 1)
+        hidden_states = torch.concat([hidden_states, torch.where(use_flex_condition, flex_condition, flex_uncondition)], dim=1)
             
     # Step1x
     if step1x_llm_embedding is not None:
@@ -1134,16 +1111,17 @@ def model_fn_flux_image(
         image_rotary_emb = dit.pos_embedder(torch.cat((text_ids, image_ids), dim=1))
         attention_mask = None
 
-    # TeaCache
-    if tea_cache is not None:
-        tea_cache_update = tea_cache.check(dit, hidden_states, conditioning)
+    # Step cache
+    if step_cache is not None:
+        step_cache_update = step_cache.check(hidden_states, lambda: dit.blocks[0].norm1_a(hidden_states, emb=conditioning)[0], model=dit)
     else:
-        tea_cache_update = False
+        step_cache_update = False
 
-    if tea_cache_update:
-        hidden_states = tea_cache.update(hidden_states)
+    if step_cache_update:
+        hidden_states = step_cache.update(hidden_states)
     else:
         # Joint Blocks
+        first_block_input = hidden_states
         for block_id, block in enumerate(dit.blocks):
             hidden_states, prompt_emb = gradient_checkpoint_forward(
                 block,
@@ -1162,7 +1140,13 @@ def model_fn_flux_image(
                     hidden_states = hidden_states + controlnet_res_stack[block_id]
                 else:
                     hidden_states[:, :-kontext_latents.shape[1]] = hidden_states[:, :-kontext_latents.shape[1]] + controlnet_res_stack[block_id]
+            # Step cache
+            if block_id == 0 and step_cache is not None and step_cache.check_first_block(hidden_states, first_block_input):
+                hidden_states = step_cache.update(hidden_states)
+                step_cache_update = True
+                break
 
+    if not step_cache_update:
         # Single Blocks
         hidden_states = torch.cat([prompt_emb, hidden_states], dim=1)
         num_joint_blocks = len(dit.blocks)
@@ -1186,8 +1170,8 @@ def model_fn_flux_image(
                     hidden_states[:, prompt_emb.shape[1]:-kontext_latents.shape[1]] = hidden_states[:, prompt_emb.shape[1]:-kontext_latents.shape[1]] + controlnet_single_res_stack[block_id]
         hidden_states = hidden_states[:, prompt_emb.shape[1]:]
 
-        if tea_cache is not None:
-            tea_cache.store(hidden_states)
+        if step_cache is not None:
+            step_cache.store(hidden_states)
 
     hidden_states = dit.final_norm_out(hidden_states, conditioning)
     hidden_states = dit.final_proj_out(hidden_states)
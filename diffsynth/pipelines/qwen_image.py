@@ -7,6 +7,7 @@ import numpy as np
 from math import prod
 
 from ..diffusion import FlowMatchScheduler
+from ..diffusion.step_cache import StepCache
 from ..core import ModelConfig, gradient_checkpoint_forward
 from ..diffusion.base_pipeline import BasePipeline, PipelineUnit, ControlNetInput
 from ..utils.lora.merge import merge_lora
@@ -53,6 +54,7 @@ class QwenImagePipeline(BasePipeline):
             QwenImageUnit_PromptEmbedder(),
             QwenImageUnit_EntityControl(),
             QwenImageUnit_BlockwiseControlNet(),
+            QwenImageUnit_StepCache(),
         ]
         self.model_fn = model_fn_qwen_image
     
@@ -138,6 +140,10 @@ class QwenImagePipeline(BasePipeline):
         tiled: bool = False,
         tile_size: int = 128,
         tile_stride: int = 64,
+        # Step cache
+        step_cache_policy: str = None,
+        step_cache_thresh: float = None,
+        step_cache_model_id: str = None,
         # Progress bar
         progress_bar_cmd = tqdm,
     ):
@@ -158,6 +164,7 @@ class QwenImagePipeline(BasePipeline):
             "height": height, "width": width,
             "seed": seed, "rand_device": rand_device,
             "num_inference_steps": num_inference_steps,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
             "blockwise_controlnet_inputs": blockwise_controlnet_inputs,
             "tiled": tiled, "tile_size": tile_size, "tile_stride": tile_stride,
             "eligen_entity_prompts": eligen_entity_prompts, "eligen_entity_masks": eligen_entity_masks, "eligen_enable_on_negative": eligen_enable_on_negative,
@@ -381,7 +388,16 @@ class QwenImageUnit_PromptEmbedder(PipelineUnit):
         return split_hidden_states
 
     def process(self, pipe: QwenImagePipeline, prompt, edit_image=None) -> dict:
+        if pipe.text_encoder is not None and edit_image is None:
+            # Only text-only prompts are cached.
+            return pipe.encode_prompt_with_cache(
+                self, lambda: self.process_uncached(pipe, prompt, edit_image),
+                prompt, tokenizers=(pipe.tokenizer,), text_encoders=(pipe.text_encoder,),
+            )
         pipe.load_models_to_device(self.onload_model_names)
+        return self.process_uncached(pipe, prompt, edit_image)
+
+    def process_uncached(self, pipe: QwenImagePipeline, prompt, edit_image=None) -> dict:
         if pipe.text_encoder is not None:
             prompt = [prompt]
             if edit_image is None:
@@ -695,6 +711,21 @@ class QwenImageUnit_ContextImageEmbedder(PipelineUnit):
         return {"context_latents": context_latents}
 
 
+class QwenImageUnit_StepCache(PipelineUnit):
+    def __init__(self):
+        super().__init__(
+            seperate_cfg=True,
+            input_params=("num_inference_steps", "step_cache_policy", "step_cache_thresh", "step_cache_model_id"),
+            input_params_posi={}, input_params_nega={},
+            output_params=("step_cache",)
+        )
+
+    def process(self, pipe: QwenImagePipeline, num_inference_steps, step_cache_policy, step_cache_thresh, step_cache_model_id):
+        if step_cache_policy is None:
+            return {}
+        return {"step_cache": StepCache(num_inference_steps, policy=step_cache_policy, thresh=step_cache_thresh, model_id=step_cache_model_id)}
+
+
 def model_fn_qwen_image(
     dit: QwenImageDiT = None,
     blockwise_controlnet: QwenImageBlockwiseMultiControlNet = None,
@@ -720,6 +751,7 @@ def model_fn_qwen_image(
     use_gradient_checkpointing_offload=False,
     edit_rope_interpolation=False,
     zero_cond_t=False,
+    step_cache: StepCache = None,
     **kwargs
 ):
     if layer_num is None:
@@ -728,6 +760,8 @@ def model_fn_qwen_image(
     else:
         layer_num = layer_num + 1
         img_shapes = [(1, latents.shape[2]//2, latents.shape[3]//2)] * layer_num
+    if latents.shape[0] != layer_num:
+        raise ValueError(f"`model_fn_qwen_image` only supports batch size 1, but the shape of `latents` is {tuple(latents.shape)}.")
     txt_seq_lens = prompt_emb_mask.sum(dim=1).tolist()
     timestep = timestep / 1000
     
@@ -782,7 +816,14 @@ def model_fn_qwen_image(
         blockwise_controlnet_conditioning = blockwise_controlnet.preprocess(
             blockwise_controlnet_inputs, blockwise_controlnet_conditioning)
 
-    for block_id, block in enumerate(dit.transformer_blocks):
+    # Step cache
+    if step_cache is not None and step_cache.check(image, conditioning, model=dit):
+        image = step_cache.update(image)
+        transformer_blocks = []
+    else:
+        transformer_blocks = dit.transformer_blocks
+    first_block_input = image
+    for block_id, block in enumerate(transformer_blocks):
         text, image = gradient_checkpoint_forward(
             block,
             use_gradient_checkpointing,
@@ -803,6 +844,11 @@ def model_fn_qwen_image(
                 progress_id=progress_id, num_inference_steps=num_inference_steps,
             )
             image[:, :image_seq_len] = image_slice + controlnet_output
+        if block_id == 0 and step_cache is not None and step_cache.check_first_block(image, first_block_input):
+            image = step_cache.update(image)
+            break
+    if step_cache is not None:
+        step_cache.store(image)
     
     if zero_cond_t:
         conditioning = conditioning.chunk(2, dim=0)[0]
@@ -15,10 +15,11 @@ from typing_extensions import Literal
 from transformers import Wav2Vec2Processor
 
 from ..diffusion import FlowMatchScheduler
+from ..diffusion.step_cache import StepCache, load_step_cache_configs
 from ..core import ModelConfig, gradient_checkpoint_forward
 from ..diffusion.base_pipeline import BasePipeline, PipelineUnit
 
-from ..models.wan_video_dit import WanModel, sinusoidal_embedding_1d
+from ..models.wan_video_dit import WanModel, CrossAttentionKVCache, sinusoidal_embedding_1d, split_freqs_cis
 from ..models.wan_video_dit_s2v import rope_precompute
 from ..models.wan_video_text_encoder import WanTextEncoder, HuggingfaceTokenizer
 from ..models.wan_video_vae import WanVideoVAE
@@ -27,7 +28,7 @@ from ..models.wan_video_vace import VaceWanModel
 from ..models.wan_video_motion_controller import WanMotionControllerModel
 from ..models.wan_video_animate_adapter import WanAnimateAdapter
 
-from ..models.wan_video_flow_line_adapter import WanFlowLineAdapter
+from ..models.wan_video_flow_line_adapter import WanFlowLineAdapter, FlowLineFeatureCache
 
 from ..models.wan_video_mot import MotWanModel
 from ..models.wav2vec import WanS2VAudioEncoder
@@ -81,9 +82,11 @@ class WanVideoPipeline(BasePipeline):
             
             WanVideoUnit_FlowLine(),
             WanVideoUnit_Track(),
+            WanVideoUnit_FlowLineCache(),
             WanVideoUnit_VAP(),
             WanVideoUnit_UnifiedSequenceParallel(),
-            WanVideoUnit_TeaCache(),
+            WanVideoUnit_StepCache(),
+            WanVideoUnit_CrossAttentionKVCache(),
             WanVideoUnit_CfgMerger(),
             WanVideoUnit_LongCatVideo(),
         ]
@@ -114,26 +117,13 @@ class WanVideoPipeline(BasePipeline):
         model_configs: list[ModelConfig] = [],
         tokenizer_config: ModelConfig = ModelConfig(model_id="Wan-AI/Wan2.1-T2V-1.3B", origin_file_pattern="google/umt5-xxl/"),
         audio_processor_config: ModelConfig = None,
-        redirect_common_files: bool = True,
+        redirect_common_files: bool = None,
         use_usp: bool = False,
         vram_limit: float = None,
     ):
-        # Redirect model path
-        if redirect_common_files:
-            redirect_dict = {
-                "models_t5_umt5-xxl-enc-bf16.pth": ("DiffSynth-Studio/Wan-Series-Converted-Safetensors", "models_t5_umt5-xxl-enc-bf16.safetensors"),
-                "models_clip_open-clip-xlm-roberta-large-vit-huge-14.pth": ("DiffSynth-Studio/Wan-Series-Converted-Safetensors", "models_clip_open-clip-xlm-roberta-large-vit-huge-14.safetensors"),
-                "Wan2.1_VAE.pth": ("DiffSynth-Studio/Wan-Series-Converted-Safetensors", "Wan2.1_VAE.safetensors"),
-                "Wan2.2_VAE.pth": ("DiffSynth-Studio/Wan-Series-Converted-Safetensors", "Wan2.2_VAE.safetensors"),
-            }
-            for model_config in model_configs:
-                if model_config.origin_file_pattern is None or model_config.model_id is None:
-                    continue
-                if model_config.origin_file_pattern in redirect_dict and model_config.model_id != redirect_dict[model_config.origin_file_pattern][0]:
-                    print(f"To avoid repeatedly downloading model files, ({model_config.model_id}, {model_config.origin_file_pattern}) is redirected to {redirect_dict[model_config.origin_file_pattern]}. You can use `redirect_common_files=False` to disable file redirection.")
-                    model_config.model_id = redirect_dict[model_config.origin_file_pattern][0]
-                    model_config.origin_file_pattern = redirect_dict[model_config.origin_file_pattern][1]
-        
+        if redirect_common_files is not None:
+            # Deprecated. The legacy checkpoints are converted into safetensors when they are loaded, see `SafetensorsConversionCache`.
+            print("`redirect_common_files` is deprecated and has no effect. The model files are no longer redirected, and `.pth` files are converted into safetensors the first time they are loaded.")
         if use_usp:
             from ..utils.xfuser import initialize_usp
             initialize_usp(device)
@@ -262,15 +252,26 @@ class WanVideoPipeline(BasePipeline):
         tiled: Optional[bool] = True,
         tile_size: Optional[tuple[int, int]] = (30, 52),
         tile_stride: Optional[tuple[int, int]] = (15, 26),
+        tile_batch_size: Optional[int] = 1,
+        tile_pipelined: Optional[bool] = False,
+        tile_cache_offload: Optional[bool] = False,
         # Sliding window
         sliding_window_size: Optional[int] = None,
         sliding_window_stride: Optional[int] = None,
+        # Step cache
+        step_cache_policy: Optional[str] = None,
+        step_cache_thresh: Optional[float] = None,
+        step_cache_model_id: Optional[str] = None,
         # Teacache
         tea_cache_l1_thresh: Optional[float] = None,
         tea_cache_model_id: Optional[str] = "",
+        # Cross-attention K/V cache
+        cross_attn_kv_cache: Optional[bool] = False,
         # progress_bar
         progress_bar_cmd=tqdm,
         output_type: Optional[Literal["quantized", "floatpoint"]] = "quantized",
+        # Streaming output
+        video_writer = None,
     ):
         # Scheduler
         self.scheduler.set_timesteps(num_inference_steps, denoising_strength=denoising_strength, shift=sigma_shift)
@@ -279,12 +280,16 @@ class WanVideoPipeline(BasePipeline):
         inputs_posi = {
             "prompt": prompt,
             "vap_prompt": vap_prompt,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
             "tea_cache_l1_thresh": tea_cache_l1_thresh, "tea_cache_model_id": tea_cache_model_id, "num_inference_steps": num_inference_steps,
+            "cross_attn_kv_cache": cross_attn_kv_cache,
         }
         inputs_nega = {
             "negative_prompt": negative_prompt,
             "negative_vap_prompt": negative_vap_prompt,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
             "tea_cache_l1_thresh": tea_cache_l1_thresh, "tea_cache_model_id": tea_cache_model_id, "num_inference_steps": num_inference_steps,
+            "cross_attn_kv_cache": cross_attn_kv_cache,
         }
         inputs_shared = {
             "input_image": input_image,
@@ -336,10 +341,17 @@ class WanVideoPipeline(BasePipeline):
                 noise_pred = noise_pred_posi
 
             # Scheduler
-            inputs_shared["latents"] = self.scheduler.step(noise_pred, self.scheduler.timesteps[progress_id], inputs_shared["latents"])
+            inputs_shared["latents"] = self.scheduler.step(noise_pred, self.scheduler.timesteps[progress_id], inputs_shared["latents"], progress_id=progress_id)
             if "first_frame_latents" in inputs_shared:
                 inputs_shared["latents"][:, :, 0:1] = inputs_shared["first_frame_latents"]
         
+        # Free the step-invariant caches
+        if inputs_shared.get("flow_line_cache") is not None:
+            inputs_shared.pop("flow_line_cache").clear()
+        for inputs in (inputs_shared, inputs_posi, inputs_nega):
+            if inputs.get("kv_cache") is not None:
+                inputs.pop("kv_cache").clear()
+
         # VACE (TODO: remove it)
         if vace_reference_image is not None or (animate_pose_video is not None and animate_face_video is not None):
             if vace_reference_image is not None and isinstance(vace_reference_image, list):
@@ -352,7 +364,14 @@ class WanVideoPipeline(BasePipeline):
             inputs_shared, _, _ = self.unit_runner(unit, self, inputs_shared, inputs_posi, inputs_nega)
         # Decode
         self.load_models_to_device(['vae'])
-        video = self.vae.decode(inputs_shared["latents"], device=self.device, tiled=tiled, tile_size=tile_size, tile_stride=tile_stride)
+        if video_writer is not None:
+            # The frames are written as soon as they are decoded, and the video is not returned.
+            for chunk in self.vae.decode_stream(inputs_shared["latents"], device=self.device, tiled=tiled, tile_size=tile_size, tile_stride=tile_stride, tile_batch_size=tile_batch_size, offload_cache=tile_cache_offload):
+                for frame in self.vae_output_to_video(chunk, output_type="numpy"):
+                    video_writer.append_data(frame)
+            self.load_models_to_device([])
+            return None
+        video = self.vae.decode(inputs_shared["latents"], device=self.device, tiled=tiled, tile_size=tile_size, tile_stride=tile_stride, tile_batch_size=tile_batch_size, pipelined=tile_pipelined)
         if output_type == "quantized":
             video = self.vae_output_to_video(video)
         elif output_type == "floatpoint":
@@ -444,9 +463,10 @@ class WanVideoUnit_PromptEmbedder(PipelineUnit):
         return prompt_emb
 
     def process(self, pipe: WanVideoPipeline, prompt, positive) -> dict:
-        pipe.load_models_to_device(self.onload_model_names)
-        prompt_emb = self.encode_prompt(pipe, prompt)
-        return {"context": prompt_emb}
+        return pipe.encode_prompt_with_cache(
+            self, lambda: {"context": self.encode_prompt(pipe, prompt)},
+            prompt, tokenizers=(pipe.tokenizer,), text_encoders=(pipe.text_encoder,),
+        )
 
 
 
@@ -798,19 +818,44 @@ class WanVideoUnit_UnifiedSequenceParallel(PipelineUnit):
 
 
 
-class WanVideoUnit_TeaCache(PipelineUnit):
+class WanVideoUnit_StepCache(PipelineUnit):
     def __init__(self):
+        input_params = {name: name for name in (
+            "num_inference_steps", "step_cache_policy", "step_cache_thresh", "step_cache_model_id", "tea_cache_l1_thresh", "tea_cache_model_id",
+        )}
         super().__init__(
             seperate_cfg=True,
-            input_params_posi={"num_inference_steps": "num_inference_steps", "tea_cache_l1_thresh": "tea_cache_l1_thresh", "tea_cache_model_id": "tea_cache_model_id"},
-            input_params_nega={"num_inference_steps": "num_inference_steps", "tea_cache_l1_thresh": "tea_cache_l1_thresh", "tea_cache_model_id": "tea_cache_model_id"},
-            output_params=("tea_cache",)
+            input_params_posi=input_params,
+            input_params_nega=input_params,
+            output_params=("step_cache",)
         )
 
-    def process(self, pipe: WanVideoPipeline, num_inference_steps, tea_cache_l1_thresh, tea_cache_model_id):
-        if tea_cache_l1_thresh is None:
+    def process(self, pipe: WanVideoPipeline, num_inference_steps, step_cache_policy, step_cache_thresh, step_cache_model_id, tea_cache_l1_thresh, tea_cache_model_id):
+        if step_cache_policy is None and tea_cache_l1_thresh is not None:
+            # The legacy arguments always use the rescale coefficients of a model, so the model id cannot be omitted.
+            if not tea_cache_model_id:
+                raise ValueError(f"`tea_cache_model_id` is required by TeaCache. Please choose a valid model id in ({', '.join(load_step_cache_configs())}).")
+            step_cache_policy, step_cache_thresh, step_cache_model_id = "teacache", tea_cache_l1_thresh, tea_cache_model_id
+        if step_cache_policy is None:
             return {}
-        return {"tea_cache": TeaCache(num_inference_steps, rel_l1_thresh=tea_cache_l1_thresh, model_id=tea_cache_model_id)}
+        return {"step_cache": StepCache(num_inference_steps, policy=step_cache_policy, thresh=step_cache_thresh, model_id=step_cache_model_id)}
+
+
+
+class WanVideoUnit_CrossAttentionKVCache(PipelineUnit):
+    def __init__(self):
+        super().__init__(
+            seperate_cfg=True,
+            input_params_posi={"cross_attn_kv_cache": "cross_attn_kv_cache"},
+            input_params_nega={"cross_attn_kv_cache": "cross_attn_kv_cache"},
+            output_params=("kv_cache",)
+        )
+
+    def process(self, pipe: WanVideoPipeline, cross_attn_kv_cache):
+        # The K/V projections must be re-executed in training, otherwise they receive no gradients.
+        if not cross_attn_kv_cache or pipe.scheduler.training:
+            return {}
+        return {"kv_cache": CrossAttentionKVCache()}
 
 
 
@@ -822,6 +867,9 @@ class WanVideoUnit_CfgMerger(PipelineUnit):
     def process(self, pipe: WanVideoPipeline, inputs_shared, inputs_posi, inputs_nega):
         if not inputs_shared["cfg_merge"]:
             return inputs_shared, inputs_posi, inputs_nega
+        if inputs_posi.get("kv_cache") is not None:
+            # Only one branch is computed after merging, so one cache is enough.
+            inputs_shared["kv_cache"] = inputs_posi["kv_cache"]
         for name in self.concat_tensor_names:
             tensor_posi = inputs_posi.get(name)
             tensor_nega = inputs_nega.get(name)
@@ -1094,6 +1142,20 @@ class WanVideoUnit_Track(PipelineUnit):
         
         return cond_map
     
+class WanVideoUnit_FlowLineCache(PipelineUnit):
+    def __init__(self):
+        super().__init__(
+            input_params=("flow_latents",),
+            output_params=("flow_line_cache",)
+        )
+
+    def process(self, pipe: WanVideoPipeline, flow_latents):
+        # The adapter must be re-executed in training, otherwise it receives no gradients.
+        if flow_latents is None or pipe.scheduler.training:
+            return {}
+        return {"flow_line_cache": FlowLineFeatureCache()}
+
+
 class WanVideoUnit_LongCatVideo(PipelineUnit):
     def __init__(self):
         super().__init__(
@@ -1110,57 +1172,6 @@ class WanVideoUnit_LongCatVideo(PipelineUnit):
         longcat_latents = pipe.vae.encode(longcat_video, device=pipe.device).to(dtype=pipe.torch_dtype, device=pipe.device)
         return {"longcat_latents": longcat_latents}
 
-class TeaCache:
-    def __init__(self, num_inference_steps, rel_l1_thresh, model_id):
-        self.num_inference_steps = num_inference_steps
-        self.step = 0
-        self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = None
-        self.rel_l1_thresh = rel_l1_thresh
-        self.previous_residual = None
-        self.previous_hidden_states = None
-        
-        self.coefficients_dict = {
-            "Wan2.1-T2V-1.3B": [-5.21862437e+04, 9.23041404e+03, -5.28275948e+02, 1.36987616e+01, -4.99875664e-02],
-            "Wan2.1-T2V-14B": [-3.03318725e+05, 4.90537029e+04, -2.65530556e+03, 5.87365115e+01, -3.15583525e-01],
-            "Wan2.1-I2V-14B-480P": [2.57151496e+05, -3.54229917e+04,  1.40286849e+03, -1.35890334e+01, 1.32517977e-01],
-            "Wan2.1-I2V-14B-720P": [ 8.10705460e+03,  2.13393892e+03, -3.72934672e+02,  1.66203073e+01, -4.17769401e-02],
-        }
-        if model_id not in self.coefficients_dict:
-            supported_model_ids = ", ".join([i for i in self.coefficients_dict])
-            raise ValueError(f"{model_id} is not a supported TeaCache model id. Please choose a valid model id in ({supported_model_ids}).")
-        self.coefficients = self.coefficients_dict[model_id]
-
-    def check(self, dit: WanModel, x, t_mod):
-        modulated_inp = t_mod.clone()
-        if self.step == 0 or self.step == self.num_inference_steps - 1:
-            should_calc = True
-            self.accumulated_rel_l1_distance = 0
-        else:
-            coefficients = self.coefficients
-            rescale_func = np.poly1d(coefficients)
-            self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
-            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
-                should_calc = False
-            else:
-                should_calc = True
-                self.accumulated_rel_l1_distance = 0
-        self.previous_modulated_input = modulated_inp
-        self.step += 1
-        if self.step == self.num_inference_steps:
-            self.step = 0
-        if should_calc:
-            self.previous_hidden_states = x.clone()
-        return not should_calc
-
-    def store(self, hidden_states):
-        self.previous_residual = hidden_states - self.previous_hidden_states
-        self.previous_hidden_states = None
-
-    def update(self, hidden_states):
-        hidden_states = hidden_states + self.previous_residual
-        return hidden_states
-
 
 
 class TemporalTiler_BCTHW:
@@ -1240,12 +1251,14 @@ def model_fn_wan_video(
     vap_clip_feature = None,
     context_vap = None,
     drop_motion_frames: bool = True,
-    tea_cache: TeaCache = None,
+    step_cache: StepCache = None,
+    kv_cache: CrossAttentionKVCache = None,
     use_unified_sequence_parallel: bool = False,
     motion_bucket_id: Optional[torch.Tensor] = None,
     pose_latents=None,
     
     flow_latents=None,
+    flow_line_cache: FlowLineFeatureCache = None,
 
     face_pixel_values=None,
     longcat_latents=None,
@@ -1271,7 +1284,7 @@ def model_fn_wan_video(
             reference_latents=reference_latents,
             vace_context=vace_context,
             vace_scale=vace_scale,
-            tea_cache=tea_cache,
+            step_cache=step_cache,
             use_unified_sequence_parallel=use_unified_sequence_parallel,
             motion_bucket_id=motion_bucket_id,
         )
@@ -1319,11 +1332,13 @@ def model_fn_wan_video(
 
     # Timestep
     if dit.seperated_timestep and fuse_vae_embedding_in_latents:
+        # Per-token timesteps (B, F * H * W): the first frame is clean. Each sample has its own timestep in training.
+        num_tokens = latents.shape[3] * latents.shape[4] // 4
         timestep = torch.concat([
-            torch.zeros((1, latents.shape[3] * latents.shape[4] // 4), dtype=latents.dtype, device=latents.device),
-            torch.ones((latents.shape[2] - 1, latents.shape[3] * latents.shape[4] // 4), dtype=latents.dtype, device=latents.device) * timestep
-        ]).flatten()
-        t = dit.time_embedding(sinusoidal_embedding_1d(dit.freq_dim, timestep).unsqueeze(0))
+            torch.zeros((timestep.shape[0], num_tokens), dtype=latents.dtype, device=latents.device),
+            torch.ones((timestep.shape[0], (latents.shape[2] - 1) * num_tokens), dtype=latents.dtype, device=latents.device) * timestep.reshape(-1, 1)
+        ], dim=1)
+        t = dit.time_embedding(sinusoidal_embedding_1d(dit.freq_dim, timestep.flatten()).unflatten(0, timestep.shape))
         if use_unified_sequence_parallel and dist.is_initialized() and dist.get_world_size() > 1:
             t_chunks = torch.chunk(t, get_sequence_parallel_world_size(), dim=1)
             t_chunks = [torch.nn.functional.pad(chunk, (0, 0, 0, t_chunks[0].shape[1]-chunk.shape[1]), value=0) for chunk in t_chunks]
@@ -1336,6 +1351,10 @@ def model_fn_wan_video(
     # Motion Controller
     if motion_bucket_id is not None and motion_controller is not None:
         t_mod = t_mod + motion_controller(motion_bucket_id).unflatten(1, (6, dit.dim))
+    
+    # Cross-attention K/V cache
+    if kv_cache is not None:
+        kv_cache.check(dit, context, clip_feature)
     context = dit.text_embedding(context)
 
     x = latents
@@ -1361,7 +1380,7 @@ def model_fn_wan_video(
 
     #FlowLine
     if flow_latents is not None :
-        x = flow_line_adapter.after_patch_embedding(x, flow_latents)
+        x = flow_line_adapter.after_patch_embedding(x, flow_latents, flow_line_cache=flow_line_cache)
 
     # Patchify
     f, h, w = x.shape[2:]
@@ -1375,11 +1394,7 @@ def model_fn_wan_video(
         x = torch.concat([reference_latents, x], dim=1)
         f += 1
     
-    freqs = torch.cat([
-        dit.freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-        dit.freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-        dit.freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-    ], dim=-1).reshape(f * h * w, 1, -1).to(x.device)
+    freqs = dit.rope(f, h, w, device=x.device)
 
     # VAP 
     if vap is not None:
@@ -1393,18 +1408,18 @@ def model_fn_wan_video(
         t_mod_vap = vap.time_projection(t).unflatten(1, (6, vap.dim))
 
         # rope
-        freqs_vap = vap.compute_freqs_mot(f,h,w).to(x.device)
+        freqs_vap = vap.compute_freqs_mot(f, h, w, device=x.device)
 
         # context
         vap_clip_embedding = vap.img_emb(vap_clip_feature)
         context_vap = vap.text_embedding(context_vap)
         context_vap = torch.cat([vap_clip_embedding, context_vap], dim=1)
     
-    # TeaCache
-    if tea_cache is not None:
-        tea_cache_update = tea_cache.check(dit, x, t_mod)
+    # Step cache
+    if step_cache is not None:
+        step_cache_update = step_cache.check(x, t_mod, model=dit)
     else:
-        tea_cache_update = False
+        step_cache_update = False
         
     if vace_context is not None:
         vace_hints = vace(
@@ -1420,8 +1435,8 @@ def model_fn_wan_video(
             pad_shape = chunks[0].shape[1] - chunks[-1].shape[1]
             chunks = [torch.nn.functional.pad(chunk, (0, 0, 0, chunks[0].shape[1]-chunk.shape[1]), value=0) for chunk in chunks]
             x = chunks[get_sequence_parallel_rank()]
-    if tea_cache_update:
-        x = tea_cache.update(x)
+    if step_cache_update:
+        x = step_cache.update(x)
     else:
         def create_custom_forward(module):
             def custom_forward(*inputs):
@@ -1433,6 +1448,7 @@ def model_fn_wan_video(
                 return vap(block, *inputs)
             return custom_forward
         
+        first_block_input = x
         for block_id, block in enumerate(dit.blocks):
             # Block
             if vap is not None and block_id in vap.mot_layers_mapping:
@@ -1466,7 +1482,7 @@ def model_fn_wan_video(
                         use_reentrant=False,
                     )
                 else:
-                    x = block(x, context, t_mod, freqs)
+                    x = block(x, context, t_mod, freqs, None if kv_cache is None else kv_cache.fetch(block_id))
             
             # VACE
             if vace_context is not None and block_id in vace.vace_layers_mapping:
@@ -1479,8 +1495,13 @@ def model_fn_wan_video(
             # Animate
             if pose_latents is not None and face_pixel_values is not None:
                 x = animate_adapter.after_transformer_block(block_id, x, motion_vec)
-        if tea_cache is not None:
-            tea_cache.store(x)
+
+            # Step cache
+            if block_id == 0 and step_cache is not None and step_cache.check_first_block(x, first_block_input):
+                x = step_cache.update(x)
+                break
+        if step_cache is not None:
+            step_cache.store(x)
             
     x = dit.head(x, t)
     if use_unified_sequence_parallel:
@@ -1504,6 +1525,8 @@ def model_fn_longcat_video(
     use_gradient_checkpointing=False,
     use_gradient_checkpointing_offload=False,
 ):
+    if latents.shape[0] != 1:
+        raise ValueError(f"`model_fn_longcat_video` only supports batch size 1, but the shape of `latents` is {tuple(latents.shape)}.")
     if longcat_latents is not None:
         latents[:, :, :longcat_latents.shape[2]] = longcat_latents
         num_cond_latents = longcat_latents.shape[2]
@@ -1538,6 +1561,8 @@ def model_fn_wans2v(
     use_gradient_checkpointing=False,
     use_unified_sequence_parallel=False,
 ):
+    if latents.shape[0] != 1:
+        raise ValueError(f"`model_fn_wans2v` only supports batch size 1, but the shape of `latents` is {tuple(latents.shape)}.")
     if use_unified_sequence_parallel:
         import torch.distributed as dist
         from xfuser.core.distributed import (get_sequence_parallel_rank,
@@ -1567,6 +1592,7 @@ def model_fn_wans2v(
     pre_compute_freqs = rope_precompute(x.detach().view(1, x.size(1), dit.num_heads, dit.dim // dit.num_heads), grid_sizes, dit.freqs, start=None)
     # motion
     x, pre_compute_freqs, mask = dit.inject_motion(x, pre_compute_freqs, mask, motion_latents, drop_motion_frames=drop_motion_frames, add_last_motion=2)
+    freqs = split_freqs_cis(pre_compute_freqs[0])
 
     x = x + dit.trainable_cond_mask(mask).to(x.dtype)
 
@@ -1593,7 +1619,7 @@ def model_fn_wans2v(
             with torch.autograd.graph.save_on_cpu():
                 x = torch.utils.checkpoint.checkpoint(
                     create_custom_forward(block),
-                    x, context, t_mod, seq_len_x, pre_compute_freqs[0],
+                    x, context, t_mod, seq_len_x, freqs,
                     use_reentrant=False,
                 )
                 x = torch.utils.checkpoint.checkpoint(
@@ -1604,7 +1630,7 @@ def model_fn_wans2v(
         elif use_gradient_checkpointing:
             x = torch.utils.checkpoint.checkpoint(
                 create_custom_forward(block),
-                x, context, t_mod, seq_len_x, pre_compute_freqs[0],
+                x, context, t_mod, seq_len_x, freqs,
                 use_reentrant=False,
             )
             x = torch.utils.checkpoint.checkpoint(
@@ -1613,7 +1639,7 @@ def model_fn_wans2v(
                 use_reentrant=False,
             )
         else:
-            x = block(x, context, t_mod, seq_len_x, pre_compute_freqs[0])
+            x = block(x, context, t_mod, seq_len_x, freqs)
             x = dit.after_transformer_block(block_id, x, audio_emb_global, merged_audio_emb, seq_len_x_global, use_unified_sequence_parallel)
 
     if use_unified_sequence_parallel and dist.is_initialized() and dist.get_world_size() > 1:
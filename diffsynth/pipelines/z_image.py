@@ -7,6 +7,7 @@ import numpy as np
 from typing import Union, List, Optional, Tuple, Iterable, Dict
 
 from ..diffusion import FlowMatchScheduler
+from ..diffusion.step_cache import StepCache
 from ..core import ModelConfig, gradient_checkpoint_forward
 from ..core.data.operators import ImageCropAndResize
 from ..diffusion.base_pipeline import BasePipeline, PipelineUnit, ControlNetInput
@@ -51,6 +52,7 @@ class ZImagePipeline(BasePipeline):
             ZImageUnit_EditImageEmbedderVAE(),
             ZImageUnit_EditImageEmbedderSiglip(),
             ZImageUnit_PAIControlNet(),
+            ZImageUnit_StepCache(),
         ]
         self.model_fn = model_fn_z_image
     
@@ -113,6 +115,10 @@ class ZImagePipeline(BasePipeline):
         # Image to LoRA
         image2lora_images: List[Image.Image] = None,
         positive_only_lora: Dict[str, torch.Tensor] = None,
+        # Step cache
+        step_cache_policy: str = None,
+        step_cache_thresh: float = None,
+        step_cache_model_id: str = None,
         # Progress bar
         progress_bar_cmd = tqdm,
     ):
@@ -132,6 +138,7 @@ class ZImagePipeline(BasePipeline):
             "height": height, "width": width,
             "seed": seed, "rand_device": rand_device,
             "num_inference_steps": num_inference_steps,
+            "step_cache_policy": step_cache_policy, "step_cache_thresh": step_cache_thresh, "step_cache_model_id": step_cache_model_id,
             "edit_image": edit_image, "edit_image_auto_resize": edit_image_auto_resize,
             "controlnet_inputs": controlnet_inputs,
             "image2lora_images": image2lora_images, "positive_only_lora": positive_only_lora,
@@ -142,14 +149,18 @@ class ZImagePipeline(BasePipeline):
         # Denoise
         self.load_models_to_device(self.in_iteration_models)
         models = {name: getattr(self, name) for name in self.in_iteration_models}
-        for progress_id, timestep in enumerate(progress_bar_cmd(self.scheduler.timesteps)):
-            timestep = timestep.unsqueeze(0).to(dtype=self.torch_dtype, device=self.device)
-            noise_pred = self.cfg_guided_model_fn(
-                self.model_fn, cfg_scale,
-                inputs_shared, inputs_posi, inputs_nega,
-                **models, timestep=timestep, progress_id=progress_id
-            )
-            inputs_shared["latents"] = self.step(self.scheduler, progress_id=progress_id, noise_pred=noise_pred, **inputs_shared)
+        try:
+            for progress_id, timestep in enumerate(progress_bar_cmd(self.scheduler.timesteps)):
+                timestep = timestep.unsqueeze(0).to(dtype=self.torch_dtype, device=self.device)
+                noise_pred = self.cfg_guided_model_fn(
+                    self.model_fn, cfg_scale,
+                    inputs_shared, inputs_posi, inputs_nega,
+                    **models, timestep=timestep, progress_id=progress_id
+                )
+                inputs_shared["latents"] = self.step(self.scheduler, progress_id=progress_id, noise_pred=noise_pred, **inputs_shared)
+        finally:
+            # The positive-only LoRA must not leak into later calls, even if the loop is interrupted.
+            self.clear_positive_only_lora()
         
         # Decode
         self.load_models_to_device(['vae_decoder'])
@@ -293,18 +304,28 @@ class ZImageUnit_PromptEmbedder(PipelineUnit):
 
         return embeddings_list
 
-    def process(self, pipe: ZImagePipeline, prompt, edit_image):
-        pipe.load_models_to_device(self.onload_model_names)
-        if hasattr(pipe, "dit") and pipe.dit.siglip_embedder is not None:
-            # Z-Image-Turbo and Z-Image-Omni-Base use different prompt encoding methods.
-            # We determine which encoding method to use based on the model architecture.
-            # If you are using two-stage split training,
-            # please use `--offload_models` instead of skipping the DiT model loading.
+    def process_uncached(self, pipe: ZImagePipeline, prompt, edit_image, omni):
+        if omni:
             prompt_embeds = self.encode_prompt_omni(pipe, prompt, edit_image, pipe.device)
         else:
             prompt_embeds = self.encode_prompt(pipe, prompt, pipe.device)
         return {"prompt_embeds": prompt_embeds}
 
+    def process(self, pipe: ZImagePipeline, prompt, edit_image):
+        # Z-Image-Turbo and Z-Image-Omni-Base use different prompt encoding methods.
+        # We determine which encoding method to use based on the model architecture.
+        # If you are using two-stage split training,
+        # please use `--offload_models` instead of skipping the DiT model loading.
+        omni = hasattr(pipe, "dit") and pipe.dit.siglip_embedder is not None
+        if edit_image is None:
+            # Only text-only prompts are cached.
+            return pipe.encode_prompt_with_cache(
+                self, lambda: self.process_uncached(pipe, prompt, edit_image, omni),
+                prompt, tokenizers=(pipe.tokenizer,), text_encoders=(pipe.text_encoder,), omni=omni,
+            )
+        pipe.load_models_to_device(self.onload_model_names)
+        return self.process_uncached(pipe, prompt, edit_image, omni)
+
 
 class ZImageUnit_NoiseInitializer(PipelineUnit):
     def __init__(self):
@@ -439,6 +460,21 @@ class ZImageUnit_PAIControlNet(PipelineUnit):
         return {"control_context": control_context, "control_scale": controlnet_input.scale}
 
 
+class ZImageUnit_StepCache(PipelineUnit):
+    def __init__(self):
+        super().__init__(
+            seperate_cfg=True,
+            input_params=("num_inference_steps", "step_cache_policy", "step_cache_thresh", "step_cache_model_id"),
+            input_params_posi={}, input_params_nega={},
+            output_params=("step_cache",)
+        )
+
+    def process(self, pipe: ZImagePipeline, num_inference_steps, step_cache_policy, step_cache_thresh, step_cache_model_id):
+        if step_cache_policy is None:
+            return {}
+        return {"step_cache": StepCache(num_inference_steps, policy=step_cache_policy, thresh=step_cache_thresh, model_id=step_cache_model_id)}
+
+
 def model_fn_z_image(
     dit: ZImageDiT,
     controlnet: ZImageControlNet = None,
@@ -447,6 +483,7 @@ def model_fn_z_image(
     prompt_embeds=None,
     image_embeds=None,
     image_latents=None,
+    step_cache: StepCache = None,
     use_gradient_checkpointing=False,
     use_gradient_checkpointing_offload=False,
     **kwargs,
@@ -463,10 +500,13 @@ def model_fn_z_image(
             prompt_embeds=prompt_embeds,
             image_embeds=image_embeds,
             image_latents=image_latents,
+            step_cache=step_cache,
             use_gradient_checkpointing=use_gradient_checkpointing,
             use_gradient_checkpointing_offload=use_gradient_checkpointing_offload,
             **kwargs,
         )
+    if latents.shape[0] != 1:
+        raise ValueError(f"`model_fn_z_image` only supports batch size 1, but the shape of `latents` is {tuple(latents.shape)}.")
     latents = [rearrange(latents, "B C H W -> C B H W")]
     if dit.siglip_embedder is not None:
         if image_latents is not None:
@@ -486,6 +526,7 @@ def model_fn_z_image(
         prompt_embeds,
         siglip_feats=image_embeds,
         image_noise_mask=image_noise_mask,
+        step_cache=step_cache,
         use_gradient_checkpointing=use_gradient_checkpointing,
         use_gradient_checkpointing_offload=use_gradient_checkpointing_offload,
     )[0]
@@ -569,6 +610,7 @@ def model_fn_z_image_turbo(
     image_latents=None,
     control_context=None,
     control_scale=None,
+    step_cache: StepCache = None,
     use_gradient_checkpointing=False,
     use_gradient_checkpointing_offload=False,
     **kwargs,
@@ -579,6 +621,8 @@ def model_fn_z_image_turbo(
         latents = latents[0]
     while isinstance(image_embeds, list):
         image_embeds = image_embeds[0]
+    if latents.shape[0] != 1:
+        raise ValueError(f"`model_fn_z_image_turbo` only supports batch size 1, but the shape of `latents` is {tuple(latents.shape)}.")
 
     # Timestep
     timestep = 1000 - timestep
@@ -646,7 +690,14 @@ def model_fn_z_image_turbo(
             use_gradient_checkpointing=use_gradient_checkpointing, use_gradient_checkpointing_offload=use_gradient_checkpointing_offload,
         )
 
-    for layer_id, layer in enumerate(dit.layers):
+    # Step cache
+    if step_cache is not None and step_cache.check(unified, t_noisy, model=dit):
+        unified = step_cache.update(unified)
+        layers = []
+    else:
+        layers = dit.layers
+    first_layer_input = unified
+    for layer_id, layer in enumerate(layers):
         unified = gradient_checkpoint_forward(
             layer,
             use_gradient_checkpointing=use_gradient_checkpointing,
@@ -659,6 +710,11 @@ def model_fn_z_image_turbo(
         if control_context is not None:
             if layer_id in controlnet.control_layers_mapping:
                 unified = unified + hints[controlnet.control_layers_mapping[layer_id]] * control_scale
+        if layer_id == 0 and step_cache is not None and step_cache.check_first_block(unified, first_layer_input):
+            unified = step_cache.update(unified)
+            break
+    if step_cache is not None:
+        step_cache.store(unified)
     
     # Output
     unified = dit.all_final_layer["2-1"](unified, t_noisy)
@@ -1,4 +1,4 @@
-import imageio, os
+import imageio, os, queue, threading, torch
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
@@ -213,5 +213,94 @@ def merge_video_audio(video_path: str, audio_path: str):
 
 
 def save_video_with_audio(frames, save_path, audio_path, fps=16, quality=9, ffmpeg_params=None):
-    save_video(frames, save_path, fps, quality, ffmpeg_params)
-    merge_video_audio(save_path, audio_path)
+    # The audio is muxed while the frames are encoded, so the video is only written once.
+    with AsyncVideoWriter(save_path, fps, quality=quality, ffmpeg_params=ffmpeg_params, audio_path=audio_path) as writer:
+        writer.write(frames)
+
+
+def iterate_video_frames(data):
+    # Yields (H, W, C) uint8 arrays from
+    # * PIL images or lists of them,
+    # * uint8 arrays/tensors in the shape (H, W, C) or (T, H, W, C),
+    # * float tensors in [-1, 1] in the shape (C, T, H, W) or (B, C, T, H, W), i.e., the VAE output.
+    if isinstance(data, Image.Image):
+        yield np.array(data)
+    elif isinstance(data, torch.Tensor) and data.is_floating_point():
+        if data.ndim == 5:
+            data = data.mean(dim=0)
+        data = ((data + 1) * (255 / 2)).clip(0, 255).to(dtype=torch.uint8).permute(1, 2, 3, 0)
+        yield from iterate_video_frames(data)
+    elif isinstance(data, (torch.Tensor, np.ndarray)):
+        if isinstance(data, torch.Tensor):
+            data = data.to("cpu").numpy()
+        if data.ndim == 3:
+            yield data
+        else:
+            yield from data
+    else:
+        for frame in data:
+            yield from iterate_video_frames(frame)
+
+
+class AsyncVideoWriter:
+    # Encodes video frames on a background thread.
+    # `write` only puts the frames into a bounded queue, so that the caller (e.g., the next denoising job) can continue while the frames are encoded.
+    # If `audio_path` is set, the audio is muxed in the same ffmpeg pass, with the duration set to the shorter of the two.
+
+    def __init__(self, save_path, fps, quality=9, ffmpeg_params=None, audio_path=None, max_queue_size=8):
+        kwargs = {"fps": fps, "quality": quality, "ffmpeg_params": ffmpeg_params}
+        if audio_path is not None:
+            if not os.path.exists(audio_path):
+                raise FileNotFoundError(f"audio file {audio_path} does not exist")
+            kwargs.update({"audio_path": audio_path, "audio_codec": "aac", "ffmpeg_params": (ffmpeg_params or []) + ["-b:a", "192k", "-shortest"]})
+        self.save_path = save_path
+        self.writer = imageio.get_writer(save_path, **kwargs)
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.num_frames = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # Drain the queue after a failure so that `write` never blocks.
+                continue
+            try:
+                for frame in iterate_video_frames(item):
+                    self.writer.append_data(frame)
+                    self.num_frames += 1
+            except Exception as e:
+                self.error = e
+
+    def check_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Failed to write video {self.save_path}") from self.error
+
+    def write(self, frames):
+        # frames: a frame, a list of frames, or a video tensor. See `iterate_video_frames`.
+        # Tensors are not copied, so they should not be modified in-place after they are written.
+        self.check_error()
+        if not self.thread.is_alive():
+            raise RuntimeError(f"Video writer of {self.save_path} is closed")
+        self.queue.put(frames)
+
+    def append_data(self, frame):
+        # Compatible with the writers of imageio.
+        self.write(frame)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            self.writer.close()
+        self.check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
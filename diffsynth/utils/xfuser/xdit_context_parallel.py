@@ -6,6 +6,7 @@ from xfuser.core.distributed import (get_sequence_parallel_rank,
                                      get_sp_group)
 from xfuser.core.long_ctx_attention import xFuserLongContextAttention
 from ...core.device import parse_nccl_backend, parse_device_type
+from ...models.wan_video_dit import rope_apply as wan_rope_apply, split_freqs_cis
 
 
 def initialize_usp(device_type):
@@ -27,32 +28,28 @@ def sinusoidal_embedding_1d(dim, position):
     x = torch.cat([torch.cos(sinusoid), torch.sin(sinusoid)], dim=1)
     return x.to(position.dtype)
 
-def pad_freqs(original_tensor, target_len):
+def pad_freqs(original_tensor, target_len, value=1):
     seq_len, s1, s2 = original_tensor.shape
     pad_size = target_len - seq_len
-    padding_tensor = torch.ones(
-        pad_size,
-        s1,
-        s2,
+    padding_tensor = torch.full(
+        (pad_size, s1, s2),
+        value,
         dtype=original_tensor.dtype,
         device=original_tensor.device)
     padded_tensor = torch.cat([original_tensor, padding_tensor], dim=0)
     return padded_tensor
     
 def rope_apply(x, freqs, num_heads):
-    x = rearrange(x, "b s (n d) -> b s n d", n=num_heads)
+    if isinstance(freqs, torch.Tensor):
+        freqs = split_freqs_cis(freqs)
     s_per_rank = x.shape[1]
 
-    x_out = torch.view_as_complex(x.to(torch.float64).reshape(
-        x.shape[0], x.shape[1], x.shape[2], -1, 2))
-
     sp_size = get_sequence_parallel_world_size()
     sp_rank = get_sequence_parallel_rank()
-    freqs = pad_freqs(freqs, s_per_rank * sp_size)
-    freqs_rank = freqs[(sp_rank * s_per_rank):((sp_rank + 1) * s_per_rank), :, :]
-
-    x_out = torch.view_as_real(x_out * freqs_rank).flatten(2)
-    return x_out.to(x.dtype)
+    # The padded positions are not rotated (cos = 1, sin = 0).
+    cos = pad_freqs(freqs[0], s_per_rank * sp_size, 1)[(sp_rank * s_per_rank):((sp_rank + 1) * s_per_rank)]
+    sin = pad_freqs(freqs[1], s_per_rank * sp_size, 0)[(sp_rank * s_per_rank):((sp_rank + 1) * s_per_rank)]
+    return wan_rope_apply(x, (cos, sin), num_heads)
 
 def usp_dit_forward(self,
             x: torch.Tensor,
@@ -76,11 +73,7 @@ def usp_dit_forward(self,
     
     x, (f, h, w) = self.patchify(x)
     
-    freqs = torch.cat([
-        self.freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-        self.freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-        self.freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-    ], dim=-1).reshape(f * h * w, 1, -1).to(x.device)
+    freqs = self.rope(f, h, w, device=x.device)
     
     def create_custom_forward(module):
         def custom_forward(*inputs):
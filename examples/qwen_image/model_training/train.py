@@ -86,10 +86,10 @@ class QwenImageTrainingModule(DiffusionTrainingModule):
         return inputs_shared, inputs_posi, inputs_nega
     
     def forward(self, data, inputs=None):
-        if inputs is None: inputs = self.get_pipeline_inputs(data)
-        inputs = self.transfer_data_to_device(inputs, self.pipe.device, self.pipe.torch_dtype)
-        for unit in self.pipe.units:
-            inputs = self.pipe.unit_runner(unit, self.pipe, *inputs)
+        if isinstance(data, list) or isinstance(inputs, list):
+            # `model_fn_qwen_image` only processes one sample.
+            return self.forward_per_sample(data, inputs)
+        inputs = self.run_pipeline_units(data, inputs)
         loss = self.task_to_loss[self.task](self.pipe, *inputs)
         return loss
 
@@ -124,6 +124,14 @@ if __name__ == "__main__":
             height_division_factor=16,
             width_division_factor=16,
         ),
+        bucket_operator=UnifiedDataset.default_image_bucket_operator(
+            base_path=args.dataset_base_path,
+            max_pixels=args.max_pixels,
+            height=args.height,
+            width=args.width,
+            height_division_factor=16,
+            width_division_factor=16,
+        ),
         special_operator_map={
             # Qwen-Image-Layered
             "layer_input_image": ToAbsolutePath(args.dataset_base_path) >> LoadImage(convert_RGB=False, convert_RGBA=True) >> ImageCropAndResize(args.height, args.width, args.max_pixels, 16, 16),
@@ -131,7 +139,11 @@ if __name__ == "__main__":
                 (str, ToAbsolutePath(args.dataset_base_path) >> LoadImage() >> ImageCropAndResize(args.height, args.width, args.max_pixels, 16, 16)),
                 (list, SequencialProcess(ToAbsolutePath(args.dataset_base_path) >> LoadImage(convert_RGB=False, convert_RGBA=True) >> ImageCropAndResize(args.height, args.width, args.max_pixels, 16, 16))),
             ])
-        }
+        },
+        special_bucket_operator_map={
+            "layer_input_image": UnifiedDataset.default_image_bucket_operator(args.dataset_base_path, args.max_pixels, args.height, args.width, 16, 16),
+            "image": UnifiedDataset.default_image_bucket_operator(args.dataset_base_path, args.max_pixels, args.height, args.width, 16, 16),
+        },
     )
     model = QwenImageTrainingModule(
         model_paths=args.model_paths,
@@ -1,6 +1,6 @@
 import torch, os, argparse, accelerate, warnings
 from diffsynth.core import UnifiedDataset
-from diffsynth.core.data.operators import LoadVideo, LoadAudio, ImageCropAndResize, ToAbsolutePath,LoadNumpy
+from diffsynth.core.data.operators import LoadVideoStream, LoadAudio, ImageCropAndResize, ToAbsolutePath,LoadNumpy
 from diffsynth.pipelines.wan_video import WanVideoPipeline, ModelConfig
 from diffsynth.diffusion import *
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -100,10 +100,7 @@ class WanTrainingModule(DiffusionTrainingModule):
         return inputs_shared, inputs_posi, inputs_nega
     
     def forward(self, data, inputs=None):
-        if inputs is None: inputs = self.get_pipeline_inputs(data)
-        inputs = self.transfer_data_to_device(inputs, self.pipe.device, self.pipe.torch_dtype)
-        for unit in self.pipe.units:
-            inputs = self.pipe.unit_runner(unit, self.pipe, *inputs)
+        inputs = self.run_pipeline_units(data, inputs)
         loss = self.task_to_loss[self.task](self.pipe, *inputs)
         return loss
 
@@ -143,10 +140,21 @@ if __name__ == "__main__":
             time_division_factor=4,
             time_division_remainder=1,
         ),
+        bucket_operator=UnifiedDataset.default_video_bucket_operator(
+            base_path=args.dataset_base_path,
+            max_pixels=args.max_pixels,
+            height=args.height,
+            width=args.width,
+            height_division_factor=division_factor,
+            width_division_factor=division_factor,
+            num_frames=args.num_frames,
+            time_division_factor=4,
+            time_division_remainder=1,
+        ),
         special_operator_map={
-            "animate_face_video": ToAbsolutePath(args.dataset_base_path) >> LoadVideo(args.num_frames, 4, 1, frame_processor=ImageCropAndResize(512, 512, None, 16, 16)),
+            "animate_face_video": ToAbsolutePath(args.dataset_base_path) >> LoadVideoStream(args.num_frames, 4, 1, frame_processor=ImageCropAndResize(512, 512, None, 16, 16), output_type="pil"),
             "input_audio": ToAbsolutePath(args.dataset_base_path) >> LoadAudio(sr=16000),
-            "flow_line": ToAbsolutePath(args.dataset_base_path) >>  LoadVideo(args.num_frames, 4, 1, frame_processor=ImageCropAndResize(None,None, args.max_pixels,division_factor,division_factor)),
+            "flow_line": ToAbsolutePath(args.dataset_base_path) >>  LoadVideoStream(args.num_frames, 4, 1, frame_processor=ImageCropAndResize(None,None, args.max_pixels,division_factor,division_factor), output_type="pil"),
             "track": ToAbsolutePath(args.dataset_base_path) >> LoadNumpy()
 
         }
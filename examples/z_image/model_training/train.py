@@ -81,10 +81,10 @@ class ZImageTrainingModule(DiffusionTrainingModule):
         return inputs_shared, inputs_posi, inputs_nega
     
     def forward(self, data, inputs=None):
-        if inputs is None: inputs = self.get_pipeline_inputs(data)
-        inputs = self.transfer_data_to_device(inputs, self.pipe.device, self.pipe.torch_dtype)
-        for unit in self.pipe.units:
-            inputs = self.pipe.unit_runner(unit, self.pipe, *inputs)
+        if isinstance(data, list) or isinstance(inputs, list):
+            # `model_fn_z_image` only processes one sample.
+            return self.forward_per_sample(data, inputs)
+        inputs = self.run_pipeline_units(data, inputs)
         loss = self.task_to_loss[self.task](self.pipe, *inputs)
         return loss
 
@@ -116,7 +116,15 @@ if __name__ == "__main__":
             width=args.width,
             height_division_factor=16,
             width_division_factor=16,
-        )
+        ),
+        bucket_operator=UnifiedDataset.default_image_bucket_operator(
+            base_path=args.dataset_base_path,
+            max_pixels=args.max_pixels,
+            height=args.height,
+            width=args.width,
+            height_division_factor=16,
+            width_division_factor=16,
+        ),
     )
     model = ZImageTrainingModule(
         model_paths=args.model_paths,
@@ -0,0 +1,46 @@
+import torch
+from diffsynth.core.attention import attention_forward_padded
+
+
+def masked_sdpa(q, k, v, padding_mask, scale=None):
+    # Dense attention in which the padding keys are masked out, in the pattern "b s n d".
+    attn_mask = padding_mask[:, None, None, :]
+    out = torch.nn.functional.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2), attn_mask=attn_mask, scale=scale)
+    return out.transpose(1, 2)
+
+
+def build_qkv(batch_size=3, seq_len=24, num_heads=4, head_dim=16, dtype=torch.float64):
+    generator = torch.Generator().manual_seed(0)
+    return [torch.randn((batch_size, seq_len, num_heads, head_dim), generator=generator, dtype=dtype) for _ in range(3)]
+
+
+def test_attention_forward_padded_matches_masked_sdpa():
+    q, k, v = build_qkv()
+    padding_masks = {
+        "right": torch.arange(24)[None, :] < torch.tensor([[24], [17], [5]]),
+        "scattered": torch.rand((3, 24), generator=torch.Generator().manual_seed(1)) < 0.6,
+    }
+    for name, padding_mask in padding_masks.items():
+        padding_mask[:, 0] = True
+        for scale in [None, 0.1]:
+            out = attention_forward_padded(q, k, v, padding_mask, q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d", scale=scale)
+            out_ref = masked_sdpa(q, k, v, padding_mask, scale=scale)
+            torch.testing.assert_close(out[padding_mask], out_ref[padding_mask], msg=name)
+            # The outputs of the padding tokens are zero.
+            assert bool((out[~padding_mask] == 0).all()), name
+
+
+def test_attention_forward_padded_patterns():
+    q, k, v = build_qkv()
+    padding_mask = torch.arange(24)[None, :] < torch.tensor([[20], [9], [24]])
+    out_ref = attention_forward_padded(q, k, v, padding_mask, q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d")
+    q_, k_, v_ = q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)
+    out = attention_forward_padded(q_, k_, v_, padding_mask)
+    torch.testing.assert_close(out.transpose(1, 2), out_ref)
+
+
+def test_attention_forward_padded_without_padding():
+    q, k, v = build_qkv()
+    padding_mask = torch.ones((3, 24), dtype=torch.bool)
+    out = attention_forward_padded(q, k, v, padding_mask, q_pattern="b s n d", k_pattern="b s n d", v_pattern="b s n d", out_pattern="b s n d")
+    torch.testing.assert_close(out, masked_sdpa(q, k, v, padding_mask))
@@ -0,0 +1,50 @@
+import pytest
+import torch
+from diffsynth.diffusion.flow_match import FlowMatchScheduler
+
+
+def baseline_timestep_id(scheduler, timestep):
+    # The lookup before the index was introduced: argmin over the distances to all timesteps.
+    return torch.argmin((scheduler.timesteps.unsqueeze(0) - timestep.reshape(-1, 1)).abs(), dim=1)
+
+
+@pytest.mark.parametrize("template", ["FLUX.1", "Wan", "Qwen-Image", "Z-Image"])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16, torch.float16])
+def test_fetch_timestep_id_matches_argmin(template, dtype):
+    scheduler = FlowMatchScheduler(template)
+    scheduler.set_timesteps(1000, training=True)
+    timestep = scheduler.timesteps.to(dtype)
+    assert torch.equal(scheduler.fetch_timestep_id(timestep), baseline_timestep_id(scheduler, timestep))
+    # Timesteps between the scheduler timesteps
+    timestep = torch.linspace(0, 1000, 10007).to(dtype)
+    assert torch.equal(scheduler.fetch_timestep_id(timestep), baseline_timestep_id(scheduler, timestep))
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_training_lookups_match_argmin(dtype):
+    scheduler = FlowMatchScheduler("Wan")
+    scheduler.set_timesteps(1000, training=True)
+    timestep = scheduler.timesteps.to(dtype)
+    sample = torch.zeros((len(timestep), 4), dtype=dtype)
+    timestep_id = baseline_timestep_id(scheduler, timestep)
+    sigma = scheduler.fetch_sigma("sigmas", timestep, sample)
+    assert torch.equal(sigma.flatten(), scheduler.sigmas[timestep_id].to(dtype))
+    assert torch.equal(scheduler.training_weight(timestep), scheduler.linear_timesteps_weights[timestep_id])
+
+
+def test_progress_id_matches_timestep_lookup():
+    scheduler = FlowMatchScheduler("Wan")
+    scheduler.set_timesteps(50)
+    original_samples = torch.randn((1, 16, 4, 8, 8), dtype=torch.bfloat16)
+    noise = torch.randn_like(original_samples)
+    for progress_id, timestep in enumerate(scheduler.timesteps):
+        sigma = scheduler.sigmas[progress_id]
+        expected = (1 - sigma) * original_samples + sigma * noise
+        assert torch.equal(scheduler.add_noise(original_samples, noise, timestep, progress_id=progress_id), expected)
+        assert torch.equal(scheduler.add_noise(original_samples, noise, timestep), expected)
+        sigma_ = scheduler.sigmas[progress_id + 1] if progress_id + 1 < len(scheduler.timesteps) else 0
+        expected = original_samples + noise * (sigma_ - sigma)
+        assert torch.equal(scheduler.step(noise, timestep, original_samples, progress_id=progress_id), expected)
+        assert torch.equal(scheduler.step(noise, timestep, original_samples), expected)
+        expected = (original_samples - noise) / sigma
+        assert torch.equal(scheduler.return_to_timestep(timestep, original_samples, noise, progress_id=progress_id), expected)
@@ -0,0 +1,101 @@
+import torch
+from diffsynth.core.vram import enable_vram_management, AutoWrappedLinear, LoRAAdapterSelection
+from diffsynth.diffusion.base_pipeline import BasePipeline
+
+
+VRAM_CONFIG = dict(
+    offload_dtype=torch.float64, offload_device="cpu",
+    onload_dtype=torch.float64, onload_device="cpu",
+    preparing_dtype=torch.float64, preparing_device="cpu",
+    computation_dtype=torch.float64, computation_device="cpu",
+)
+
+
+def build_layer(adapters):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(16, 12).double())
+    model = enable_vram_management(model, {torch.nn.Linear: AutoWrappedLinear}, VRAM_CONFIG)
+    layer = model[0]
+    for name, (lora_A, lora_B, scale) in adapters.items():
+        layer.add_lora_adapter(name, lora_A, lora_B, scale=scale)
+    return layer
+
+
+def build_adapters():
+    torch.manual_seed(1)
+    return {
+        "style": (torch.randn(4, 16, dtype=torch.float64), torch.randn(12, 4, dtype=torch.float64), 0.5),
+        "character": (torch.randn(2, 16, dtype=torch.float64), torch.randn(12, 2, dtype=torch.float64), 1.5),
+        "detail": (torch.randn(8, 16, dtype=torch.float64), torch.randn(12, 8, dtype=torch.float64), -1.0),
+    }
+
+
+def per_adapter_forward(layer, x, adapters, names):
+    # The loop over the adapters, one pair of GEMMs per adapter.
+    out = torch.nn.functional.linear(x, layer.weight, layer.bias)
+    for name in names:
+        lora_A, lora_B, scale = adapters[name]
+        out = out + scale * (x @ lora_A.T @ lora_B.T)
+    return out
+
+
+def test_stacked_lora_matches_per_adapter_loop():
+    adapters = build_adapters()
+    layer = build_layer(adapters)
+    x = torch.randn(3, 5, 16, dtype=torch.float64)
+    torch.testing.assert_close(layer(x), per_adapter_forward(layer, x, adapters, adapters))
+
+
+def test_stacked_lora_is_rebuilt_after_changes():
+    adapters = build_adapters()
+    layer = build_layer(adapters)
+    x = torch.randn(3, 5, 16, dtype=torch.float64)
+    layer(x)
+    layer.set_lora_adapter_scale("style", 2.0)
+    adapters["style"] = (*adapters["style"][:2], 2.0)
+    torch.testing.assert_close(layer(x), per_adapter_forward(layer, x, adapters, adapters))
+    layer.remove_lora_adapter("character")
+    torch.testing.assert_close(layer(x), per_adapter_forward(layer, x, adapters, ["style", "detail"]))
+
+
+def test_lora_adapter_selection_per_row():
+    adapters = build_adapters()
+    layer = build_layer(adapters)
+    x = torch.randn(4, 5, 16, dtype=torch.float64)
+    rows = [["style"], ["style", "character"], [], None]
+    with LoRAAdapterSelection(rows):
+        out = layer(x)
+    for i, row in enumerate(rows):
+        names = adapters if row is None else row
+        torch.testing.assert_close(out[i:i + 1], per_adapter_forward(layer, x[i:i + 1], adapters, names))
+    # A single entry is broadcast to the whole batch, and the selection ends with the context.
+    with LoRAAdapterSelection([["detail"]]):
+        torch.testing.assert_close(layer(x), per_adapter_forward(layer, x, adapters, ["detail"]))
+    torch.testing.assert_close(layer(x), per_adapter_forward(layer, x, adapters, adapters))
+
+
+def test_positive_only_lora_excluded_from_negative_side():
+    adapters = build_adapters()
+    pipe = BasePipeline(device="cpu", torch_dtype=torch.float64)
+    torch.manual_seed(0)
+    pipe.dit = enable_vram_management(torch.nn.Sequential(torch.nn.Linear(16, 12).double()), {torch.nn.Linear: AutoWrappedLinear}, VRAM_CONFIG)
+    layer = pipe.dit[0]
+    pipe.load_lora(pipe.dit, state_dict={"0.lora_A.weight": adapters["style"][0], "0.lora_B.weight": adapters["style"][1]}, alpha=adapters["style"][2], hotload=True, verbose=0, adapter_name="style")
+    positive_only_lora = {"0.lora_A.weight": adapters["character"][0], "0.lora_B.weight": adapters["character"][1]}
+    x = torch.randn(2, 5, 16, dtype=torch.float64)
+    model_fn = lambda x, **kwargs: pipe.dit(x)
+    inputs_shared = {"positive_only_lora": positive_only_lora}
+    # With cfg_scale = 2, the prediction is 2 * posi - nega.
+    adapters["character"] = (*adapters["character"][:2], 1.0)
+    noise_pred = pipe.cfg_guided_model_fn(model_fn, 2.0, inputs_shared, {"x": x}, {"x": x})
+    expected = 2 * per_adapter_forward(layer, x, adapters, ["style", "character"]) - per_adapter_forward(layer, x, adapters, ["style"])
+    torch.testing.assert_close(noise_pred, expected)
+    # An adapter loaded later is used by the negative side as well.
+    pipe.load_lora(pipe.dit, state_dict={"0.lora_A.weight": adapters["detail"][0], "0.lora_B.weight": adapters["detail"][1]}, alpha=adapters["detail"][2], hotload=True, verbose=0, adapter_name="detail")
+    noise_pred = pipe.cfg_guided_model_fn(model_fn, 2.0, inputs_shared, {"x": x}, {"x": x})
+    expected = 2 * per_adapter_forward(layer, x, adapters, ["style", "character", "detail"]) - per_adapter_forward(layer, x, adapters, ["style", "detail"])
+    torch.testing.assert_close(noise_pred, expected)
+    pipe.remove_lora("style", verbose=0)
+    noise_pred = pipe.cfg_guided_model_fn(model_fn, 2.0, inputs_shared, {"x": x}, {"x": x})
+    expected = 2 * per_adapter_forward(layer, x, adapters, ["character", "detail"]) - per_adapter_forward(layer, x, adapters, ["detail"])
+    torch.testing.assert_close(noise_pred, expected)
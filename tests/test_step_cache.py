@@ -0,0 +1,104 @@
+import numpy as np
+import torch
+from diffsynth.diffusion.step_cache import StepCache, BUILTIN_STEP_CACHE_CONFIGS
+
+
+class LegacyTeaCache:
+    # The TeaCache of the Wan pipeline before StepCache.
+    def __init__(self, num_inference_steps, rel_l1_thresh, coefficients):
+        self.num_inference_steps = num_inference_steps
+        self.step = 0
+        self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = None
+        self.rel_l1_thresh = rel_l1_thresh
+        self.previous_residual = None
+        self.previous_hidden_states = None
+        self.coefficients = coefficients
+
+    def check(self, x, t_mod):
+        modulated_inp = t_mod.clone()
+        if self.step == 0 or self.step == self.num_inference_steps - 1:
+            should_calc = True
+            self.accumulated_rel_l1_distance = 0
+        else:
+            rescale_func = np.poly1d(self.coefficients)
+            self.accumulated_rel_l1_distance += rescale_func(((modulated_inp-self.previous_modulated_input).abs().mean() / self.previous_modulated_input.abs().mean()).cpu().item())
+            if self.accumulated_rel_l1_distance < self.rel_l1_thresh:
+                should_calc = False
+            else:
+                should_calc = True
+                self.accumulated_rel_l1_distance = 0
+        self.previous_modulated_input = modulated_inp
+        self.step += 1
+        if self.step == self.num_inference_steps:
+            self.step = 0
+        if should_calc:
+            self.previous_hidden_states = x.clone()
+        return not should_calc
+
+    def store(self, hidden_states):
+        self.previous_residual = hidden_states - self.previous_hidden_states
+        self.previous_hidden_states = None
+
+    def update(self, hidden_states):
+        return hidden_states + self.previous_residual
+
+
+def blocks(x, t_mod):
+    return torch.tanh(x * 0.9 + t_mod.mean())
+
+
+def denoise(cache, t_mods, x):
+    # Mirrors the step cache calls in `model_fn_wan_video`.
+    skipped, outputs = [], []
+    for t_mod in t_mods:
+        if cache.check(x, t_mod):
+            y = cache.update(x)
+            skipped.append(True)
+        else:
+            y = blocks(x, t_mod)
+            cache.store(y)
+            skipped.append(False)
+        outputs.append(y)
+        x = x + 0.1 * y
+    return skipped, outputs
+
+
+def build_modulated_inputs(num_inference_steps, seed):
+    generator = torch.Generator().manual_seed(seed)
+    t_mod = torch.randn((1, 6, 64), generator=generator)
+    t_mods = []
+    for step_id in range(num_inference_steps):
+        # Alternate small and large changes so that some steps are skipped and some are not.
+        scale = 0.002 if step_id % 3 else 0.05
+        t_mod = t_mod + scale * torch.randn(t_mod.shape, generator=generator)
+        t_mods.append(t_mod)
+    return t_mods
+
+
+def test_step_cache_teacache_matches_legacy_teacache():
+    num_inference_steps = 20
+    for model_id in ["Wan2.1-T2V-1.3B", "Wan2.1-T2V-14B", "Wan2.1-I2V-14B-480P", "Wan2.1-I2V-14B-720P"]:
+        for thresh in [0.05, 0.1, 0.2]:
+            coefficients = BUILTIN_STEP_CACHE_CONFIGS[model_id]["coefficients"]
+            legacy = LegacyTeaCache(num_inference_steps, thresh, coefficients)
+            step_cache = StepCache(num_inference_steps, policy="teacache", thresh=thresh, model_id=model_id)
+            # Two generations, so that the wrap-around of the step counter is covered.
+            for seed in range(2):
+                t_mods = build_modulated_inputs(num_inference_steps, seed)
+                x = torch.randn((1, 8, 64), generator=torch.Generator().manual_seed(seed))
+                legacy_skipped, legacy_outputs = denoise(legacy, t_mods, x)
+                skipped, outputs = denoise(step_cache, t_mods, x)
+                assert skipped == legacy_skipped, (model_id, thresh, seed)
+                for output, legacy_output in zip(outputs, legacy_outputs):
+                    torch.testing.assert_close(output, legacy_output, rtol=0, atol=0)
+
+
+def test_step_cache_teacache_skips_steps():
+    # Guards the test above against a sequence in which nothing is skipped.
+    num_inference_steps = 20
+    step_cache = StepCache(num_inference_steps, policy="teacache", thresh=0.2, model_id="Wan2.1-T2V-1.3B")
+    t_mods = build_modulated_inputs(num_inference_steps, 0)
+    skipped, _ = denoise(step_cache, t_mods, torch.randn((1, 8, 64)))
+    assert any(skipped)
+    assert not skipped[0] and not skipped[-1]
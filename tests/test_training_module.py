@@ -0,0 +1,23 @@
+import pytest
+import torch
+from diffsynth.diffusion.training_module import DiffusionTrainingModule
+
+
+def test_collate_pipeline_inputs():
+    module = DiffusionTrainingModule()
+    batch = [
+        {"latents": torch.full((1, 4), float(i)), "prompt_emb": [torch.ones(3, 2) * i], "height": 480, "prompt": f"prompt {i}"}
+        for i in range(3)
+    ]
+    inputs = module.collate_pipeline_inputs(batch)
+    torch.testing.assert_close(inputs["latents"], torch.arange(3, dtype=torch.float32)[:, None].repeat(1, 4))
+    assert len(inputs["prompt_emb"]) == 3
+    assert inputs["height"] == 480
+    # Inputs that differ between the samples are kept per sample instead of taking the first one.
+    assert inputs["prompt"] == ["prompt 0", "prompt 1", "prompt 2"]
+
+
+def test_collate_pipeline_inputs_shape_mismatch():
+    module = DiffusionTrainingModule()
+    with pytest.raises(ValueError, match="latents"):
+        module.collate_pipeline_inputs([{"latents": torch.zeros(1, 4)}, {"latents": torch.zeros(1, 5)}])
@@ -0,0 +1,53 @@
+import pytest
+import torch
+from einops import rearrange
+from diffsynth.models.wan_video_dit import rope_apply, precompute_freqs_cis_3d, WanRotaryEmbedding
+
+
+def baseline_rope_apply(x, freqs, num_heads):
+    # The complex float64 implementation.
+    x = rearrange(x, "b s (n d) -> b s n d", n=num_heads)
+    x_out = torch.view_as_complex(x.to(torch.float64).reshape(x.shape[0], x.shape[1], x.shape[2], -1, 2))
+    x_out = torch.view_as_real(x_out * freqs).flatten(2)
+    return x_out.to(x.dtype)
+
+
+def baseline_freqs(freqs, f, h, w, f_start=0):
+    return torch.cat([
+        freqs[0][f_start:f_start + f].view(f, 1, 1, -1).expand(f, h, w, -1),
+        freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
+        freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1),
+    ], dim=-1).reshape(f * h * w, 1, -1)
+
+
+@pytest.mark.parametrize("f_start", [0, 3])
+def test_rotary_embedding_matches_complex_freqs(f_start):
+    head_dim, (f, h, w) = 128, (3, 4, 5)
+    cos, sin = WanRotaryEmbedding(head_dim)(f, h, w, f_start=f_start)
+    freqs = baseline_freqs(precompute_freqs_cis_3d(head_dim), f, h, w, f_start=f_start)
+    torch.testing.assert_close(cos, freqs.real.float())
+    torch.testing.assert_close(sin, freqs.imag.float())
+
+
+@pytest.mark.parametrize("grad_enabled", [True, False])
+def test_rope_apply_matches_complex_baseline(grad_enabled):
+    num_heads, head_dim, (f, h, w) = 4, 128, (3, 4, 5)
+    torch.manual_seed(0)
+    x = torch.randn(2, f * h * w, num_heads * head_dim)
+    freqs = baseline_freqs(precompute_freqs_cis_3d(head_dim), f, h, w)
+    expected = baseline_rope_apply(x, freqs, num_heads)
+    with torch.set_grad_enabled(grad_enabled):
+        torch.testing.assert_close(rope_apply(x, WanRotaryEmbedding(head_dim)(f, h, w), num_heads), expected)
+        # Complex freqs are still accepted.
+        torch.testing.assert_close(rope_apply(x, freqs, num_heads), expected)
+
+
+def test_rope_apply_bfloat16_within_one_ulp():
+    num_heads, head_dim, (f, h, w) = 4, 128, (3, 4, 5)
+    torch.manual_seed(0)
+    x = torch.randn(2, f * h * w, num_heads * head_dim).bfloat16()
+    freqs = baseline_freqs(precompute_freqs_cis_3d(head_dim), f, h, w)
+    out = rope_apply(x, WanRotaryEmbedding(head_dim)(f, h, w), num_heads).float()
+    expected = baseline_rope_apply(x, freqs, num_heads).float()
+    # One bfloat16 ulp is 2 ** -7 relative to the magnitude.
+    assert ((out - expected).abs() <= expected.abs() * 2 ** -7 + 1e-6).all()
@@ -0,0 +1,84 @@
+import torch
+from diffsynth.models.wan_video_vae import WanVideoVAE, VideoVAE_, WanVideoVAE38, VideoVAE38_, unpatchify
+
+
+def build_vae():
+    # A narrow VAE with random weights, so that the test runs on CPU in seconds.
+    torch.manual_seed(0)
+    vae = WanVideoVAE()
+    vae.model = VideoVAE_(dim=16, z_dim=16).eval().requires_grad_(False)
+    for param in vae.parameters():
+        param.data.normal_(0, 0.1)
+    return vae
+
+
+@torch.no_grad()
+def test_batched_tiled_decode_matches_tiled_decode():
+    vae = build_vae()
+    z = torch.randn((1, 16, 3, 12, 12))
+    video = vae.decode(z, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4))
+    for tile_batch_size in [2, 4, None]:
+        video_batched = vae.decode(z, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4), tile_batch_size=tile_batch_size)
+        torch.testing.assert_close(video_batched, video)
+
+
+@torch.no_grad()
+def test_batched_tiled_encode_matches_tiled_encode():
+    vae = build_vae()
+    video = torch.rand((1, 3, 5, 96, 96)) * 2 - 1
+    latents = vae.encode(video, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4))
+    for tile_batch_size in [2, None]:
+        latents_batched = vae.encode(video, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4), tile_batch_size=tile_batch_size)
+        torch.testing.assert_close(latents_batched, latents)
+
+
+def reference_decode(model, z, scale, first_chunk=None):
+    # The Wan VAE decoder before streaming: all latent frames are decoded with the cache of the model and concatenated.
+    model.clear_cache()
+    z = model.unscale_latents(z, scale)
+    x = model.conv2(z)
+    outputs = []
+    for i in range(z.shape[2]):
+        model._conv_idx = [0]
+        kwargs = {} if first_chunk is None else {"first_chunk": i == 0}
+        outputs.append(model.decoder(x[:, :, i:i + 1], feat_cache=model._feat_map, feat_idx=model._conv_idx, **kwargs))
+    return torch.cat(outputs, 2)
+
+
+def build_vae38():
+    torch.manual_seed(0)
+    vae = WanVideoVAE38()
+    vae.model = VideoVAE38_(dim=16, dec_dim=16, z_dim=48).eval().requires_grad_(False)
+    for param in vae.parameters():
+        param.data.normal_(0, 0.1)
+    return vae
+
+
+@torch.no_grad()
+def test_decode_stream_matches_reference_decode():
+    vae = build_vae()
+    z = torch.randn((1, 16, 3, 12, 12))
+    chunks = list(vae.model.decode_stream(z, vae.scale))
+    assert [chunk.shape[2] for chunk in chunks] == [1, 4, 4]
+    torch.testing.assert_close(torch.cat(chunks, 2), reference_decode(vae.model, z, vae.scale), rtol=0, atol=0)
+
+    vae = build_vae38()
+    z = torch.randn((1, 48, 3, 6, 6))
+    chunks = list(vae.model.decode_stream(z, vae.scale))
+    reference = unpatchify(reference_decode(vae.model, z, vae.scale, first_chunk=True), patch_size=2)
+    torch.testing.assert_close(torch.cat(chunks, 2), reference, rtol=0, atol=0)
+
+
+@torch.no_grad()
+def test_tiled_decode_stream_matches_tiled_decode():
+    vae = build_vae()
+    z = torch.randn((1, 16, 3, 12, 12))
+    video = torch.cat(list(vae.decode_stream(z, device="cpu")), dim=2)
+    torch.testing.assert_close(video, reference_decode(vae.model, z, vae.scale).clamp(-1, 1), rtol=0, atol=0)
+    # The tiled decoding before streaming decodes each tile by the reference decoder.
+    vae.model.decode = lambda z, scale: reference_decode(vae.model, z, scale)
+    video = vae.decode(z, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4))
+    for tile_batch_size, offload_cache in [(1, False), (4, False), (1, True)]:
+        chunks = list(vae.decode_stream(z, device="cpu", tiled=True, tile_size=(8, 8), tile_stride=(4, 4), tile_batch_size=tile_batch_size, offload_cache=offload_cache))
+        assert [chunk.shape[2] for chunk in chunks] == [1, 4, 4]
+        torch.testing.assert_close(torch.cat(chunks, dim=2), video)